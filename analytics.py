@@ -0,0 +1,186 @@
+import os
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime, timedelta
+
+import numpy as np
+import pandas as pd
+import tzlocal
+
+import db
+import reports
+
+# Аналитика по затраченному времени: время выполнения (создана -> закрыта) в перцентилях,
+# сколько задач закрывается по дням, распределение трудозатрат и возраст открытых задач.
+#
+# Таблица читается один раз, пачками по CHUNK_SIZE строк и только нужные столбцы; каждая пачка
+# обрабатывается векторно (NumPy), в памяти копятся только гистограммы и времена выполнения
+# закрытых задач (8 байт на задачу — для точных перцентилей).
+# Результат кэшируется по версии данных (db.data_version) и дате: пока в задачах ничего
+# не менялось, повторный запрос ничего не считает.
+
+CHUNK_SIZE = 100000
+
+DEFAULT_DAYS = 30
+MAX_DAYS = 365
+
+LEAD_TIME_PERCENTILES = (50, 75, 90, 95, 99)
+# Границы корзин трудозатрат, часы (последняя корзина — от 40 ч и больше)
+TIME_SPENT_EDGES = (0, 0.5, 1, 2, 4, 8, 16, 40)
+# Границы корзин возраста открытых задач, дни
+BACKLOG_AGE_EDGES = (0, 1, 3, 7, 30, 90)
+
+# Даты — по часовому поясу сервера, как и везде в интерфейсах
+LOCAL_TZ = tzlocal.get_localzone_name()
+
+QUERY = 'SELECT created_at, closed_at, time_spent, is_closed FROM tasks_all'
+
+CACHE_ENTRIES = 64
+
+
+def _histogram_edges(edges):
+    return np.array(edges + (np.inf,), dtype=float)
+
+def _buckets(edges, counts):
+    return [
+        {'from': low, 'to': edges[i + 1] if i + 1 < len(edges) else None, 'count': int(count)}
+        for i, (low, count) in enumerate(zip(edges, counts))
+    ]
+
+# Полночь (по времени сервера) первого дня окна из days дней, заканчивающегося сегодня
+def _window_start(days, now):
+    today = datetime.fromtimestamp(now).replace(hour=0, minute=0, second=0, microsecond=0)
+    return today - timedelta(days=days - 1)
+
+# Посчитать аналитику по всем задачам (или задачам чата chat_id). days — окно для закрытий по дням
+def compute(conn, chat_id=None, days=DEFAULT_DAYS, now=None):
+    now = now or int(time.time())
+    first_day = _window_start(days, now)
+    window_from = int(first_day.timestamp())
+    first_day = np.datetime64(first_day.date(), 'D')
+
+    time_spent_edges = _histogram_edges(TIME_SPENT_EDGES)
+    age_edges = _histogram_edges(BACKLOG_AGE_EDGES) * 86400
+    time_spent_counts = np.zeros(len(TIME_SPENT_EDGES), dtype=np.int64)
+    age_counts = np.zeros(len(BACKLOG_AGE_EDGES), dtype=np.int64)
+    daily = np.zeros(days, dtype=np.int64)
+    lead_times = []
+    total = closed = 0
+    hours_sum = 0.0
+
+    query, params = QUERY, ()
+    if chat_id is not None:
+        query, params = f'{QUERY} WHERE chat_id = ?', (chat_id,)
+
+    for chunk in pd.read_sql_query(query, conn, params=params, chunksize=CHUNK_SIZE):
+        created_at = chunk['created_at'].to_numpy(dtype=float)
+        closed_at = chunk['closed_at'].to_numpy(dtype=float)
+        time_spent = chunk['time_spent'].to_numpy(dtype=float)
+        is_closed = chunk['is_closed'].to_numpy() == 1
+        total += len(chunk)
+        closed += int(is_closed.sum())
+
+        finished = is_closed & ~np.isnan(closed_at)
+        lead_times.append(np.maximum(closed_at[finished] - created_at[finished], 0))
+
+        spent = time_spent[is_closed & ~np.isnan(time_spent)]
+        time_spent_counts += np.histogram(spent, bins=time_spent_edges)[0]
+        hours_sum += float(spent.sum())
+
+        age_counts += np.histogram(now - created_at[~is_closed], bins=age_edges)[0]
+
+        recent = closed_at[finished & (closed_at >= window_from)]
+        if len(recent):
+            dates = pd.to_datetime(recent, unit='s', utc=True).tz_convert(LOCAL_TZ).tz_localize(None)
+            offsets = (dates.values.astype('datetime64[D]') - first_day).astype(np.int64)
+            offsets = offsets[(offsets >= 0) & (offsets < days)]
+            daily += np.bincount(offsets, minlength=days)
+
+    lead_times = np.concatenate(lead_times) if lead_times else np.empty(0)
+    lead_hours = None
+    if len(lead_times):
+        values = np.percentile(lead_times, LEAD_TIME_PERCENTILES) / 3600
+        lead_hours = {f'p{p}': round(float(v), 2) for p, v in zip(LEAD_TIME_PERCENTILES, values)}
+        lead_hours['mean'] = round(float(lead_times.mean()) / 3600, 2)
+
+    return {
+        'generated_at': now,
+        'tasks': total,
+        'open': total - closed,
+        'closed': closed,
+        'lead_time_hours': lead_hours,
+        'throughput': [
+            {'date': str(first_day + i), 'closed': int(count)} for i, count in enumerate(daily)
+        ],
+        'time_spent_hours': _buckets(TIME_SPENT_EDGES, time_spent_counts),
+        'time_spent_total': round(hours_sum, 2),
+        'backlog_age_days': _buckets(BACKLOG_AGE_EDGES, age_counts),
+    }
+
+
+_cache = OrderedDict()
+_cache_lock = threading.Lock()
+
+# Аналитика из кэша или посчитанная заново. Своё соединение: считается в фоновом потоке
+# (бот) или в потоке запроса (веб)
+def get(path=db.DATABASE, chat_id=None, days=DEFAULT_DAYS):
+    conn = db.connect(path)
+    try:
+        version = db.data_version(conn)
+        key = (os.path.abspath(path), version, datetime.now().date(), chat_id, days)
+        with _cache_lock:
+            result = _cache.get(key)
+            if result is not None:
+                _cache.move_to_end(key)
+                return result
+        result = compute(conn, chat_id, days)
+    finally:
+        conn.close()
+
+    result['data_version'] = version
+    with _cache_lock:
+        _cache[key] = result
+        while len(_cache) > CACHE_ENTRIES:
+            _cache.popitem(last=False)
+    return result
+
+
+def _duration(hours):
+    return reports.format_age(int(hours * 3600)) if hours >= 1 else f"{round(hours * 60)} мин."
+
+def _bucket_label(bucket, unit):
+    if bucket['to'] is None:
+        return f"от {bucket['from']:g} {unit}"
+    return f"{bucket['from']:g}–{bucket['to']:g} {unit}"
+
+# Текст для бота
+def render_text(result, week=7):
+    lines = [
+        f"📈 АНАЛИТИКА ЗА {len(result['throughput'])} ДН.",
+        f"Задач: {result['tasks']} (открыто {result['open']}, закрыто {result['closed']})",
+    ]
+
+    lead = result['lead_time_hours']
+    if lead:
+        lines += [
+            "",
+            "⏱️ Время выполнения (создана → закрыта):",
+            f"медиана {_duration(lead['p50'])}, p90 {_duration(lead['p90'])}, p99 {_duration(lead['p99'])}",
+        ]
+
+    closed = [day['closed'] for day in result['throughput']]
+    lines += [
+        "",
+        f"✅ Закрыто за период: {sum(closed)}, в среднем {sum(closed) / len(closed):.1f} в день",
+        "за последние дни: " + " · ".join(str(count) for count in closed[-week:]),
+    ]
+
+    if result['closed']:
+        lines += ["", f"🕒 Трудозатраты (всего {result['time_spent_total']:g} ч.):"]
+        lines += [f"{_bucket_label(b, 'ч.')}: {b['count']}" for b in result['time_spent_hours'] if b['count']]
+
+    if result['open']:
+        lines += ["", "⏳ Возраст открытых задач:"]
+        lines += [f"{_bucket_label(b, 'дн.')}: {b['count']}" for b in result['backlog_age_days'] if b['count']]
+    return "\n".join(lines)
@@ -0,0 +1 @@
+# Инструменты для нагрузочного тестирования бота и веб-интерфейса
@@ -0,0 +1,169 @@
+import json
+import random
+import time
+from collections import Counter
+
+from telegram import Update
+from telegram.request import BaseRequest
+
+from bench import datagen
+from bench.measure import peak_rss_kb, reset_peak_rss, scenario_result
+
+# Бенчмарк обработчиков бота: настоящий Application из main.build_application(),
+# но вместо Bot API — заглушка, которая только записывает вызовы. Меряется время
+# от передачи апдейта в Application до завершения обработчика (для сценариев из нескольких
+# апдейтов — всего сценария).
+
+BOT_USER = {'id': 1, 'is_bot': True, 'first_name': 'BenchBot', 'username': 'bench_bot'}
+SEARCH_WORDS = ['отчёт', 'принтер', 'договор', 'склад', 'клиента', 'инвентаризацию', 'бэкап']
+
+
+# HTTP-клиент Bot API, который ничего не отправляет: считает методы и отвечает правдоподобным результатом
+class StubRequest(BaseRequest):
+    def __init__(self):
+        self.calls = Counter()
+        self.message_ids = iter(range(1, 10 ** 9))
+
+    async def initialize(self):
+        pass
+
+    async def shutdown(self):
+        pass
+
+    async def do_request(self, url, method, request_data=None, read_timeout=None, write_timeout=None,
+                         connect_timeout=None, pool_timeout=None):
+        name = url.rsplit('/', 1)[-1]
+        params = request_data.parameters if request_data else {}
+        self.calls[name] += 1
+
+        if name == 'getMe':
+            result = BOT_USER
+        elif name in ('sendMessage', 'editMessageText', 'sendDocument'):
+            result = {
+                'message_id': next(self.message_ids),
+                'date': int(time.time()),
+                'chat': {'id': params.get('chat_id', 0), 'type': 'private'},
+                'text': params.get('text', ''),
+            }
+        else:
+            result = True
+        return 200, json.dumps({'ok': True, 'result': result}).encode()
+
+
+# Генератор апдейтов в формате Bot API
+class Updates:
+    def __init__(self, bot, seed):
+        self.bot = bot
+        self.rng = random.Random(seed)
+        self.ids = iter(range(1, 10 ** 9))
+
+    def chat(self):
+        return datagen.CHAT_BASE + self.rng.randrange(datagen.CHATS)
+
+    def message(self, chat_id, text):
+        data = {
+            'message_id': next(self.ids),
+            'date': int(time.time()),
+            'chat': {'id': chat_id, 'type': 'private'},
+            'from': {'id': chat_id, 'is_bot': False, 'first_name': 'Bench'},
+            'text': text,
+        }
+        if text.startswith('/'):
+            data['entities'] = [{'type': 'bot_command', 'offset': 0, 'length': len(text.split()[0])}]
+        return Update.de_json({'update_id': next(self.ids), 'message': data}, self.bot)
+
+    def callback(self, chat_id, data):
+        return Update.de_json({'update_id': next(self.ids), 'callback_query': {
+            'id': str(next(self.ids)),
+            'chat_instance': 'bench',
+            'data': data,
+            'from': {'id': chat_id, 'is_bot': False, 'first_name': 'Bench'},
+            'message': {'message_id': 1, 'date': int(time.time()), 'chat': {'id': chat_id, 'type': 'private'}, 'text': '-'},
+        }}, self.bot)
+
+
+# Идентификаторы для сценариев берём из базы заранее, вне замеров.
+# Задачи чатов распределены по остатку id (см. datagen.chat_of), так что задачу нужного чата
+# можно выбрать без запроса
+class TaskIds:
+    def __init__(self, conn, rng):
+        self.conn = conn
+        self.rng = rng
+        self.max_id = conn.execute('SELECT COALESCE(MAX(id), 0) FROM tasks').fetchone()[0]
+
+    def any(self, chat):
+        task_id = self.rng.randint(1, max(self.max_id, 1))
+        task_id += (chat - datagen.chat_of(task_id)) % datagen.CHATS
+        return task_id if task_id <= self.max_id else task_id - datagen.CHATS
+
+    # Случайная открытая задача чата (ближайшая открытая с id не меньше случайного)
+    def open(self, chat):
+        row = self.conn.execute(
+            'SELECT id FROM tasks WHERE chat_id = ? AND is_closed = 0 AND id >= ? ORDER BY id LIMIT 1', (chat, self.any(chat))
+        ).fetchone()
+        return row[0] if row else self.any(chat)
+
+
+# Сценарий: имя и функция, строящая список апдейтов одного прогона.
+# Изменяющие базу сценарии идут последними, чтобы не влиять на читающие
+SCENARIOS = [
+    ('start', lambda u, ids, chat: [u.message(chat, '/start')]),
+    ('list_open_first_page', lambda u, ids, chat: [u.message(chat, '📋 Показать все'), u.callback(chat, 'filter_open')]),
+    ('list_all_deep_page', lambda u, ids, chat: [u.callback(chat, f'pg_a_o_{ids.any(chat)}')]),
+    ('list_closed_deep_page', lambda u, ids, chat: [u.callback(chat, f'pg_c_o_{ids.any(chat)}')]),
+    ('close_picker', lambda u, ids, chat: [u.message(chat, '✅ Закрыть задачу')]),
+    ('search', lambda u, ids, chat: [u.message(chat, f'/search {u.rng.choice(SEARCH_WORDS)}')]),
+    ('add_task', lambda u, ids, chat: [u.message(chat, '➕ Добавить задачу'), u.message(chat, f'Нагрузка {u.rng.randrange(10 ** 6)}')]),
+    ('close_task', lambda u, ids, chat: [u.callback(chat, f'close_{ids.open(chat)}'), u.message(chat, '1.5')]),
+    ('edit_task', lambda u, ids, chat: [u.callback(chat, f'edit_{ids.any(chat)}'), u.message(chat, f'Правка {u.rng.randrange(10 ** 6)}')]),
+    ('delete_task', lambda u, ids, chat: [u.message(chat, '🗑️ Удалить задачу'), u.message(chat, str(ids.any(chat)))]),
+]
+
+async def run(path, iterations, seed=1, only=None):
+    # main импортируется здесь: к этому моменту TASKS_DB уже указывает на рабочую копию базы
+    import db
+    import main
+
+    request = StubRequest()
+    application = main.build_application(request=request, get_updates_request=StubRequest())
+    errors = Counter()
+
+    async def count_error(update, context):
+        errors[type(context.error).__name__] += 1
+
+    application.add_error_handler(count_error)
+    await application.initialize()
+
+    conn = db.connect(path)
+    updates = Updates(application.bot, seed)
+    ids = TaskIds(conn, updates.rng)
+    results = {}
+    try:
+        for name, make in SCENARIOS:
+            if only and name not in only:
+                continue
+            flows = [make(updates, ids, updates.chat()) for _ in range(iterations)]
+
+            request.calls.clear()
+            errors.clear()
+            reset_peak_rss()
+            samples = []
+            started = time.perf_counter()
+            for flow in flows:
+                begin = time.perf_counter()
+                for update in flow:
+                    await application.process_update(update)
+                samples.append(time.perf_counter() - begin)
+            elapsed = time.perf_counter() - started
+
+            results[name] = scenario_result(
+                samples, elapsed, peak_rss_kb(),
+                updates=sum(len(flow) for flow in flows),
+                api_calls=dict(request.calls),
+                errors=dict(errors),
+            )
+    finally:
+        conn.close()
+        await application.shutdown()
+        await main.post_shutdown(application)
+    return results
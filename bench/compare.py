@@ -0,0 +1,75 @@
+import argparse
+import json
+import sys
+
+# Сравнение двух результатов bench.run: по каждому сценарию p50/p99 и пропускная способность
+# "было -> стало" с изменением в процентах.
+#
+#   python -m bench.compare bench/results/old.json bench/results/new.json
+#   python -m bench.compare old.json new.json --fail-above 20   — код 1, если p50 где-то вырос больше чем на 20%
+
+def load(path):
+    with open(path, encoding='utf-8') as f:
+        return json.load(f)
+
+def change(old, new):
+    if not old or new is None:
+        return None
+    return (new - old) / old * 100
+
+def fmt(value, unit=''):
+    return '—' if value is None else f'{value:g}{unit}'
+
+def fmt_change(value):
+    return '' if value is None else f'{value:+.1f}%'
+
+def compare(old, new):
+    rows = []
+    for part in ('bot', 'web'):
+        for name, result in new.get(part, {}).items():
+            before = old.get(part, {}).get(name)
+            if before is None:
+                continue
+            rows.append({
+                'scenario': f'{part}.{name}',
+                'p50': (before['latency_ms']['p50'], result['latency_ms']['p50']),
+                'p99': (before['latency_ms']['p99'], result['latency_ms']['p99']),
+                'throughput': (before['throughput_per_s'], result['throughput_per_s']),
+                'peak_rss_kb': (before['peak_rss_kb'], result['peak_rss_kb']),
+            })
+    return rows
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Сравнить два результата бенчмарка")
+    parser.add_argument('old')
+    parser.add_argument('new')
+    parser.add_argument('--fail-above', type=float, help="вернуть код 1, если p50 вырос больше чем на столько процентов")
+    args = parser.parse_args(argv)
+
+    old, new = load(args.old), load(args.new)
+    if (old.get('rows'), old.get('closed_ratio')) != (new.get('rows'), new.get('closed_ratio')):
+        print(f"⚠️ Разные наборы данных: {old.get('rows')} vs {new.get('rows')} строк", file=sys.stderr)
+    print(f"{(old.get('commit') or '?')[:10]} -> {(new.get('commit') or '?')[:10]}, {new.get('rows')} задач\n")
+
+    header = f"{'сценарий':32} {'p50, мс':>24} {'p99, мс':>24} {'оп/с':>24} {'пик RSS, КБ':>20}"
+    print(header)
+    print('-' * len(header))
+    regressions = []
+    for row in compare(old, new):
+        cells = []
+        for key in ('p50', 'p99', 'throughput', 'peak_rss_kb'):
+            before, after = row[key]
+            cells.append(f"{fmt(before)} -> {fmt(after)} {fmt_change(change(before, after))}")
+        print(f"{row['scenario']:32} {cells[0]:>24} {cells[1]:>24} {cells[2]:>24} {cells[3]:>20}")
+
+        p50_change = change(*row['p50'])
+        if args.fail_above is not None and p50_change is not None and p50_change > args.fail_above:
+            regressions.append(row['scenario'])
+
+    if regressions:
+        print(f"\n❌ p50 вырос больше чем на {args.fail_above}%: {', '.join(regressions)}")
+        return 1
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
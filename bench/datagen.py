@@ -0,0 +1,112 @@
+import argparse
+import math
+import os
+import random
+import time
+
+import db
+import migrations
+
+# Генератор синтетических баз задач для бенчмарков.
+#
+#   python -m bench.datagen --rows 1000000                 — bench/data/tasks-1000000-c85-s1-k50.db
+#   python -m bench.datagen --rows 10000 --closed 0.5 --out /tmp/small.db
+#
+# Схема создаётся миграциями, строки вставляются через обычные триггеры (статистика, поиск),
+# поэтому база ничем не отличается от рабочей. Одинаковые параметры дают одинаковые задачи
+# (время отсчитывается от момента генерации).
+
+DATA_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data')
+
+# Вставляем пачками: одна транзакция на BATCH_SIZE строк
+BATCH_SIZE = 50000
+
+VERBS = ['Сделать', 'Проверить', 'Починить', 'Обновить', 'Подготовить', 'Согласовать', 'Отправить',
+         'Настроить', 'Перенести', 'Разобрать', 'Заказать', 'Оплатить', 'Позвонить', 'Описать']
+OBJECTS = ['отчёт', 'договор', 'счёт', 'поставку', 'склад', 'принтер', 'сервер', 'кнопку подбора',
+           'внутреннее перемещение', 'накладную', 'прайс', 'сайт', 'базу клиентов', 'доставку',
+           'инвентаризацию', 'акт сверки', 'заявку', 'бэкап', 'права доступа', 'расписание']
+DETAILS = ['для клиента', 'по филиалу', 'до пятницы', 'срочно', 'для бухгалтерии', 'после обеда',
+           'на следующую неделю', 'по новому шаблону', 'в 1С', 'вместе с логистами', '', '', '']
+
+# Задачи поровну принадлежат CHATS чатам с id от CHAT_BASE (эти же чаты пишут в сценариях bench.bot)
+CHAT_BASE = 1000
+CHATS = 50
+
+def chat_of(task_id):
+    return CHAT_BASE + task_id % CHATS
+
+def default_path(rows, closed_ratio, seed):
+    # Чаты в имени: базы, сгенерированные до появления владельцев задач, не подхватываются
+    return os.path.join(DATA_DIR, f'tasks-{rows}-c{round(closed_ratio * 100)}-s{seed}-k{CHATS}.db')
+
+INSERT_QUERY = 'INSERT INTO tasks (id, description, created_at, closed_at, time_spent, is_closed, chat_id) VALUES (?, ?, ?, ?, ?, ?, ?)'
+
+# Строки задач в порядке id: время создания растёт вместе с id, закрытые задачи закрыты
+# через экспоненциально распределённый срок, трудозатраты — логнормальные, кратные 0.25 ч.
+def iter_tasks(rows, closed_ratio, days, seed, now):
+    rng = random.Random(seed)
+    start = now - days * 86400
+    step = days * 86400 / max(rows, 1)
+    for task_id in range(1, rows + 1):
+        created_at = int(start + task_id * step)
+        description = f'{rng.choice(VERBS)} {rng.choice(OBJECTS)} {rng.choice(DETAILS)}'.strip()
+        description += f' #{rng.randrange(1, 100000)}'
+        if rng.random() < closed_ratio:
+            closed_at = min(now, created_at + int(rng.expovariate(1 / (3 * 86400))))
+            time_spent = min(200.0, round(rng.lognormvariate(math.log(1.5), 0.9) * 4) / 4 or 0.25)
+            yield task_id, description, created_at, closed_at, time_spent, 1, chat_of(task_id)
+        else:
+            yield task_id, description, created_at, None, None, 0, chat_of(task_id)
+
+def generate(path, rows, closed_ratio=0.85, days=365, seed=1, now=None):
+    now = now or int(time.time())
+    if os.path.exists(path):
+        os.remove(path)
+    migrations.migrate(path)
+
+    conn = db.connect(path)
+    # Генерация одноразовая: надёжность записи не нужна, скорость — да
+    conn.execute('PRAGMA synchronous = OFF')
+    try:
+        tasks = iter_tasks(rows, closed_ratio, days, seed, now)
+        while True:
+            batch = [row for _, row in zip(range(BATCH_SIZE), tasks)]
+            if not batch:
+                break
+            with conn:
+                conn.executemany(INSERT_QUERY, batch)
+        conn.execute("INSERT INTO tasks_fts (tasks_fts) VALUES ('optimize')")
+        conn.commit()
+        conn.execute('PRAGMA wal_checkpoint(TRUNCATE)')
+    finally:
+        conn.close()
+    return path
+
+# Путь к готовой базе с такими параметрами; если её ещё нет — сгенерировать
+def ensure(rows, closed_ratio=0.85, seed=1):
+    path = default_path(rows, closed_ratio, seed)
+    if not os.path.exists(path):
+        os.makedirs(DATA_DIR, exist_ok=True)
+        # Прерванная генерация не должна оставить "готовую" базу
+        generate(path + '.tmp', rows, closed_ratio, seed=seed)
+        os.replace(path + '.tmp', path)
+    return path
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Синтетическая база задач для бенчмарков")
+    parser.add_argument('--rows', type=int, default=100000, help="число задач (10k–10M)")
+    parser.add_argument('--closed', type=float, default=0.85, help="доля закрытых задач")
+    parser.add_argument('--days', type=int, default=365, help="за сколько дней распределены задачи")
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--out', help="куда записать базу (по умолчанию bench/data/...)")
+    args = parser.parse_args(argv)
+
+    path = args.out or default_path(args.rows, args.closed, args.seed)
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    started = time.perf_counter()
+    generate(path, args.rows, args.closed, args.days, args.seed)
+    print(f"✅ {path}: {args.rows} задач за {time.perf_counter() - started:.1f} с")
+
+if __name__ == '__main__':
+    main()
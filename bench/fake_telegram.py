@@ -0,0 +1,305 @@
+import argparse
+import asyncio
+import itertools
+import json
+import logging
+import statistics
+import time
+from collections import Counter, defaultdict, deque
+
+import httpx
+from tornado.web import Application, RequestHandler
+
+logger = logging.getLogger(__name__)
+
+# Локальная замена Bot API для нагрузочных тестов: проигрывает записанные апдейты с заданной скоростью
+# и меряет задержку от выдачи апдейта до первого ответа бота в тот же чат.
+#
+#   python -m bench.fake_telegram --updates updates.jsonl --rate 50
+#   TELEGRAM_API_URL=http://127.0.0.1:8081 BOT_TOKEN=1:fake python main.py
+#
+# Бот в режиме polling забирает апдейты через getUpdates; в режиме webhook (BOT_MODE=webhook)
+# он сам вызывает setWebhook, и сервер начинает присылать апдейты POST-запросами на его адрес.
+# По окончании в stdout печатается JSON со сводкой; она же доступна по GET /stats.
+
+BOT_USER = {'id': 1, 'is_bot': True, 'first_name': 'FakeBot', 'username': 'fake_bot'}
+
+# Методы, которые отвечают сообщением (остальные — просто True)
+MESSAGE_METHODS = {'sendMessage', 'editMessageText', 'editMessageReplyMarkup', 'sendDocument', 'sendPhoto'}
+
+
+# Записи из файла: готовые Update (с message / callback_query / ...) или упрощённые {"chat_id", "text"}.
+# update_id перенумеровываются по порядку, чтобы работал offset в getUpdates
+def load_updates(path, default_chats=1):
+    updates = []
+    with open(path, encoding='utf-8') as f:
+        for line in f:
+            if line.strip():
+                updates.append(json.loads(line))
+    return normalize(updates, default_chats)
+
+def synthetic_updates(count, chats):
+    return normalize([{'chat_id': 1000 + i % chats, 'text': f'/add нагрузка {i}'} for i in range(count)], chats)
+
+def normalize(records, default_chats):
+    message_ids = itertools.count(1)
+    updates = []
+    for i, record in enumerate(records, start=1):
+        if not any(key in record for key in ('message', 'callback_query', 'inline_query', 'edited_message')):
+            chat_id = int(record.get('chat_id', 1000 + i % default_chats))
+            text = record.get('text') or record.get('title') or json.dumps(record, ensure_ascii=False)
+            record = {'message': {
+                'message_id': next(message_ids),
+                'date': int(time.time()),
+                'chat': {'id': chat_id, 'type': 'private'},
+                'from': {'id': chat_id, 'is_bot': False, 'first_name': 'Load'},
+                'text': text,
+            }}
+            if text.startswith('/'):
+                record['message']['entities'] = [{'type': 'bot_command', 'offset': 0, 'length': len(text.split()[0])}]
+        record = dict(record, update_id=i)
+        updates.append(record)
+    return updates
+
+def chat_of(update):
+    for key in ('message', 'edited_message'):
+        if key in update:
+            return update[key]['chat']['id']
+    if 'callback_query' in update:
+        query = update['callback_query']
+        return query['message']['chat']['id'] if 'message' in query else query['from']['id']
+    if 'inline_query' in update:
+        return update['inline_query']['from']['id']
+    return None
+
+
+class FakeTelegram:
+    def __init__(self, updates, rate, drain_timeout=10):
+        self.updates = updates
+        self.rate = rate
+        self.drain_timeout = drain_timeout
+
+        self.queue = deque()
+        self.new_updates = asyncio.Event()
+        self.bot_connected = asyncio.Event()
+        self.finished = asyncio.Event()
+        self.webhook_url = None
+        self.webhook_secret = None
+        self.mode = None
+
+        self.pending = defaultdict(deque)  # чат -> выданные апдейты, на которые ещё не было ответа
+        self.callback_chats = {}
+        self.latencies = []
+        self.calls = Counter()
+        self.message_ids = itertools.count(1)
+        self.started_at = None
+        self.last_reply_at = None
+        self.client = httpx.AsyncClient(timeout=30)
+
+    # --- Выдача апдейтов ---
+
+    async def replay(self):
+        await self.bot_connected.wait()
+        # Даём боту закончить запуск (post_init и т.п.)
+        await asyncio.sleep(0.5)
+        logger.info("▶️ Проигрываю %s апдейтов (%s), скорость %s/с", len(self.updates), self.mode, self.rate or '∞')
+
+        self.started_at = time.perf_counter()
+        interval = 1 / self.rate if self.rate else 0
+        for i, update in enumerate(self.updates):
+            delay = self.started_at + i * interval - time.perf_counter()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            self.release(update)
+
+        # Ждём ответов на всё выданное, но не дольше drain_timeout с последнего ответа
+        while any(self.pending.values()):
+            last = self.last_reply_at or self.started_at
+            if time.perf_counter() - last > self.drain_timeout:
+                break
+            await asyncio.sleep(0.05)
+        self.finished.set()
+
+    def release(self, update):
+        chat_id = chat_of(update)
+        if chat_id is not None:
+            self.pending[chat_id].append(time.perf_counter())
+        if 'callback_query' in update:
+            self.callback_chats[update['callback_query']['id']] = chat_id
+
+        if self.webhook_url:
+            asyncio.create_task(self.post_webhook(update))
+        else:
+            self.queue.append(update)
+            self.new_updates.set()
+
+    async def post_webhook(self, update):
+        headers = {'X-Telegram-Bot-Api-Secret-Token': self.webhook_secret} if self.webhook_secret else {}
+        try:
+            await self.client.post(self.webhook_url, json=update, headers=headers)
+        except httpx.HTTPError as e:
+            logger.warning("Webhook недоступен: %s", e)
+
+    async def get_updates(self, offset, timeout, limit):
+        while self.queue and self.queue[0]['update_id'] < offset:
+            self.queue.popleft()
+        if not self.queue and timeout:
+            self.new_updates.clear()
+            try:
+                await asyncio.wait_for(self.new_updates.wait(), timeout)
+            except asyncio.TimeoutError:
+                pass
+        return list(itertools.islice(self.queue, limit))
+
+    # --- Ответы бота ---
+
+    def record_reply(self, method, params):
+        self.calls[method] += 1
+        chat_id = params.get('chat_id') or self.callback_chats.pop(params.get('callback_query_id'), None)
+        try:
+            chat_id = int(chat_id)
+        except (TypeError, ValueError):
+            return
+        # Первый ответ в чат закрывает самый старый ожидающий апдейт этого чата
+        if self.pending.get(chat_id):
+            now = time.perf_counter()
+            self.latencies.append(now - self.pending[chat_id].popleft())
+            self.last_reply_at = now
+
+    def message(self, params):
+        chat_id = params.get('chat_id')
+        try:
+            chat_id = int(chat_id)
+        except (TypeError, ValueError):
+            chat_id = 0
+        return {
+            'message_id': next(self.message_ids),
+            'date': int(time.time()),
+            'chat': {'id': chat_id, 'type': 'private'},
+            'from': BOT_USER,
+            'text': params.get('text', ''),
+        }
+
+    def summary(self):
+        duration = ((self.last_reply_at or time.perf_counter()) - self.started_at) if self.started_at else 0
+        latencies_ms = sorted(l * 1000 for l in self.latencies)
+
+        def percentile(p):
+            if not latencies_ms:
+                return None
+            return round(latencies_ms[min(len(latencies_ms) - 1, int(p / 100 * len(latencies_ms)))], 2)
+
+        return {
+            'mode': self.mode,
+            'updates': len(self.updates),
+            'replied': len(self.latencies),
+            'duration_s': round(duration, 3),
+            'throughput_per_s': round(len(self.latencies) / duration, 2) if duration else None,
+            'latency_ms': {
+                'mean': round(statistics.fmean(latencies_ms), 2) if latencies_ms else None,
+                'p50': percentile(50),
+                'p90': percentile(90),
+                'p99': percentile(99),
+                'max': round(latencies_ms[-1], 2) if latencies_ms else None,
+            },
+            'calls': dict(self.calls),
+        }
+
+
+class BotApiHandler(RequestHandler):
+    def initialize(self, fake):
+        self.fake = fake
+
+    def params(self):
+        if self.request.headers.get('Content-Type', '').startswith('application/json'):
+            return json.loads(self.request.body or b'{}')
+        return {key: self.get_body_argument(key) for key in self.request.body_arguments}
+
+    async def post(self, token, method):
+        fake = self.fake
+        params = self.params()
+
+        if method == 'getMe':
+            result = BOT_USER
+        elif method == 'getUpdates':
+            if fake.mode is None:
+                fake.mode = 'polling'
+                fake.bot_connected.set()
+            result = await fake.get_updates(
+                int(params.get('offset') or 0),
+                float(params.get('timeout') or 0),
+                int(params.get('limit') or 100),
+            )
+        elif method == 'setWebhook':
+            fake.webhook_url = params.get('url') or None
+            fake.webhook_secret = params.get('secret_token')
+            if fake.webhook_url:
+                fake.mode = 'webhook'
+                fake.bot_connected.set()
+            result = True
+        elif method == 'deleteWebhook':
+            fake.webhook_url = None
+            result = True
+        elif method == 'getWebhookInfo':
+            result = {'url': fake.webhook_url or '', 'has_custom_certificate': False, 'pending_update_count': len(fake.queue)}
+        else:
+            fake.record_reply(method, params)
+            if method in MESSAGE_METHODS and 'inline_message_id' not in params:
+                result = fake.message(params)
+            else:
+                result = True
+
+        self.write({'ok': True, 'result': result})
+
+    get = post
+
+
+class StatsHandler(RequestHandler):
+    def initialize(self, fake):
+        self.fake = fake
+
+    def get(self):
+        self.write(self.fake.summary())
+
+
+def make_app(fake):
+    return Application([
+        (r'/bot(?P<token>[^/]+)/(?P<method>\w+)', BotApiHandler, {'fake': fake}),
+        (r'/stats', StatsHandler, {'fake': fake}),
+    ])
+
+async def serve(args):
+    if args.updates:
+        updates = load_updates(args.updates, args.chats)
+    else:
+        updates = synthetic_updates(args.synthetic, args.chats)
+
+    fake = FakeTelegram(updates, args.rate, args.drain_timeout)
+    server = make_app(fake).listen(args.port, address=args.host)
+    logger.info("🧪 Fake Bot API: http://%s:%s (TELEGRAM_API_URL для бота)", args.host, args.port)
+
+    await fake.replay()
+    print(json.dumps(fake.summary(), ensure_ascii=False, indent=2))
+
+    if args.keep_running:
+        await asyncio.Event().wait()
+    server.stop()
+    await fake.client.aclose()
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Локальный fake Telegram Bot API для нагрузочных тестов")
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8081)
+    parser.add_argument('--updates', help="JSONL с апдейтами (Update или {\"chat_id\", \"text\"})")
+    parser.add_argument('--synthetic', type=int, default=1000, help="сколько апдейтов сгенерировать, если --updates не задан")
+    parser.add_argument('--chats', type=int, default=50, help="число разных чатов в сгенерированных апдейтах")
+    parser.add_argument('--rate', type=float, default=0, help="апдейтов в секунду (0 — без ограничения)")
+    parser.add_argument('--drain-timeout', type=float, default=10, help="сколько ждать оставшихся ответов, с")
+    parser.add_argument('--keep-running', action='store_true', help="не останавливать сервер после прогона")
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(format='%(asctime)s - %(name)s - %(levelname)s - %(message)s', level=logging.INFO)
+    asyncio.run(serve(args))
+
+if __name__ == '__main__':
+    main()
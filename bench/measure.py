@@ -0,0 +1,52 @@
+import resource
+import statistics
+
+# Общие замеры для бенчмарков: перцентили задержек и пиковая память процесса
+
+
+# Задержки в секундах -> сводка в миллисекундах
+def latency_summary(samples):
+    ms = sorted(s * 1000 for s in samples)
+    if not ms:
+        return {'mean': None, 'p50': None, 'p90': None, 'p99': None, 'max': None}
+
+    def percentile(p):
+        return round(ms[min(len(ms) - 1, int(p / 100 * len(ms)))], 3)
+
+    return {
+        'mean': round(statistics.fmean(ms), 3),
+        'p50': percentile(50),
+        'p90': percentile(90),
+        'p99': percentile(99),
+        'max': round(ms[-1], 3),
+    }
+
+# Итог одного сценария: число прогонов, задержки, пропускная способность и пик RSS за сценарий
+def scenario_result(samples, elapsed, peak_rss_kb, **extra):
+    return {
+        'runs': len(samples),
+        'latency_ms': latency_summary(samples),
+        'throughput_per_s': round(len(samples) / elapsed, 2) if elapsed else None,
+        'peak_rss_kb': peak_rss_kb,
+        **extra,
+    }
+
+
+# Пиковый RSS. На Linux пик можно сбросить (запись "5" в /proc/self/clear_refs) и читать VmHWM,
+# тогда у каждого сценария свой пик; иначе — пик за всё время процесса (ru_maxrss)
+def reset_peak_rss():
+    try:
+        with open('/proc/self/clear_refs', 'w') as f:
+            f.write('5')
+    except OSError:
+        pass
+
+def peak_rss_kb():
+    try:
+        with open('/proc/self/status') as f:
+            for line in f:
+                if line.startswith('VmHWM:'):
+                    return int(line.split()[1])
+    except OSError:
+        pass
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
@@ -0,0 +1,110 @@
+import argparse
+import asyncio
+import json
+import logging
+import os
+import platform
+import shutil
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import time
+
+# Запуск бенчмарков бота и веб-интерфейса на синтетической базе:
+#
+#   python -m bench.run --rows 100000 --out bench/results/$(git rev-parse --short HEAD).json
+#   python -m bench.run --rows 1000000 --only web --iterations 50
+#   python -m bench.compare bench/results/old.json bench/results/new.json
+#
+# База генерируется один раз (bench/data/, см. bench.datagen) и для каждого прогона копируется
+# во временный каталог, так что изменяющие сценарии не портят исходник и прогоны сравнимы.
+# Результат — JSON: параметры прогона, коммит и для каждого сценария перцентили задержки,
+# пропускная способность и пиковый RSS.
+
+def git_revision():
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    try:
+        commit = subprocess.run(['git', 'rev-parse', 'HEAD'], cwd=root, capture_output=True, text=True, check=True).stdout.strip()
+        dirty = bool(subprocess.run(['git', 'status', '--porcelain', '--untracked-files=no'], cwd=root, capture_output=True, text=True).stdout.strip())
+    except (OSError, subprocess.CalledProcessError):
+        return None, None
+    return commit, dirty
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Бенчмарки бота и веб-интерфейса")
+    parser.add_argument('--rows', type=int, default=100000, help="размер синтетической базы (10k–10M)")
+    parser.add_argument('--closed', type=float, default=0.85, help="доля закрытых задач")
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--iterations', type=int, default=200, help="прогонов каждого сценария")
+    parser.add_argument('--export-iterations', type=int, default=3, help="прогонов выгрузок")
+    parser.add_argument('--only', choices=['bot', 'web'], help="только бот или только веб")
+    parser.add_argument('--scenario', action='append', help="запустить только эти сценарии (можно несколько раз)")
+    parser.add_argument('--out', help="куда записать JSON (по умолчанию stdout)")
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(format='%(asctime)s - %(name)s - %(levelname)s - %(message)s', level=logging.WARNING)
+
+    # TASKS_DB задаётся до первого импорта db/main/web: путь к базе они читают при импорте
+    workdir = tempfile.mkdtemp(prefix='tasks-bench-')
+    work_db = os.path.join(workdir, 'tasks.db')
+    os.environ['TASKS_DB'] = work_db
+    os.environ.setdefault('BOT_TOKEN', '1:bench')
+    # Меряем обработчики, а не фоновую запись состояния диалогов
+    os.environ.setdefault('PERSISTENCE', '0')
+    # и не лимиты Telegram: очередь отправки работает, но без общего лимита (в бенчмарке все чаты — личные)
+    os.environ.setdefault('SEND_OVERALL_RATE', '0')
+
+    from bench import datagen
+    import migrations
+
+    try:
+        started = time.perf_counter()
+        source = datagen.ensure(args.rows, args.closed, args.seed)
+        generated_s = time.perf_counter() - started
+
+        commit, dirty = git_revision()
+        report = {
+            'commit': commit,
+            'dirty': dirty,
+            'started_at': int(time.time()),
+            'python': platform.python_version(),
+            'sqlite': sqlite3.sqlite_version,
+            'platform': platform.platform(),
+            'rows': args.rows,
+            'closed_ratio': args.closed,
+            'seed': args.seed,
+            'iterations': args.iterations,
+            'export_iterations': args.export_iterations,
+            'dataset_ready_s': round(generated_s, 2),
+        }
+
+        if args.only in (None, 'bot'):
+            shutil.copyfile(source, work_db)
+            migrations.migrate(work_db)
+            from bench import bot
+            report['bot'] = asyncio.run(bot.run(work_db, args.iterations, args.seed, args.scenario))
+
+        if args.only in (None, 'web'):
+            # Свежая копия: веб меряем на той же базе, что бот видел до своих изменений
+            for suffix in ('', '-wal', '-shm'):
+                if os.path.exists(work_db + suffix):
+                    os.remove(work_db + suffix)
+            shutil.copyfile(source, work_db)
+            migrations.migrate(work_db)
+            from bench import web
+            report['web'] = web.run(work_db, args.iterations, args.export_iterations, args.seed, args.scenario)
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    output = json.dumps(report, ensure_ascii=False, indent=2)
+    if args.out:
+        os.makedirs(os.path.dirname(os.path.abspath(args.out)), exist_ok=True)
+        with open(args.out, 'w', encoding='utf-8') as f:
+            f.write(output + '\n')
+        print(f"✅ Результаты: {args.out}", file=sys.stderr)
+    else:
+        print(output)
+
+if __name__ == '__main__':
+    main()
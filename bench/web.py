@@ -0,0 +1,84 @@
+import os
+import random
+import shutil
+import time
+from collections import Counter
+
+from bench.measure import peak_rss_kb, reset_peak_rss, scenario_result
+
+# Бенчмарк веб-интерфейса: маршруты web.py через тестовый клиент Flask (без сети и сервера),
+# ответ читается целиком — для потоковых выгрузок это время полной отдачи файла.
+
+SEARCH_WORDS = ['отчёт', 'принтер', 'договор', 'склад', 'клиента', 'инвентаризацию', 'бэкап']
+
+# Сценарий: имя, функция (rng, max_id) -> URL, и тяжёлый ли он (тяжёлые гоняются export_iterations раз)
+SCENARIOS = [
+    ('index', lambda rng, max_id: '/', False),
+    ('index_open', lambda rng, max_id: '/?filter=open', False),
+    ('api_stats', lambda rng, max_id: '/api/stats', False),
+    ('api_tasks_deep', lambda rng, max_id: f'/api/tasks?cursor={rng.randint(1, max_id + 1)}', False),
+    ('api_tasks_closed_fields', lambda rng, max_id: f'/api/tasks?status=closed&fields=id,time_spent&cursor={rng.randint(1, max_id + 1)}', False),
+    ('api_search', lambda rng, max_id: f'/api/search?q={rng.choice(SEARCH_WORDS)}', False),
+    ('export_csv', lambda rng, max_id: '/export?format=csv', True),
+    ('export_ndjson', lambda rng, max_id: '/export?format=ndjson', True),
+    ('export_xlsx', lambda rng, max_id: '/export', True),
+]
+
+def run(path, iterations, export_iterations, seed=1, only=None):
+    # web импортируется здесь: к этому моменту TASKS_DB уже указывает на рабочую копию базы
+    import db
+    import exports
+    import web
+
+    client = web.app.test_client()
+    with client.session_transaction() as session:
+        session['logged_in'] = True
+
+    conn = db.connect(path)
+    max_id = conn.execute('SELECT COALESCE(MAX(id), 0) FROM tasks').fetchone()[0]
+    conn.close()
+
+    rng = random.Random(seed)
+    results = {}
+    for name, make_url, heavy in SCENARIOS:
+        if only and name not in only:
+            continue
+        urls = [make_url(rng, max_id) for _ in range(export_iterations if heavy else iterations)]
+
+        statuses = Counter()
+        response_bytes = 0
+        reset_peak_rss()
+        samples = []
+        started = time.perf_counter()
+        for url in urls:
+            if name == 'export_xlsx':
+                # Каждый прогон — сборка с нуля, а не отдача готового файла из кэша
+                shutil.rmtree(exports.EXPORT_DIR, ignore_errors=True)
+            begin = time.perf_counter()
+            response = client.get(url)
+            body = response.get_data()
+            if name == 'export_xlsx' and response.status_code == 302:
+                # Большая таблица: выгрузка ушла в фон — ждём её, это и есть время ожидания пользователя
+                _wait_export(web)
+            samples.append(time.perf_counter() - begin)
+            statuses[response.status_code] += 1
+            response_bytes += len(body)
+        elapsed = time.perf_counter() - started
+
+        results[name] = scenario_result(
+            samples, elapsed, peak_rss_kb(),
+            statuses={str(code): count for code, count in statuses.items()},
+            response_bytes=response_bytes,
+        )
+
+    shutil.rmtree(exports.EXPORT_DIR, ignore_errors=True)
+    return results
+
+def _wait_export(web):
+    # submit с тем же ключом возвращает уже идущую задачу
+    job = web.export_jobs.submit('export', web.exports.xlsx_job, web.DATABASE, key='xlsx')
+    while job.status in ('pending', 'running'):
+        time.sleep(0.05)
+    if job.status == 'done' and os.path.exists(job.result):
+        return job.result
+    return None
@@ -0,0 +1,57 @@
+import os
+
+# Настройки бота. Всё можно переопределить переменными окружения
+
+# 🔑 ТОКЕН
+BOT_TOKEN = os.environ.get('BOT_TOKEN', "8296163167:AAHPn-gjTODYfao8G7_aWY8nEsczGgSwiJY")
+
+# Адрес Bot API. Для нагрузочных тестов сюда подставляется локальный fake-сервер
+# (python -m bench.fake_telegram), например http://127.0.0.1:8081
+TELEGRAM_API_URL = os.environ.get('TELEGRAM_API_URL', 'https://api.telegram.org')
+
+# Чат администратора. Задачи без владельца (созданные до разделения задач по чатам) бот при старте
+# отдаёт этому чату; не задан — только предупреждает в логе (см. python manage.py claim)
+ADMIN_CHAT_ID = int(os.environ['ADMIN_CHAT_ID']) if os.environ.get('ADMIN_CHAT_ID') else None
+
+# polling (по умолчанию) или webhook
+BOT_MODE = os.environ.get('BOT_MODE', 'polling')
+
+# Webhook: где слушаем, по какому пути, какой публичный URL сообщаем Telegram
+# и каким секретом Telegram подписывает запросы (заголовок X-Telegram-Bot-Api-Secret-Token)
+WEBHOOK_LISTEN = os.environ.get('WEBHOOK_LISTEN', '127.0.0.1')
+WEBHOOK_PORT = int(os.environ.get('WEBHOOK_PORT', 8443))
+WEBHOOK_PATH = os.environ.get('WEBHOOK_PATH', 'telegram')
+WEBHOOK_URL = os.environ.get('WEBHOOK_URL')  # по умолчанию http://WEBHOOK_LISTEN:WEBHOOK_PORT/WEBHOOK_PATH
+WEBHOOK_SECRET = os.environ.get('WEBHOOK_SECRET')
+
+# Параллельная обработка апдейтов: сколько апдейтов разных чатов обрабатывается одновременно.
+# Внутри одного чата порядок всегда сохраняется. 0 — по одному, как раньше
+CONCURRENT_UPDATES = int(os.environ.get('CONCURRENT_UPDATES', 0))
+
+# Состояние диалогов (user_data/chat_data) хранится в tasks.db и переживает перезапуск.
+# Изменения копятся в памяти и пишутся пачкой: PTB отдаёт их раз в PERSISTENCE_UPDATE_INTERVAL секунд,
+# запись в базу — не позже чем через PERSISTENCE_FLUSH_DELAY секунд после этого
+PERSISTENCE = os.environ.get('PERSISTENCE', '1') != '0'
+PERSISTENCE_UPDATE_INTERVAL = float(os.environ.get('PERSISTENCE_UPDATE_INTERVAL', 5))
+PERSISTENCE_FLUSH_DELAY = float(os.environ.get('PERSISTENCE_FLUSH_DELAY', 1))
+
+# Метрики бота в формате Prometheus: http://METRICS_LISTEN:METRICS_PORT/metrics (не задан — не слушаем).
+# Веб-интерфейс отдаёт свои метрики на /metrics. Отключить сбор совсем: METRICS=0
+METRICS_PORT = int(os.environ.get('METRICS_PORT', 0))
+METRICS_LISTEN = os.environ.get('METRICS_LISTEN', '127.0.0.1')
+# /metrics веб-интерфейса отдаётся только после входа или сборщику с заголовком
+# Authorization: Bearer METRICS_TOKEN (не задан — только после входа)
+METRICS_TOKEN = os.environ.get('METRICS_TOKEN')
+
+# Архив: задачи, закрытые больше ARCHIVE_AFTER_DAYS дней назад, бот раз в сутки (в ARCHIVE_HOUR часов)
+# переносит из горячей таблицы в tasks_archive. Списки, поиск и выгрузки видят архив как обычно. 0 — не архивировать
+ARCHIVE_AFTER_DAYS = float(os.environ.get('ARCHIVE_AFTER_DAYS', 90))
+ARCHIVE_HOUR = int(os.environ.get('ARCHIVE_HOUR', 3))
+
+# Очередь исходящих сообщений (outbox.py): общий лимит запросов в секунду, лимит сообщений в минуту
+# на групповой чат (SEND_OVERALL_RATE=0 — без общего лимита), сколько раз повторять запрос после 429
+# и склеивать ли мелкие сообщения одного чата
+SEND_OVERALL_RATE = float(os.environ.get('SEND_OVERALL_RATE', 30))
+SEND_GROUP_PER_MINUTE = float(os.environ.get('SEND_GROUP_PER_MINUTE', 20))
+SEND_MAX_RETRIES = int(os.environ.get('SEND_MAX_RETRIES', 5))
+SEND_MERGE = os.environ.get('SEND_MERGE', '1') != '0'
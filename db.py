@@ -0,0 +1,826 @@
+import asyncio
+import os
+import re
+import sqlite3
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+import metrics
+
+DATABASE = os.environ.get('TASKS_DB', 'tasks.db')
+
+# Колонки карточки задачи — в этом порядке их ждут обработчики бота
+TASK_COLUMNS = 'id, description, created_at, closed_at, time_spent, is_closed, assignee, due_at, remind_at'
+
+# Все хранимые колонки задачи (так переносится задача в архив)
+STORED_COLUMNS = f'{TASK_COLUMNS}, chat_id'
+
+# Таблицы, где может лежать задача: горячая и архив закрытых
+TASK_TABLES = ('tasks', 'tasks_archive')
+
+FILTER_CONDITIONS = {
+    'open': 'is_closed = 0',
+    'closed': 'is_closed = 1',
+    'all': '1',
+}
+
+# Откуда читать задачи для фильтра: открытые есть только в горячей таблице tasks,
+# закрытые могут лежать и в архиве (tasks_all = tasks + tasks_archive, см. миграцию archive)
+FILTER_SOURCES = {
+    'open': 'tasks',
+    'closed': 'tasks_all',
+    'all': 'tasks_all',
+}
+
+# Размер страницы в списках задач бота
+PAGE_SIZE = 10
+
+# Имя исполнителя обрезается до этой длины
+MAX_ASSIGNEE = 64
+
+# Условие "задача этого чата" и его параметры. chat_id=None — без ограничения (веб видит все чаты).
+# Все запросы с чатом идут по индексам, начинающимся с chat_id (см. миграцию task_owner)
+def _owner(chat_id):
+    if chat_id is None:
+        return '1', ()
+    return 'chat_id = ?', (chat_id,)
+
+# Подключение к БД: WAL, чтобы читатели не блокировали писателя (и наоборот).
+# Если включены метрики, каждый запрос попадает в гистограмму sql_statement_duration_seconds
+def connect(path=DATABASE, **kwargs):
+    kwargs.setdefault('timeout', 30)
+    kwargs.setdefault('cached_statements', 256)
+    if metrics.ENABLED:
+        kwargs.setdefault('factory', metrics.TimedConnection)
+    conn = sqlite3.connect(path, **kwargs)
+    conn.execute('PRAGMA journal_mode=WAL')
+    return conn
+
+# created_at/closed_at хранятся как unix epoch; для людей показываем локальное время
+def format_ts(ts):
+    if ts is None:
+        return None
+    return datetime.fromtimestamp(ts).strftime('%Y-%m-%d %H:%M:%S')
+
+# --- Запросы. Каждый принимает открытое соединение, чтобы их могли переиспользовать и бот, и веб ---
+
+# Номер версии данных (см. миграцию data_version): меняется при любой записи в tasks
+def data_version(conn):
+    return conn.execute("SELECT value FROM meta WHERE key = 'data_version'").fetchone()[0]
+
+# --- Сводная статистика (таблицы task_stats и task_top, их ведут триггеры) ---
+
+# Размер топа самых долгих задач (должен совпадать с TOP_N в migrations)
+STATS_TOP_N = 5
+
+# Те же цифры, что в task_stats, посчитанные по всем задачам вместе с архивом (полный проход)
+STATS_AGGREGATE = '''
+    SELECT
+        COUNT(*),
+        COALESCE(SUM(is_closed = 0), 0),
+        COALESCE(SUM(is_closed = 1), 0),
+        COALESCE(SUM(CASE WHEN is_closed = 1 THEN time_spent END), 0),
+        COUNT(CASE WHEN is_closed = 1 THEN time_spent END)
+    FROM tasks_all
+'''
+
+# Самые долгие задачи — слияние концов индексов idx_tasks_closed_time и idx_tasks_archive_time
+TOP_TASKS_QUERY = f'''
+    SELECT id, description, time_spent
+    FROM tasks_all
+    WHERE is_closed = 1 AND time_spent IS NOT NULL
+    ORDER BY time_spent DESC
+    LIMIT {STATS_TOP_N}
+'''
+
+STATS_FIELDS = ('total', 'open_count', 'closed_count', 'time_sum', 'time_count')
+
+# Статистика для /api/stats: одна строка счётчиков и несколько строк топа.
+# По одному чату сводки нет — считаем по его строкам (индексы по chat_id, стоимость — размер бэклога чата)
+def read_stats(conn, chat_id=None):
+    if chat_id is None:
+        total, open_count, closed_count, time_sum, time_count = conn.execute(
+            f'SELECT {", ".join(STATS_FIELDS)} FROM task_stats WHERE id = 1'
+        ).fetchone()
+        top = conn.execute('SELECT description, time_spent FROM task_top ORDER BY time_spent DESC').fetchall()
+    else:
+        total, open_count, closed_count, time_sum, time_count = conn.execute(
+            STATS_AGGREGATE + ' WHERE chat_id = ?', (chat_id,)
+        ).fetchone()
+        top = conn.execute(f'''
+            SELECT description, time_spent FROM tasks_all
+            WHERE chat_id = ? AND is_closed = 1 AND time_spent IS NOT NULL
+            ORDER BY time_spent DESC
+            LIMIT {STATS_TOP_N}
+        ''', (chat_id,)).fetchall()
+    return {
+        'total': total,
+        'open': open_count,
+        'closed': closed_count,
+        'avg_time': round(time_sum / time_count, 2) if time_count else 0,
+        'top_long_tasks': [{'description': row[0], 'time_spent': row[1]} for row in top],
+    }
+
+# Сравнить сводку с реальными данными. Возвращает список расхождений (пустой — всё сходится)
+def check_stats(conn):
+    problems = []
+    stored = conn.execute(f'SELECT {", ".join(STATS_FIELDS)} FROM task_stats WHERE id = 1').fetchone()
+    actual = conn.execute(STATS_AGGREGATE).fetchone()
+    for name, stored_value, actual_value in zip(STATS_FIELDS, stored, actual):
+        if abs(stored_value - actual_value) > 1e-6:
+            problems.append(f'{name}: в сводке {stored_value}, в таблице {actual_value}')
+
+    # Сравниваем значения, а не id: при равном времени порядок задач в топе не определён
+    stored_top = [row[0] for row in conn.execute('SELECT time_spent FROM task_top ORDER BY time_spent DESC')]
+    actual_top = [row[2] for row in conn.execute(TOP_TASKS_QUERY)]
+    if stored_top != actual_top:
+        problems.append(f'task_top: в сводке {stored_top}, в таблице {actual_top}')
+    return problems
+
+# Пересчитать сводку с нуля. Транзакцией управляет вызывающий
+def rebuild_stats(conn):
+    conn.execute(f'''
+        UPDATE task_stats
+        SET ({", ".join(STATS_FIELDS)}) = ({STATS_AGGREGATE})
+        WHERE id = 1
+    ''')
+    conn.execute('DELETE FROM task_top')
+    conn.execute(f'INSERT INTO task_top (task_id, description, time_spent) {TOP_TASKS_QUERY}')
+
+def add_task(conn, description, chat_id=None):
+    with conn:
+        return insert_task(conn, description, chat_id)
+
+# Вставка без своей транзакции: её открывает вызывающий (add_task или групповая запись, см. group_commit.py).
+# Возвращает id новой задачи
+def insert_task(conn, description, chat_id=None):
+    return conn.execute('INSERT INTO tasks (description, chat_id) VALUES (?, ?)', (description, chat_id)).lastrowid
+
+def get_task(conn, task_id, chat_id=None):
+    owner, owner_params = _owner(chat_id)
+    return conn.execute(f'SELECT {TASK_COLUMNS} FROM tasks_all WHERE id = ? AND {owner}', (task_id, *owner_params)).fetchone()
+
+# Страница задач по ключу (keyset) — стоимость запроса O(размер страницы), а не O(смещение).
+# Строки всегда идут от новых к старым. after — взять задачи с id < after,
+# before — с id > before. Возвращает (строки, есть ли более новые, есть ли более старые).
+# Для tasks_all SQLite сливает по id два индексных прохода (горячая таблица и архив)
+def page_tasks(conn, filter_type='all', after=None, before=None, limit=PAGE_SIZE, chat_id=None):
+    owner, owner_params = _owner(chat_id)
+    condition = f'{FILTER_CONDITIONS.get(filter_type, "1")} AND {owner}'
+    source = FILTER_SOURCES.get(filter_type, 'tasks_all')
+
+    if before is not None:
+        rows = conn.execute(
+            f'SELECT {TASK_COLUMNS} FROM {source} WHERE {condition} AND id > ? ORDER BY id ASC LIMIT ?',
+            (*owner_params, before, limit + 1)
+        ).fetchall()
+        has_newer = len(rows) > limit
+        rows = rows[:limit][::-1]
+        has_older = bool(rows) and _exists(conn, source, condition, owner_params, 'id < ?', rows[-1][0])
+    else:
+        if after is not None:
+            rows = conn.execute(
+                f'SELECT {TASK_COLUMNS} FROM {source} WHERE {condition} AND id < ? ORDER BY id DESC LIMIT ?',
+                (*owner_params, after, limit + 1)
+            ).fetchall()
+        else:
+            rows = conn.execute(
+                f'SELECT {TASK_COLUMNS} FROM {source} WHERE {condition} ORDER BY id DESC LIMIT ?',
+                (*owner_params, limit + 1)
+            ).fetchall()
+        has_older = len(rows) > limit
+        rows = rows[:limit]
+        has_newer = bool(rows) and _exists(conn, source, condition, owner_params, 'id > ?', rows[0][0])
+
+    return rows, has_newer, has_older
+
+def _exists(conn, source, condition, params, bound, value):
+    return bool(conn.execute(f'SELECT EXISTS(SELECT 1 FROM {source} WHERE {condition} AND {bound})', (*params, value)).fetchone()[0])
+
+# Поля, которые можно запросить через /api/tasks
+API_FIELDS = ('id', 'description', 'created_at', 'closed_at', 'time_spent', 'is_closed', 'chat_id', 'assignee', 'due_at', 'remind_at')
+
+# Выборка для веб-API: фильтр по статусу и дате создания, keyset-курсор по id (задачи с id < cursor).
+# created_from/created_to — unix epoch, полуинтервал [created_from, created_to); chat_id — задачи одного чата.
+# Возвращает (строки, курсор следующей страницы или None)
+def query_tasks(conn, status='all', cursor=None, limit=50, created_from=None, created_to=None, fields=API_FIELDS, chat_id=None):
+    conditions = [FILTER_CONDITIONS.get(status, '1')]
+    params = []
+    if chat_id is not None:
+        conditions.append('chat_id = ?')
+        params.append(chat_id)
+    if cursor is not None:
+        conditions.append('id < ?')
+        params.append(cursor)
+    if created_from:
+        conditions.append('created_at >= ?')
+        params.append(created_from)
+    if created_to:
+        conditions.append('created_at < ?')
+        params.append(created_to)
+
+    # id нужен всегда — по нему строится курсор
+    columns = ['id'] + [f for f in fields if f != 'id']
+    rows = conn.execute(
+        f'SELECT {", ".join(columns)} FROM {FILTER_SOURCES.get(status, "tasks_all")} WHERE {" AND ".join(conditions)} ORDER BY id DESC LIMIT ?',
+        (*params, limit + 1)
+    ).fetchall()
+
+    next_cursor = rows[limit - 1][0] if len(rows) > limit else None
+    return rows[:limit], next_cursor
+
+# --- Журнал изменений (task_changes, см. миграцию change_log) ---
+
+# Больше изменённых задач за раз не отдаём — клиенту проще перечитать список целиком
+CHANGES_LIMIT = 500
+
+# Последний номер в журнале изменений (0 — изменений ещё не было)
+def change_seq(conn):
+    return conn.execute('SELECT COALESCE(MAX(seq), 0) FROM task_changes').fetchone()[0]
+
+# Что изменилось после seq = since для списка с фильтром status (и чатом chat_id).
+# Возвращает словарь: seq — до какого номера учтены изменения, tasks — изменённые задачи, которые
+# подходят под фильтр (поля API_FIELDS), removed — id удалённых и переставших подходить.
+# reset=True — журнал уже срезан дальше since или изменений слишком много: список нужно перечитать
+def changes_since(conn, since, status='all', chat_id=None, limit=CHANGES_LIMIT):
+    latest = change_seq(conn)
+    result = {'seq': latest, 'reset': False, 'tasks': [], 'removed': []}
+    if since >= latest:
+        return result
+    oldest = conn.execute('SELECT MIN(seq) FROM task_changes').fetchone()[0]
+    if since < oldest - 1:
+        result['reset'] = True
+        return result
+
+    ids = [row[0] for row in conn.execute(
+        'SELECT DISTINCT task_id FROM task_changes WHERE seq > ? AND seq <= ? LIMIT ?', (since, latest, limit + 1)
+    )]
+    if len(ids) > limit:
+        result['reset'] = True
+        return result
+
+    owner, owner_params = _owner(chat_id)
+    placeholders = ', '.join('?' * len(ids))
+    result['tasks'] = conn.execute(f'''
+        SELECT {", ".join(API_FIELDS)} FROM tasks_all
+        WHERE id IN ({placeholders}) AND {FILTER_CONDITIONS.get(status, '1')} AND {owner}
+        ORDER BY id DESC
+    ''', (*ids, *owner_params)).fetchall()
+    found = {row[0] for row in result['tasks']}
+    result['removed'] = [task_id for task_id in ids if task_id not in found]
+    return result
+
+# --- Полнотекстовый поиск (tasks_fts, см. миграцию search_index) ---
+
+# Пользовательский ввод -> запрос FTS5: каждое слово ищется как префикс ("отч" найдёт "отчёт"),
+# все слова должны встретиться. Слова берём в кавычки, чтобы операторы FTS5 из ввода не работали.
+# None — искать нечего
+def fts_query(text, max_terms=10):
+    terms = re.findall(r'\w+', text.lower())[:max_terms]
+    if not terms:
+        return None
+    return ' '.join(f'"{term}"*' for term in terms)
+
+# Сколько самых новых совпадений ранжируется. bm25 считается на каждую строку, и по частому слову
+# на миллионе задач это сотни миллисекунд; ограничив окно, держим время запроса в миллисекундах.
+# Если совпадений меньше окна (обычный случай), ранжирование точное
+SEARCH_WINDOW = 1000
+
+# Фильтр по статусу для совпадений FTS — поиском по ключу в горячей таблице:
+# открытые задачи лежат только в tasks, а всё, что не открыто в tasks, закрыто (в том числе архив)
+SEARCH_CONDITIONS = {
+    'open': 'EXISTS (SELECT 1 FROM tasks WHERE id = tasks_fts.rowid AND is_closed = 0)',
+    'closed': 'NOT EXISTS (SELECT 1 FROM tasks WHERE id = tasks_fts.rowid AND is_closed = 0)',
+    'all': '1',
+}
+
+# То же для поиска в одном чате: чат задачи проверяется поиском по ключу в tasks или архиве.
+# Индекс FTS общий, так что в чате с редкими совпадениями по частому слову просматривается больше строк
+SEARCH_CHAT_CONDITIONS = {
+    'open': 'EXISTS (SELECT 1 FROM tasks WHERE id = tasks_fts.rowid AND is_closed = 0 AND chat_id = ?)',
+    'closed': 'EXISTS (SELECT 1 FROM tasks_all WHERE id = tasks_fts.rowid AND is_closed = 1 AND chat_id = ?)',
+    'all': 'EXISTS (SELECT 1 FROM tasks_all WHERE id = tasks_fts.rowid AND chat_id = ?)',
+}
+
+# Поиск по описаниям, лучшие совпадения (bm25) первыми. Пагинация смещением: порядок по релевантности
+# не даёт устойчивого ключа, а листают результаты поиска недалеко.
+# Возвращает (строки в формате TASK_COLUMNS, есть ли ещё)
+def search_tasks(conn, text, status='all', offset=0, limit=PAGE_SIZE, chat_id=None):
+    query = fts_query(text)
+    if query is None:
+        return [], False
+
+    if chat_id is None:
+        condition, condition_params = SEARCH_CONDITIONS.get(status, '1'), ()
+    else:
+        condition, condition_params = SEARCH_CHAT_CONDITIONS.get(status, SEARCH_CHAT_CONDITIONS['all']), (chat_id,)
+
+    columns = ', '.join(f't.{column.strip()} AS {column.strip()}' for column in TASK_COLUMNS.split(','))
+    # Внутренний запрос идёт по индексу FTS от новых задач к старым и останавливается на SEARCH_WINDOW.
+    # С представлением tasks_all (UNION ALL) SQLite не умеет соединять по ключу и материализует его
+    # целиком, поэтому совпадения соединяются с горячей таблицей и архивом по отдельности
+    rows = conn.execute(f'''
+        WITH matches AS (
+            SELECT tasks_fts.rowid AS id, tasks_fts.rank AS rank
+            FROM tasks_fts
+            WHERE tasks_fts MATCH ? AND {condition}
+            ORDER BY tasks_fts.rowid DESC
+            LIMIT ?
+        )
+        SELECT {TASK_COLUMNS}
+        FROM (
+            SELECT {columns}, matches.rank AS rank FROM matches JOIN tasks t ON t.id = matches.id
+            UNION ALL
+            SELECT {columns}, matches.rank AS rank FROM matches JOIN tasks_archive t ON t.id = matches.id
+        )
+        ORDER BY rank, id DESC
+        LIMIT ? OFFSET ?
+    ''', (query, *condition_params, SEARCH_WINDOW, limit + 1, offset)).fetchall()
+    return rows[:limit], len(rows) > limit
+
+# --- Быстрый поиск для inline-режима (@бот <текст>) ---
+# Запрос приходит на каждую набранную букву, поэтому каждый ответ — ограниченная работа по индексам:
+# - число ("42", "#42") — задача с этим id по первичному ключу, первой в выдаче;
+# - слова ищутся по префиксным индексам FTS (prefix='2 3'): слово длиннее трёх букв — по первым трём,
+#   полное слово проверяется уже на найденных строках (как и слова сверх LOOKUP_INDEXED_WORDS). Префикс вне индекса заставил бы FTS5 собрать
+#   в памяти весь список документов по всем словам с этим началом — сотни миллисекунд на миллионе задач;
+# - совпадения идут от новых к старым, за один ответ просматривается не больше LOOKUP_WINDOW из них,
+#   страницы — по ключу (before — id, с которого продолжать), как в page_tasks;
+# - слова короче LOOKUP_MIN_PREFIX не ищутся; искать нечего — последние открытые задачи.
+LOOKUP_MIN_PREFIX = 2
+LOOKUP_INDEXED_PREFIX = 3
+LOOKUP_INDEXED_WORDS = 2
+LOOKUP_WINDOW = 2000
+LOOKUP_BATCH = 200
+
+def _lookup_matches(description, words):
+    tokens = re.findall(r'\w+', description.lower())
+    return all(any(token.startswith(word) for token in tokens) for word in words)
+
+# Строки задач по списку id (горячая таблица и архив по первичному ключу): {id: строка}
+def _tasks_by_id(conn, ids, chat_id=None):
+    owner, owner_params = _owner(chat_id)
+    found = {}
+    for table in TASK_TABLES:
+        rows = conn.execute(
+            f'SELECT {TASK_COLUMNS} FROM {table} WHERE id IN ({", ".join("?" * len(ids))}) AND {owner}',
+            (*ids, *owner_params)
+        )
+        for row in rows:
+            found[row[0]] = row
+    return found
+
+# Возвращает (строки в формате TASK_COLUMNS, id для следующей страницы или None)
+def lookup_tasks(conn, text, before=None, limit=PAGE_SIZE, chat_id=None):
+    owner, owner_params = _owner(chat_id)
+    text = text.strip()
+    number = text.lstrip('#')
+    words = [word for word in re.findall(r'\w+', text.lower()) if len(word) >= LOOKUP_MIN_PREFIX][:10]
+    before_params = (before,) if before is not None else ()
+
+    if not words and not number.isdigit():
+        rows = conn.execute(f'''
+            SELECT {TASK_COLUMNS} FROM tasks
+            WHERE is_closed = 0 AND {owner}{' AND id < ?' if before is not None else ''}
+            ORDER BY id DESC
+            LIMIT ?
+        ''', (*owner_params, *before_params, limit + 1)).fetchall()
+        return rows[:limit], rows[limit - 1][0] if len(rows) > limit else None
+
+    found = []
+    exact_id = None
+    if number.isdigit() and len(number) < 19:
+        task = get_task(conn, int(number), chat_id)
+        if task:
+            exact_id = task[0]
+            if before is None:
+                found.append(task)
+    # У пользователя, который ни разу не писал боту, задач нет — весь индекс просматривать незачем
+    if not words or not conn.execute(f'SELECT EXISTS(SELECT 1 FROM tasks_all WHERE {owner})', owner_params).fetchone()[0]:
+        return found, None
+
+    # Пересечение нескольких префиксов FTS5 считает сам, без ограничения окном: в индекс идут
+    # только самые длинные (самые избирательные) слова, остальные проверяются на строках
+    indexed = sorted(words, key=len, reverse=True)[:LOOKUP_INDEXED_WORDS]
+    query = ' '.join(f'"{word[:LOOKUP_INDEXED_PREFIX]}"*' for word in indexed)
+    checked = [word for word in words if word not in indexed or len(word) > LOOKUP_INDEXED_PREFIX]
+    cursor = conn.execute(f'''
+        SELECT rowid FROM tasks_fts
+        WHERE tasks_fts MATCH ?{' AND rowid < ?' if before is not None else ''}
+        ORDER BY rowid DESC
+    ''', (query, *before_params))
+    scanned = 0
+    last_id = None
+    try:
+        while len(found) <= limit and scanned < LOOKUP_WINDOW:
+            ids = [row[0] for row in cursor.fetchmany(LOOKUP_BATCH)]
+            if not ids:
+                return found, None
+            scanned += len(ids)
+            tasks = _tasks_by_id(conn, ids, chat_id)
+            for task_id in ids:
+                last_id = task_id
+                task = tasks.get(task_id)
+                if task is None or task_id == exact_id or not _lookup_matches(task[1], checked):
+                    continue
+                found.append(task)
+                if len(found) > limit:
+                    break
+    finally:
+        cursor.close()
+
+    if len(found) > limit:
+        return found[:limit], found[limit - 1][0]
+    # Окно просмотрено, а страница не набралась — следующая продолжит с последнего просмотренного id
+    return found, last_id
+
+# Открытые задачи для отчёта, для нескольких чатов одним запросом по idx_tasks_chat_status:
+# {chat_id: [(id, описание, возраст в секундах)]} — возраст считает SQLite
+def open_tasks_by_chat(conn, chat_ids):
+    tasks = {chat_id: [] for chat_id in chat_ids}
+    chat_ids = list(tasks)
+    for start in range(0, len(chat_ids), ID_CHUNK):
+        chunk = chat_ids[start:start + ID_CHUNK]
+        rows = conn.execute(f'''
+            SELECT chat_id, id, description, CAST(strftime('%s', 'now') AS INTEGER) - created_at
+            FROM tasks
+            WHERE chat_id IN ({', '.join('?' * len(chunk))}) AND is_closed = 0
+            ORDER BY chat_id, id
+        ''', chunk)
+        for chat_id, *row in rows:
+            tasks[chat_id].append(tuple(row))
+    return tasks
+
+# Закрытие задачи. Возвращает (статус, описание), статус: 'closed' | 'already_closed' | 'not_found'
+def close_task(conn, task_id, time_spent, chat_id=None):
+    with conn:
+        return mark_closed(conn, task_id, time_spent, chat_id)
+
+# Закрытие без своей транзакции (для групповой записи), результат как у close_task
+def mark_closed(conn, task_id, time_spent, chat_id=None):
+    now = int(time.time())
+    owner, owner_params = _owner(chat_id)
+    updated = conn.execute(f'''
+        UPDATE tasks
+        SET closed_at = ?, time_spent = ?, is_closed = 1
+        WHERE id = ? AND is_closed = 0 AND {owner}
+    ''', (now, time_spent, task_id, *owner_params)).rowcount
+    row = conn.execute(f'SELECT description FROM tasks_all WHERE id = ? AND {owner}', (task_id, *owner_params)).fetchone()
+    if not row:
+        return 'not_found', None
+    return ('closed' if updated else 'already_closed'), row[0]
+
+# Удаление задачи (из горячей таблицы или архива). Возвращает описание удалённой задачи или None
+def delete_task(conn, task_id, chat_id=None):
+    owner, owner_params = _owner(chat_id)
+    with conn:
+        row = conn.execute(f'SELECT description FROM tasks_all WHERE id = ? AND {owner}', (task_id, *owner_params)).fetchone()
+        if row:
+            for table in TASK_TABLES:
+                conn.execute(f'DELETE FROM {table} WHERE id = ?', (task_id,))
+    return row[0] if row else None
+
+def edit_task(conn, task_id, description, chat_id=None):
+    return _update_task(conn, task_id, 'description', description, chat_id)
+
+# Назначить исполнителя (None — снять). Возвращает, нашлась ли задача
+def set_assignee(conn, task_id, assignee, chat_id=None):
+    return _update_task(conn, task_id, 'assignee', (assignee or '').strip()[:MAX_ASSIGNEE] or None, chat_id)
+
+# Поставить срок (None — снять). Напоминание, которого нет или которое стояло на прежний срок,
+# переезжает на новый: по умолчанию задача напоминает о себе в момент срока. Возвращает, нашлась ли задача
+def set_due(conn, task_id, due_at, chat_id=None):
+    owner, owner_params = _owner(chat_id)
+    with conn:
+        # В SET справа везде старые значения строки
+        updated = sum(
+            conn.execute(f'''
+                UPDATE {table}
+                SET remind_at = CASE WHEN remind_at IS NULL OR remind_at IS due_at THEN ? ELSE remind_at END,
+                    due_at = ?
+                WHERE id = ? AND {owner}
+            ''', (due_at, due_at, task_id, *owner_params)).rowcount
+            for table in TASK_TABLES
+        )
+    return bool(updated)
+
+# Поставить напоминание (None — снять). Возвращает, нашлась ли задача
+def set_remind(conn, task_id, remind_at, chat_id=None):
+    return _update_task(conn, task_id, 'remind_at', remind_at, chat_id)
+
+def _update_task(conn, task_id, column, value, chat_id):
+    owner, owner_params = _owner(chat_id)
+    with conn:
+        updated = sum(
+            conn.execute(f'UPDATE {table} SET {column} = ? WHERE id = ? AND {owner}', (value, task_id, *owner_params)).rowcount
+            for table in TASK_TABLES
+        )
+    return bool(updated)
+
+# --- Массовые операции: весь пакет — одна транзакция и по одному executemany на действие ---
+
+# Сколько id подставляем в один IN (...) — с запасом ниже лимита переменных SQLite
+ID_CHUNK = 500
+
+# Текущее состояние задач пакета: {id: is_closed} (несуществующих и чужих id в словаре нет)
+def _task_states(conn, ids, chat_id=None):
+    owner, owner_params = _owner(chat_id)
+    states = {}
+    for start in range(0, len(ids), ID_CHUNK):
+        chunk = ids[start:start + ID_CHUNK]
+        placeholders = ', '.join('?' * len(chunk))
+        states.update(conn.execute(f'SELECT id, is_closed FROM tasks_all WHERE id IN ({placeholders}) AND {owner}', (*chunk, *owner_params)))
+    return states
+
+# Закрыть пачку задач. items — [(id, потраченные часы)].
+# Возвращает {id: 'closed' | 'already_closed' | 'not_found'}
+def bulk_close(conn, items, chat_id=None):
+    now = int(time.time())
+    items = list(dict(items).items())
+    with conn:
+        states = _task_states(conn, [task_id for task_id, _ in items], chat_id)
+        to_close = [(now, time_spent, task_id) for task_id, time_spent in items if states.get(task_id) == 0]
+        conn.executemany('UPDATE tasks SET closed_at = ?, time_spent = ?, is_closed = 1 WHERE id = ? AND is_closed = 0', to_close)
+    return {
+        task_id: 'not_found' if task_id not in states else ('closed' if states[task_id] == 0 else 'already_closed')
+        for task_id, _ in items
+    }
+
+# Удалить пачку задач. Возвращает {id: 'deleted' | 'not_found'}
+def bulk_delete(conn, ids, chat_id=None):
+    ids = list(dict.fromkeys(ids))
+    with conn:
+        states = _task_states(conn, ids, chat_id)
+        for table in TASK_TABLES:
+            conn.executemany(f'DELETE FROM {table} WHERE id = ?', [(task_id,) for task_id in ids if task_id in states])
+    return {task_id: 'deleted' if task_id in states else 'not_found' for task_id in ids}
+
+# Переименовать пачку задач. items — [(id, новое описание)]. Возвращает {id: 'updated' | 'not_found'}
+def bulk_edit(conn, items, chat_id=None):
+    items = list(dict(items).items())
+    with conn:
+        states = _task_states(conn, [task_id for task_id, _ in items], chat_id)
+        for table in TASK_TABLES:
+            conn.executemany(f'UPDATE {table} SET description = ? WHERE id = ?',
+                             [(description, task_id) for task_id, description in items if task_id in states])
+    return {task_id: 'updated' if task_id in states else 'not_found' for task_id, _ in items}
+
+# --- Архив: старые закрытые задачи переезжают из tasks в tasks_archive (см. миграцию archive) ---
+
+# Сколько задач переносим одной транзакцией — бот и веб успевают писать между пачками
+ARCHIVE_BATCH = 1000
+
+# Перенести в архив одну пачку задач, закрытых раньше closed_before (unix epoch).
+# Сначала удаление из tasks, потом вставка в архив: сводку и топ триггеры обеих таблиц сводят
+# к тем же значениям, а задача ни в какой момент не видна дважды. Возвращает число перенесённых
+def archive_batch(conn, closed_before, batch_size=ARCHIVE_BATCH):
+    conn.execute(f'CREATE TEMP TABLE IF NOT EXISTS archive_batch AS SELECT {STORED_COLUMNS} FROM tasks WHERE 0')
+    with conn:
+        conn.execute('DELETE FROM temp.archive_batch')
+        moved = conn.execute(f'''
+            INSERT INTO temp.archive_batch
+            SELECT {STORED_COLUMNS} FROM tasks
+            WHERE is_closed = 1 AND closed_at < ?
+            ORDER BY closed_at
+            LIMIT ?
+        ''', (closed_before, batch_size)).rowcount
+        if moved:
+            conn.execute('DELETE FROM tasks WHERE id IN (SELECT id FROM temp.archive_batch)')
+            conn.execute(f'INSERT INTO tasks_archive ({STORED_COLUMNS}) SELECT {STORED_COLUMNS} FROM temp.archive_batch')
+    return moved
+
+# Перенести в архив все задачи, закрытые больше older_than_days дней назад. Возвращает их число
+def archive_closed(conn, older_than_days, batch_size=ARCHIVE_BATCH):
+    closed_before = int(time.time() - older_than_days * 86400)
+    total = 0
+    while True:
+        moved = archive_batch(conn, closed_before, batch_size)
+        total += moved
+        if moved < batch_size:
+            return total
+
+# Размер горячей таблицы и архива
+def archive_counts(conn):
+    return {table: conn.execute(f'SELECT COUNT(*) FROM {table}').fetchone()[0] for table in TASK_TABLES}
+
+# --- Напоминания (см. миграцию deadlines и reminders.py) ---
+
+# Сколько сработавших напоминаний забирается одним чтением
+REMINDER_BATCH = 500
+
+REMINDER_PENDING = 'remind_at IS NOT NULL AND is_closed = 0'
+
+# Время ближайшего ждущего напоминания — первая запись частичного индекса idx_tasks_remind. None — ждать нечего
+def next_reminder(conn):
+    row = conn.execute(f'SELECT remind_at FROM tasks WHERE {REMINDER_PENDING} ORDER BY remind_at LIMIT 1').fetchone()
+    return row[0] if row else None
+
+# Сработавшие к now напоминания, самые ранние первыми: (id, описание, срок, напоминание, chat_id)
+def due_reminders(conn, now, limit=REMINDER_BATCH):
+    return conn.execute(f'''
+        SELECT id, description, due_at, remind_at, chat_id
+        FROM tasks
+        WHERE {REMINDER_PENDING} AND remind_at <= ?
+        ORDER BY remind_at
+        LIMIT ?
+    ''', (now, limit)).fetchall()
+
+# Снять отправленные напоминания: пары (id, remind_at). Если напоминание успели переставить, оно остаётся
+def clear_reminders(conn, reminders):
+    with conn:
+        conn.executemany('UPDATE tasks SET remind_at = NULL WHERE id = ? AND remind_at = ?', reminders)
+
+# Отложить неотправленные напоминания: тройки (id, remind_at, когда повторить). Переставленные не трогаем
+def postpone_reminders(conn, reminders):
+    with conn:
+        conn.executemany('UPDATE tasks SET remind_at = ? WHERE id = ? AND remind_at = ?',
+                         [(retry_at, task_id, remind_at) for task_id, remind_at, retry_at in reminders])
+
+# --- Владельцы задач ---
+
+# Отдать задачи чату: перечисленные id или (без ids) все задачи без владельца. Пачками по batch_size
+# в отдельных транзакциях. Возвращает число переданных задач
+def claim_tasks(conn, chat_id, ids=None, batch_size=ARCHIVE_BATCH):
+    claimed = 0
+    for table in TASK_TABLES:
+        if ids is not None:
+            for start in range(0, len(ids), ID_CHUNK):
+                chunk = ids[start:start + ID_CHUNK]
+                with conn:
+                    claimed += conn.execute(
+                        f'UPDATE {table} SET chat_id = ? WHERE id IN ({", ".join("?" * len(chunk))})', (chat_id, *chunk)
+                    ).rowcount
+            continue
+        while True:
+            with conn:
+                updated = conn.execute(
+                    f'UPDATE {table} SET chat_id = ? WHERE id IN (SELECT id FROM {table} WHERE chat_id IS NULL LIMIT ?)',
+                    (chat_id, batch_size)
+                ).rowcount
+            claimed += updated
+            if updated < batch_size:
+                break
+    return claimed
+
+# Чаты, у которых есть задачи (в том числе архивные). DISTINCT по индексу прошёл бы его целиком,
+# поэтому перескакиваем от чата к следующему: по одному поиску в индексе на чат
+def task_chats(conn):
+    chats = set()
+    for table in TASK_TABLES:
+        chats.update(row[0] for row in conn.execute(f'''
+            WITH RECURSIVE chats(chat_id) AS (
+                SELECT MIN(chat_id) FROM {table}
+                UNION ALL
+                SELECT (SELECT MIN(chat_id) FROM {table} WHERE chat_id > chats.chat_id) FROM chats WHERE chat_id IS NOT NULL
+            )
+            SELECT chat_id FROM chats WHERE chat_id IS NOT NULL
+        '''))
+    return sorted(chats)
+
+# Сколько задач ещё без владельца
+def unowned_count(conn):
+    return sum(conn.execute(f'SELECT COUNT(*) FROM {table} WHERE chat_id IS NULL').fetchone()[0] for table in TASK_TABLES)
+
+# --- Подписки на ежедневный отчёт ---
+
+def subscribe_report(conn, chat_id, minute_of_day, tz):
+    with conn:
+        conn.execute('''
+            INSERT INTO report_subscriptions (chat_id, minute_of_day, tz) VALUES (?, ?, ?)
+            ON CONFLICT(chat_id) DO UPDATE SET minute_of_day = excluded.minute_of_day, tz = excluded.tz
+        ''', (chat_id, minute_of_day, tz))
+
+def unsubscribe_report(conn, chat_id):
+    with conn:
+        deleted = conn.execute('DELETE FROM report_subscriptions WHERE chat_id = ?', (chat_id,)).rowcount
+    return bool(deleted)
+
+def get_report_subscription(conn, chat_id):
+    return conn.execute('SELECT minute_of_day, tz FROM report_subscriptions WHERE chat_id = ?', (chat_id,)).fetchone()
+
+# Часовые пояса, в которых есть подписчики (читается только индекс)
+def report_timezones(conn):
+    return [row[0] for row in conn.execute('SELECT DISTINCT tz FROM report_subscriptions')]
+
+# Чаты, которым пора отправить отчёт. slots — пары (часовой пояс, текущая минута суток в нём);
+# на каждую пару — поиск по индексу idx_report_subscriptions_due
+def due_report_chats(conn, slots):
+    if not slots:
+        return []
+    condition = ' OR '.join(['(tz = ? AND minute_of_day = ?)'] * len(slots))
+    params = [value for slot in slots for value in slot]
+    return [row[0] for row in conn.execute(f'SELECT chat_id FROM report_subscriptions WHERE {condition}', params)]
+
+
+# Асинхронный репозиторий для бота: одно долгоживущее соединение и отдельный поток под него,
+# чтобы event loop никогда не ждал диска. writes — групповая запись (group_commit.GroupCommit):
+# если задана, добавление и закрытие задач идут через неё и коммитятся пачками
+class TaskRepository:
+    def __init__(self, path=DATABASE, writes=None):
+        self.path = path
+        self.writes = writes
+        self._conn = None
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='tasks-db')
+
+    # Выполняется в потоке БД: соединение создаётся лениво и живёт в этом же потоке
+    def _call(self, func, *args):
+        if self._conn is None:
+            self._conn = connect(self.path)
+        return func(self._conn, *args)
+
+    # Запустить любую функцию вида func(conn, *args) в потоке БД
+    async def run(self, func, *args):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._executor, self._call, func, *args)
+
+    async def data_version(self):
+        return await self.run(data_version)
+
+    # chat_id — чат, в котором работает пользователь: бот видит и меняет только задачи этого чата
+
+    async def add_task(self, description, chat_id=None):
+        if self.writes:
+            return await self.writes.run(insert_task, description, chat_id)
+        return await self.run(add_task, description, chat_id)
+
+    async def get_task(self, task_id, chat_id=None):
+        return await self.run(get_task, task_id, chat_id)
+
+    async def page_tasks(self, filter_type='all', after=None, before=None, limit=PAGE_SIZE, chat_id=None):
+        return await self.run(page_tasks, filter_type, after, before, limit, chat_id)
+
+    async def search_tasks(self, text, status='all', offset=0, limit=PAGE_SIZE, chat_id=None):
+        return await self.run(search_tasks, text, status, offset, limit, chat_id)
+
+    async def lookup_tasks(self, text, before=None, limit=PAGE_SIZE, chat_id=None):
+        return await self.run(lookup_tasks, text, before, limit, chat_id)
+
+    async def open_tasks_by_chat(self, chat_ids):
+        return await self.run(open_tasks_by_chat, chat_ids)
+
+    async def close_task(self, task_id, time_spent, chat_id=None):
+        if self.writes:
+            return await self.writes.run(mark_closed, task_id, time_spent, chat_id)
+        return await self.run(close_task, task_id, time_spent, chat_id)
+
+    async def delete_task(self, task_id, chat_id=None):
+        return await self.run(delete_task, task_id, chat_id)
+
+    async def edit_task(self, task_id, description, chat_id=None):
+        return await self.run(edit_task, task_id, description, chat_id)
+
+    async def set_assignee(self, task_id, assignee, chat_id=None):
+        return await self.run(set_assignee, task_id, assignee, chat_id)
+
+    async def set_due(self, task_id, due_at, chat_id=None):
+        return await self.run(set_due, task_id, due_at, chat_id)
+
+    async def set_remind(self, task_id, remind_at, chat_id=None):
+        return await self.run(set_remind, task_id, remind_at, chat_id)
+
+    async def next_reminder(self):
+        return await self.run(next_reminder)
+
+    async def due_reminders(self, now, limit=REMINDER_BATCH):
+        return await self.run(due_reminders, now, limit)
+
+    async def clear_reminders(self, reminders):
+        return await self.run(clear_reminders, reminders)
+
+    async def postpone_reminders(self, reminders):
+        return await self.run(postpone_reminders, reminders)
+
+    async def bulk_close(self, items, chat_id=None):
+        return await self.run(bulk_close, items, chat_id)
+
+    async def bulk_delete(self, ids, chat_id=None):
+        return await self.run(bulk_delete, ids, chat_id)
+
+    async def subscribe_report(self, chat_id, minute_of_day, tz):
+        return await self.run(subscribe_report, chat_id, minute_of_day, tz)
+
+    async def unsubscribe_report(self, chat_id):
+        return await self.run(unsubscribe_report, chat_id)
+
+    async def get_report_subscription(self, chat_id):
+        return await self.run(get_report_subscription, chat_id)
+
+    async def report_timezones(self):
+        return await self.run(report_timezones)
+
+    async def due_report_chats(self, slots):
+        return await self.run(due_report_chats, slots)
+
+    def _close_conn(self):
+        if self._conn is not None:
+            self._conn.close()
+            self._conn = None
+
+    # Сначала дописываем очередь групповой записи, потом закрываем своё соединение
+    async def close(self):
+        loop = asyncio.get_running_loop()
+        if self.writes:
+            await loop.run_in_executor(None, self.writes.close)
+        await loop.run_in_executor(self._executor, self._close_conn)
+        self._executor.shutdown(wait=True)
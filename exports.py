@@ -0,0 +1,142 @@
+import csv
+import glob
+import io
+import json
+import os
+import threading
+
+from openpyxl import Workbook
+
+import db
+
+# Готовые xlsx кладём рядом с базой; имя файла содержит версию данных,
+# поэтому повторная выгрузка неизменённой таблицы — это просто отдача готового файла
+EXPORT_DIR = os.path.join(os.path.dirname(os.path.abspath(db.DATABASE)), 'exports')
+KEEP_ARTIFACTS = 3
+
+# Сколько строк читаем из курсора за раз — память не зависит от размера таблицы
+CHUNK_SIZE = 1000
+
+HEADERS = ['ID', 'Описание', 'Создана', 'Закрыта', 'Потрачено часов', 'Статус', 'Исполнитель', 'Чат', 'Срок']
+JSON_FIELDS = ['id', 'description', 'created_at', 'closed_at', 'time_spent', 'status', 'assignee', 'chat_id', 'due_at']
+
+EXPORT_QUERY = '''
+    SELECT
+        id,
+        description,
+        datetime(created_at, 'unixepoch', 'localtime'),
+        datetime(closed_at, 'unixepoch', 'localtime'),
+        time_spent,
+        CASE WHEN is_closed = 1 THEN 'Закрыта' ELSE 'Открыта' END as status,
+        assignee,
+        chat_id,
+        strftime('%Y-%m-%d %H:%M', due_at, 'unixepoch', 'localtime')
+    FROM tasks_all
+    ORDER BY id DESC
+'''
+
+# Построчное чтение выгрузки пачками по CHUNK_SIZE
+def iter_rows(conn):
+    cursor = conn.execute(EXPORT_QUERY)
+    while True:
+        rows = cursor.fetchmany(CHUNK_SIZE)
+        if not rows:
+            break
+        yield from rows
+
+# Генератор CSV для потоковой отдачи: каждая пачка строк — отдельный кусок ответа.
+# Соединение открывается внутри, чтобы жить ровно столько, сколько идёт отдача
+def stream_csv(path=db.DATABASE):
+    conn = db.connect(path)
+    try:
+        buffer = io.StringIO()
+        writer = csv.writer(buffer)
+        # BOM — чтобы Excel правильно открыл кириллицу
+        buffer.write('\ufeff')
+        writer.writerow(HEADERS)
+        for i, row in enumerate(iter_rows(conn), start=1):
+            writer.writerow(row)
+            if i % CHUNK_SIZE == 0:
+                yield buffer.getvalue()
+                buffer.seek(0)
+                buffer.truncate()
+        yield buffer.getvalue()
+    finally:
+        conn.close()
+
+def stream_ndjson(path=db.DATABASE):
+    conn = db.connect(path)
+    try:
+        lines = []
+        for row in iter_rows(conn):
+            lines.append(json.dumps(dict(zip(JSON_FIELDS, row)), ensure_ascii=False))
+            if len(lines) == CHUNK_SIZE:
+                yield '\n'.join(lines) + '\n'
+                lines = []
+        if lines:
+            yield '\n'.join(lines) + '\n'
+    finally:
+        conn.close()
+
+def xlsx_path(version):
+    return os.path.join(EXPORT_DIR, f'tasks_v{version}.xlsx')
+
+# Готовый файл для текущей версии данных или None
+def cached_xlsx(conn):
+    path = xlsx_path(db.data_version(conn))
+    return path if os.path.exists(path) else None
+
+# Число задач вместе с архивом — из сводки task_stats, без прохода по таблицам
+def count_rows(conn):
+    return conn.execute('SELECT total FROM task_stats WHERE id = 1').fetchone()[0]
+
+# Собрать xlsx в кэш. openpyxl в write-only режиме пишет строки сразу на диск.
+# Вся выгрузка читается в одной транзакции, поэтому данные точно соответствуют версии в имени файла.
+# job (если передан) получает прогресс. Возвращает путь к файлу
+def build_xlsx(path=db.DATABASE, job=None):
+    conn = db.connect(path, isolation_level=None)
+    try:
+        conn.execute('BEGIN')
+        version = db.data_version(conn)
+        target = xlsx_path(version)
+        if os.path.exists(target):
+            return target
+
+        total = count_rows(conn)
+        if job:
+            job.progress(0, total)
+
+        workbook = Workbook(write_only=True)
+        sheet = workbook.create_sheet('Задачи')
+        sheet.append(HEADERS)
+        for i, row in enumerate(iter_rows(conn), start=1):
+            sheet.append(row)
+            if job and i % CHUNK_SIZE == 0:
+                job.progress(i)
+
+        os.makedirs(EXPORT_DIR, exist_ok=True)
+        tmp = f'{target}.{os.getpid()}.{threading.get_ident()}.tmp'
+        workbook.save(tmp)
+        os.replace(tmp, target)
+        if job:
+            job.progress(total)
+        conn.execute('COMMIT')
+    finally:
+        conn.close()
+
+    _cleanup(keep=target)
+    return target
+
+# Фоновая задача экспорта для JobManager
+def xlsx_job(job, path=db.DATABASE):
+    return build_xlsx(path, job)
+
+# Удаляем старые выгрузки, оставляя несколько последних
+def _cleanup(keep):
+    files = sorted(glob.glob(os.path.join(EXPORT_DIR, 'tasks_v*.xlsx')), key=os.path.getmtime, reverse=True)
+    for old in files[KEEP_ARTIFACTS:]:
+        if old != keep:
+            try:
+                os.remove(old)
+            except OSError:
+                pass
@@ -0,0 +1,165 @@
+import asyncio
+import logging
+import os
+import queue
+import threading
+import time
+from concurrent.futures import Future
+
+import db
+import metrics
+
+logger = logging.getLogger(__name__)
+
+# Групповая запись: мелкие изменения (добавление и закрытие задач), пришедшие почти одновременно,
+# уходят в базу одной транзакцией — один fsync на пачку вместо одного на каждую операцию.
+#
+# Операции встают в очередь; поток записи со своим соединением берёт всё, что в ней накопилось
+# (не больше max_batch), и выполняет одной транзакцией. Каждая операция — в своём SAVEPOINT:
+# ошибка одной откатывает только её, вызывающий получает своё исключение, остальные пишутся.
+# Одиночная запись не ждёт: окно max_delay открывается, только если в очереди уже лежала
+# не одна операция (идёт пачка) — тогда поток ещё до max_delay секунд добирает опоздавших.
+# Пока идёт коммит, следующие операции копятся в очереди и уходят следующей пачкой.
+#
+# Надёжность как раньше: результат (id задачи, статус закрытия) вызывающий получает только после
+# COMMIT его пачки, с тем же журналом и synchronous, что у db.connect. Если коммит не удался,
+# исключение получает каждый вызывающий из пачки.
+#
+# Размер пачки и окно задаются переменными окружения WRITE_BATCH_SIZE и WRITE_BATCH_DELAY (секунды)
+
+MAX_BATCH = int(os.environ.get('WRITE_BATCH_SIZE', 64))
+MAX_DELAY = float(os.environ.get('WRITE_BATCH_DELAY', 0.002))
+
+_STOP = object()
+
+
+class GroupCommit:
+    def __init__(self, path=db.DATABASE, max_batch=MAX_BATCH, max_delay=MAX_DELAY):
+        self.path = path
+        self.max_batch = max(1, max_batch)
+        self.max_delay = max_delay
+        self._queue = queue.SimpleQueue()
+        self._lock = threading.Lock()
+        self._thread = None
+        self._closed = False
+
+    # Поставить func(conn, *args) в очередь. func не открывает своих транзакций (db.insert_task, db.mark_closed).
+    # Поток записи запускается при первой операции: импорт модуля и fork ничего не запускают
+    def submit(self, func, *args):
+        future = Future()
+        with self._lock:
+            if self._closed:
+                raise RuntimeError("Очередь записи закрыта")
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name='tasks-writer', daemon=True)
+                self._thread.start()
+            self._queue.put((func, args, future))
+        return future
+
+    # Для потоков (веб): дождаться коммита и вернуть результат
+    def call(self, func, *args):
+        return self.submit(func, *args).result()
+
+    # Для event loop (бот)
+    async def run(self, func, *args):
+        return await asyncio.wrap_future(self.submit(func, *args))
+
+    # Дописать всё, что уже в очереди, и остановить поток
+    def close(self):
+        with self._lock:
+            if self._closed:
+                return
+            self._closed = True
+            thread = self._thread
+            self._queue.put(_STOP)
+        if thread is not None:
+            thread.join()
+
+    def _run(self):
+        conn = None
+        try:
+            stop = False
+            while not stop:
+                batch, stop = self._collect()
+                if not batch:
+                    continue
+                try:
+                    if conn is None:
+                        # Транзакциями управляем сами: BEGIN/SAVEPOINT/COMMIT без неявных транзакций модуля sqlite3
+                        conn = db.connect(self.path, isolation_level=None)
+                    self._commit(conn, batch)
+                except Exception as e:
+                    logger.exception("Групповая запись не удалась (%s операций)", len(batch))
+                    self._fail(conn, batch, e)
+        finally:
+            if conn is not None:
+                conn.close()
+
+    # Следующая пачка: (операции, пора ли останавливаться)
+    def _collect(self):
+        item = self._queue.get()
+        if item is _STOP:
+            return [], True
+        batch = [item]
+        deadline = None
+        while len(batch) < self.max_batch:
+            try:
+                if deadline is None:
+                    item = self._queue.get_nowait()
+                else:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        break
+                    item = self._queue.get(timeout=remaining)
+            except queue.Empty:
+                # Очередь пуста. Одна операция — пишем сразу; пачка — ждём опоздавших до max_delay
+                if deadline is not None or len(batch) == 1 or self.max_delay <= 0:
+                    break
+                deadline = time.monotonic() + self.max_delay
+                continue
+            if item is _STOP:
+                return batch, True
+            batch.append(item)
+        return batch, False
+
+    # Пачка одной транзакцией; результаты раздаются только после COMMIT
+    def _commit(self, conn, batch):
+        outcomes = []
+        conn.execute('BEGIN IMMEDIATE')
+        for func, args, future in batch:
+            # Отменённую до начала записи операцию не выполняем
+            if not future.set_running_or_notify_cancel():
+                continue
+            conn.execute('SAVEPOINT op')
+            try:
+                result = func(conn, *args)
+            except Exception as e:
+                conn.execute('ROLLBACK TO op')
+                conn.execute('RELEASE op')
+                outcomes.append((future, None, e))
+            else:
+                conn.execute('RELEASE op')
+                outcomes.append((future, result, None))
+        conn.execute('COMMIT')
+
+        metrics.WRITE_BATCH_SIZE.observe(len(outcomes))
+        for future, result, error in outcomes:
+            if error is None:
+                future.set_result(result)
+            else:
+                future.set_exception(error)
+
+    # Пачка не записалась: откатить и отдать ошибку каждому, кто ещё ждёт
+    def _fail(self, conn, batch, error):
+        if conn is not None and conn.in_transaction:
+            try:
+                conn.execute('ROLLBACK')
+            except Exception:
+                logger.exception("Не удалось откатить групповую запись")
+        for _, _, future in batch:
+            # Отменённые и уже получившие результат пропускаем: повторная установка бросила бы
+            # исключение прямо в потоке записи, и он бы остановился
+            if future.done():
+                continue
+            if future.running() or future.set_running_or_notify_cancel():
+                future.set_exception(error)
@@ -0,0 +1,114 @@
+import functools
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+from email.utils import formatdate
+
+from flask import Response, make_response, request, session
+
+# Кэш ответов веб-интерфейса и условные GET (ETag / Last-Modified -> 304).
+#
+# Ключ — маршрут с параметрами и версия данных (db.data_version: счётчик в meta, который
+# триггеры увеличивают при любой записи в tasks — и из бота, и из веба). Пока версия та же,
+# ответ берётся из памяти, а браузер с совпавшим ETag получает 304 без тела.
+# Любая запись меняет версию, и все закэшированные ответы разом становятся неактуальными.
+
+# Сколько ответов держим и до какого размера тело вообще кэшируется
+MAX_ENTRIES = 256
+MAX_BODY_BYTES = 2 * 1024 * 1024
+
+
+class ResponseCache:
+    def __init__(self, max_entries=MAX_ENTRIES, max_body_bytes=MAX_BODY_BYTES):
+        self.max_entries = max_entries
+        self.max_body_bytes = max_body_bytes
+        self._entries = OrderedDict()  # ключ -> (версия, тело, content-type, статус)
+        self._lock = threading.Lock()
+        # Когда этот процесс впервые увидел текущую версию данных — это и есть Last-Modified.
+        # Точность заголовка — секунда, поэтому каждая новая версия получает время строго больше
+        # предыдущей, иначе две записи за секунду дали бы ложный 304 по If-Modified-Since
+        self._version = None
+        self._version_seen_at = 0
+        self.hits = 0
+        self.misses = 0
+
+    def last_modified(self, version):
+        with self._lock:
+            if version != self._version:
+                self._version = version
+                self._version_seen_at = max(int(time.time()), self._version_seen_at + 1)
+            return self._version_seen_at
+
+    def get(self, key, version):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry[0] != version:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry
+
+    def put(self, key, version, response):
+        body = response.get_data()
+        if len(body) > self.max_body_bytes:
+            return
+        with self._lock:
+            self._entries[key] = (version, body, response.content_type, response.status_code)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+
+def _etag(version, key):
+    digest = hashlib.blake2b(repr(key).encode(), digest_size=6).hexdigest()
+    return f'{version}-{digest}'
+
+def _not_modified(etag, last_modified):
+    if request.if_none_match:
+        return request.if_none_match.contains(etag)
+    if request.if_modified_since:
+        return last_modified <= request.if_modified_since.timestamp()
+    return False
+
+def _validators(response, etag, last_modified):
+    response.set_etag(etag)
+    response.headers['Last-Modified'] = formatdate(last_modified, usegmt=True)
+    # Браузер может хранить ответ, но обязан перепроверять его при каждом запросе
+    response.headers['Cache-Control'] = 'private, no-cache'
+    return response
+
+# Декоратор GET-представления. get_version() — текущая версия данных (дешёвый запрос).
+# store=False — только условный GET без хранения тела (файлы, потоковые выгрузки).
+# Пока в сессии есть flash-сообщения, страница рендерится заново: сообщения должны показаться
+def conditional(cache, get_version, store=True):
+    def decorator(view):
+        @functools.wraps(view)
+        def wrapper(*args, **kwargs):
+            if request.method != 'GET' or session.get('_flashes'):
+                return view(*args, **kwargs)
+
+            version = get_version()
+            key = (request.endpoint, request.full_path)
+            etag = _etag(version, key)
+            last_modified = cache.last_modified(version)
+
+            if _not_modified(etag, last_modified):
+                return _validators(Response(status=304), etag, last_modified)
+
+            if store:
+                entry = cache.get(key, version)
+                if entry is not None:
+                    _, body, content_type, status = entry
+                    return _validators(Response(body, status=status, content_type=content_type), etag, last_modified)
+
+            response = make_response(view(*args, **kwargs))
+            if response.status_code != 200:
+                return response
+            # Пока рендерилась страница, flash мог появиться — такой ответ не кэшируем
+            if store and not response.is_streamed and not response.direct_passthrough and not session.get('_flashes'):
+                cache.put(key, version, response)
+            return _validators(response, etag, last_modified)
+        return wrapper
+    return decorator
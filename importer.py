@@ -0,0 +1,355 @@
+import codecs
+import csv
+import glob
+import io
+import math
+import os
+import re
+import time
+from datetime import datetime
+
+from openpyxl import load_workbook
+
+import db
+
+# Массовый импорт задач из CSV/XLSX (веб-загрузка и документ в боте).
+#
+# Файл читается построчно (csv-модуль, openpyxl в read_only), строки проверяются и пишутся
+# пачками по CHUNK_SIZE в отдельных транзакциях — память не зависит от размера файла, а бот
+# и веб успевают писать между пачками. Отклонённые строки уходят в CSV-отчёт рядом с базой.
+# Понимает и собственную выгрузку (exports.HEADERS): её можно загрузить обратно, id выдаются новые.
+
+IMPORT_DIR = os.path.join(os.path.dirname(os.path.abspath(db.DATABASE)), 'imports')
+KEEP_REPORTS = 20
+
+SUPPORTED_EXTENSIONS = ('.csv', '.xlsx')
+
+# Сколько строк вставляем одной транзакцией
+CHUNK_SIZE = 1000
+# Сколько ошибок возвращаем в результате (все остальные — только в файле отчёта)
+SAMPLE_ERRORS = 20
+MAX_DESCRIPTION = 4000
+
+# Названия столбцов (без регистра, ё = е) -> поле задачи
+COLUMN_ALIASES = {
+    'description': ('описание', 'задача', 'description', 'task', 'title', 'text'),
+    'created_at': ('создана', 'дата создания', 'created', 'created_at'),
+    'closed_at': ('закрыта', 'дата закрытия', 'closed', 'closed_at'),
+    'time_spent': ('потрачено часов', 'часы', 'время', 'time_spent', 'hours'),
+    'status': ('статус', 'status'),
+    'assignee': ('исполнитель', 'ответственный', 'assignee'),
+    'chat_id': ('чат', 'chat', 'chat_id'),
+    'due_at': ('срок', 'due', 'due_at', 'deadline'),
+}
+
+CLOSED_VALUES = {'закрыта', 'закрыто', 'closed', 'done', 'да', 'yes', 'true', '1'}
+OPEN_VALUES = {'открыта', 'открыто', 'open', 'нет', 'no', 'false', '0', ''}
+
+# ГГГГ-ММ-ДД и ДД.ММ.ГГГГ, время (ЧЧ:ММ[:СС]) необязательно. Регулярки вместо strptime:
+# strptime перебором форматов съедал больше половины времени импорта
+ISO_DATE = re.compile(r'(\d{4})-(\d{1,2})-(\d{1,2})(?:[ T](\d{1,2}):(\d{2})(?::(\d{2}))?)?')
+RU_DATE = re.compile(r'(\d{1,2})\.(\d{1,2})\.(\d{4})(?: (\d{1,2}):(\d{2})(?::(\d{2}))?)?')
+
+INSERT_QUERY = '''
+    INSERT INTO tasks (description, created_at, closed_at, time_spent, is_closed, assignee, chat_id, due_at, remind_at)
+    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+'''
+
+
+class ImportFileError(Exception):
+    pass
+
+
+def _normalize(value):
+    return str(value).strip().lower().replace('ё', 'е') if value is not None else ''
+
+# Сопоставить заголовок столбцам: {поле: индекс}. Пусто — заголовка нет
+def detect_columns(header):
+    columns = {}
+    for index, cell in enumerate(header):
+        name = _normalize(cell)
+        for field, aliases in COLUMN_ALIASES.items():
+            if name in aliases and field not in columns:
+                columns[field] = index
+    return columns if 'description' in columns else {}
+
+# Дата в unix epoch (локальное время, как в выгрузке). Пусто -> None
+def parse_timestamp(value):
+    if value is None or value == '':
+        return None
+    if isinstance(value, datetime):
+        return int(value.timestamp())
+    if isinstance(value, (int, float)):
+        if value >= 1e9:
+            return int(value)
+        raise ValueError(f"непонятная дата: {value}")
+    text = str(value).strip()
+    if not text:
+        return None
+    if text.isdigit() and len(text) >= 9:
+        return int(text)
+    match = ISO_DATE.fullmatch(text)
+    if match:
+        year, month, day, hour, minute, second = match.groups()
+    else:
+        match = RU_DATE.fullmatch(text)
+        if not match:
+            raise ValueError(f"непонятная дата: {text[:40]}")
+        day, month, year, hour, minute, second = match.groups()
+    try:
+        moment = datetime(int(year), int(month), int(day), int(hour or 0), int(minute or 0), int(second or 0))
+    except ValueError:
+        raise ValueError(f"непонятная дата: {text[:40]}")
+    return int(moment.timestamp())
+
+# Потраченные часы: неотрицательное конечное число (запятая вместо точки допустима). Пусто — None
+def parse_hours(value):
+    if value is None or value == '':
+        return None
+    if isinstance(value, (int, float)):
+        hours = float(value)
+    else:
+        text = str(value).strip().replace(',', '.')
+        if not text:
+            return None
+        try:
+            hours = float(text)
+        except ValueError:
+            raise ValueError(f"время должно быть числом: {text[:40]}")
+    if hours < 0 or not math.isfinite(hours):
+        raise ValueError(f"недопустимое время: {value}")
+    return hours
+
+def parse_chat(value):
+    if value is None or value == '':
+        return None
+    if isinstance(value, float) and value.is_integer():
+        return int(value)
+    if isinstance(value, int):
+        return value
+    text = str(value).strip()
+    if not text:
+        return None
+    try:
+        return int(text)
+    except ValueError:
+        raise ValueError(f"чат должен быть числом: {text[:40]}")
+
+def _cell(values, columns, field):
+    index = columns.get(field)
+    if index is None or index >= len(values):
+        return None
+    return values[index]
+
+# Строка файла -> параметры INSERT_QUERY. ValueError с понятным текстом, если строка не годится.
+# chat_id — чат, которому принадлежат все задачи файла (столбец "Чат" тогда не читается),
+# default_chat_id — чат для строк, где столбец "Чат" пуст. Задачи без чата не импортируются
+def parse_row(values, columns, now, chat_id=None, default_chat_id=None):
+    raw_description = _cell(values, columns, 'description')
+    description = str(raw_description).strip() if raw_description is not None else ''
+    if not description:
+        raise ValueError("пустое описание")
+    if len(description) > MAX_DESCRIPTION:
+        raise ValueError(f"описание длиннее {MAX_DESCRIPTION} символов")
+
+    created_at = parse_timestamp(_cell(values, columns, 'created_at')) or now
+    closed_at = parse_timestamp(_cell(values, columns, 'closed_at'))
+    time_spent = parse_hours(_cell(values, columns, 'time_spent'))
+
+    status = _normalize(_cell(values, columns, 'status'))
+    if status in CLOSED_VALUES:
+        is_closed = 1
+    elif status in OPEN_VALUES:
+        # Без статуса задача закрыта, если указана дата закрытия
+        is_closed = 1 if not status and closed_at is not None else 0
+    else:
+        raise ValueError(f"неизвестный статус: {status[:40]}")
+
+    if is_closed:
+        closed_at = closed_at or now
+        if closed_at < created_at:
+            raise ValueError("дата закрытия раньше даты создания")
+    else:
+        closed_at = time_spent = None
+
+    raw_assignee = _cell(values, columns, 'assignee')
+    assignee = str(raw_assignee).strip()[:db.MAX_ASSIGNEE] if raw_assignee is not None else ''
+    if chat_id is None:
+        chat_id = parse_chat(_cell(values, columns, 'chat_id'))
+    if chat_id is None:
+        chat_id = default_chat_id
+    if chat_id is None:
+        raise ValueError("не указан чат")
+
+    # Напоминание в момент срока — только открытым задачам и только о будущем сроке,
+    # чтобы импорт просроченных задач не обернулся рассылкой
+    due_at = parse_timestamp(_cell(values, columns, 'due_at'))
+    remind_at = due_at if due_at is not None and not is_closed and due_at > now else None
+    return description, created_at, closed_at, time_spent, is_closed, assignee or None, chat_id, due_at, remind_at
+
+
+# --- Чтение файлов: генераторы (номер строки, значения, (прочитано, всего)) ---
+
+def _detect_encoding(sample):
+    decoder = codecs.getincrementaldecoder('utf-8')()
+    try:
+        decoder.decode(sample, final=False)
+        return 'utf-8-sig'
+    except UnicodeDecodeError:
+        # Excel под Windows сохраняет CSV в cp1251
+        return 'cp1251'
+
+def iter_csv(source):
+    total = os.path.getsize(source)
+    with open(source, 'rb') as raw:
+        sample = raw.read(64 * 1024)
+        raw.seek(0)
+        encoding = _detect_encoding(sample)
+        text = sample.decode(encoding, errors='ignore')
+        try:
+            dialect = csv.Sniffer().sniff(text[:16 * 1024], delimiters=',;\t')
+        except csv.Error:
+            dialect = csv.excel
+
+        reader = csv.reader(io.TextIOWrapper(raw, encoding=encoding, newline=''), dialect)
+        try:
+            for values in reader:
+                yield reader.line_num, values, (raw.tell(), total)
+        except (csv.Error, UnicodeDecodeError) as e:
+            raise ImportFileError(f"Файл не читается после строки {reader.line_num}: {e}")
+
+def iter_xlsx(source):
+    try:
+        workbook = load_workbook(source, read_only=True, data_only=True)
+    except Exception as e:
+        raise ImportFileError(f"Это не xlsx-файл: {e}")
+    try:
+        sheet = workbook.worksheets[0]
+        total = sheet.max_row
+        for number, values in enumerate(sheet.iter_rows(values_only=True), start=1):
+            yield number, values, (number, total)
+    finally:
+        workbook.close()
+
+def iter_file(source, filename=None):
+    extension = os.path.splitext(filename or source)[1].lower()
+    if extension == '.csv':
+        return iter_csv(source)
+    if extension == '.xlsx':
+        return iter_xlsx(source)
+    raise ImportFileError("Поддерживаются только файлы .csv и .xlsx")
+
+
+# --- Импорт ---
+
+def report_path(name):
+    return os.path.join(IMPORT_DIR, f'import_{name}_errors.csv')
+
+class _ErrorReport:
+    def __init__(self, name):
+        self.name = name
+        self.path = None
+        self.count = 0
+        self.sample = []
+        self._file = None
+        self._writer = None
+
+    def add(self, line, error, values):
+        self.count += 1
+        if len(self.sample) < SAMPLE_ERRORS:
+            self.sample.append({'line': line, 'error': error})
+        if self._writer is None:
+            os.makedirs(IMPORT_DIR, exist_ok=True)
+            self.path = report_path(self.name)
+            self._file = open(self.path, 'w', encoding='utf-8-sig', newline='')
+            self._writer = csv.writer(self._file)
+            self._writer.writerow(['Строка', 'Ошибка', 'Данные'])
+        self._writer.writerow([line, error, *('' if v is None else v for v in values)])
+
+    def close(self):
+        if self._file:
+            self._file.close()
+
+# Импортировать файл source в базу path. filename — исходное имя (по нему выбирается формат),
+# job (если передан) получает прогресс, chat_id — чат-владелец всех задач (импорт из бота),
+# default_chat_id — владелец строк без чата. Возвращает словарь с итогами
+def import_file(source, path=db.DATABASE, filename=None, job=None, report_name=None, chat_id=None, default_chat_id=None):
+    rows = iter_file(source, filename)
+    report = _ErrorReport(report_name or str(int(time.time() * 1000)))
+    imported = 0
+    batch = []
+    columns = None
+    total = None
+    now = int(time.time())
+
+    conn = db.connect(path)
+    try:
+        def flush():
+            nonlocal imported
+            with conn:
+                conn.executemany(INSERT_QUERY, batch)
+            imported += len(batch)
+            batch.clear()
+
+        try:
+            for line, values, (done, total) in rows:
+                if not any(v is not None and str(v).strip() for v in values):
+                    continue
+                if columns is None:
+                    # Первая непустая строка — заголовок; если его нет, описание берём из первого столбца
+                    columns = detect_columns(values)
+                    if columns:
+                        continue
+                    columns = {'description': 0}
+
+                try:
+                    batch.append(parse_row(values, columns, now, chat_id, default_chat_id))
+                except ValueError as e:
+                    report.add(line, str(e), values)
+
+                if len(batch) >= CHUNK_SIZE:
+                    flush()
+                    if job:
+                        job.progress(done, total)
+        except ImportFileError as e:
+            # Уже прочитанные строки сохраняем: пачки до этого места тоже закоммичены
+            if batch:
+                flush()
+            if imported:
+                raise ImportFileError(f"{e}. Импортировано до этого места: {imported}")
+            raise
+        if batch:
+            flush()
+        if job and total:
+            job.progress(total, total)
+    finally:
+        conn.close()
+        report.close()
+
+    _cleanup()
+    return {
+        'imported': imported,
+        'rejected': report.count,
+        'errors': report.sample,
+        'report': report.path,
+    }
+
+# Фоновая задача для JobManager: загруженный файл удаляется после импорта
+def import_job(job, source, filename, path=db.DATABASE, chat_id=None, default_chat_id=None):
+    try:
+        return import_file(source, path, filename, job, report_name=f'{job.id}_{int(time.time())}', chat_id=chat_id,
+                           default_chat_id=default_chat_id)
+    finally:
+        try:
+            os.remove(source)
+        except OSError:
+            pass
+
+# Оставляем несколько последних отчётов об ошибках
+def _cleanup():
+    files = sorted(glob.glob(os.path.join(IMPORT_DIR, 'import_*_errors.csv')), key=os.path.getmtime, reverse=True)
+    for old in files[KEEP_REPORTS:]:
+        try:
+            os.remove(old)
+        except OSError:
+            pass
@@ -0,0 +1,79 @@
+import itertools
+import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+logger = logging.getLogger(__name__)
+
+# Фоновая задача (экспорт, импорт и т.п.) с прогрессом, который можно опрашивать из веба
+class Job:
+    def __init__(self, job_id, kind, key=None):
+        self.id = job_id
+        self.kind = kind
+        self.key = key
+        self.status = 'pending'  # pending -> running -> done | failed
+        self.done = 0
+        self.total = None
+        self.result = None
+        self.error = None
+        self.finished_at = None
+
+    def progress(self, done, total=None):
+        self.done = done
+        if total is not None:
+            self.total = total
+
+    def to_dict(self):
+        return {
+            'id': self.id,
+            'kind': self.kind,
+            'status': self.status,
+            'done': self.done,
+            'total': self.total,
+            'error': self.error,
+        }
+
+
+# Очередь фоновых задач в отдельных потоках. Одинаковые задачи (тот же kind и key),
+# пока они в работе, не запускаются повторно — вызывающий получает уже идущую
+class JobManager:
+    def __init__(self, max_workers=1, keep=100):
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='jobs')
+        self._jobs = {}
+        self._ids = itertools.count(1)
+        self._lock = threading.Lock()
+        self._keep = keep
+
+    # func(job, *args) выполняется в фоне; её результат попадает в job.result
+    def submit(self, kind, func, *args, key=None):
+        with self._lock:
+            if key is not None:
+                for job in self._jobs.values():
+                    if job.kind == kind and job.key == key and job.status in ('pending', 'running'):
+                        return job
+            job = Job(str(next(self._ids)), kind, key)
+            self._jobs[job.id] = job
+            self._prune()
+        self._executor.submit(self._run, job, func, args)
+        return job
+
+    def get(self, job_id):
+        return self._jobs.get(job_id)
+
+    def _run(self, job, func, args):
+        job.status = 'running'
+        try:
+            job.result = func(job, *args)
+            job.status = 'done'
+        except Exception as e:
+            logger.exception("Фоновая задача %s (%s) упала", job.id, job.kind)
+            job.error = str(e)
+            job.status = 'failed'
+        job.finished_at = time.time()
+
+    # Храним только последние завершённые задачи
+    def _prune(self):
+        finished = [j for j in self._jobs.values() if j.finished_at is not None]
+        for job in sorted(finished, key=lambda j: j.finished_at)[:max(0, len(finished) - self._keep)]:
+            del self._jobs[job.id]
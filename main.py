@@ -1,13 +1,35 @@
+import asyncio
 import logging
-from telegram import Update, ReplyKeyboardMarkup, InlineKeyboardButton, InlineKeyboardMarkup
+import os
+import time
+from collections import OrderedDict
+from zoneinfo import ZoneInfo, ZoneInfoNotFoundError
+from telegram import (
+    Update, ReplyKeyboardMarkup, InlineKeyboardButton, InlineKeyboardMarkup,
+    InlineQueryResultArticle, InputTextMessageContent,
+)
+from telegram.error import BadRequest
+from telegram.request import HTTPXRequest
 from telegram.ext import (
-    Application, CommandHandler, MessageHandler, CallbackQueryHandler,
+    Application, CommandHandler, MessageHandler, CallbackQueryHandler, InlineQueryHandler,
     ContextTypes, filters
 )
-from datetime import datetime
-import sqlite3
 from apscheduler.schedulers.asyncio import AsyncIOScheduler
 
+import analytics
+import config
+import db
+import group_commit
+import importer
+import metrics
+import migrations
+import outbox
+import reminders
+import reports
+from jobs import JobManager
+from persistence import SQLitePersistence
+from update_processor import ChatOrderedUpdateProcessor
+
 # Настройка логирования
 logging.basicConfig(
     format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
@@ -15,28 +37,50 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
-# Инициализация БД
+# Общий репозиторий задач: все обработчики ходят в БД через него.
+# Добавление и закрытие задач коммитятся пачками (group_commit.py)
+repo = db.TaskRepository(writes=group_commit.GroupCommit(db.DATABASE))
+
+# Инициализация БД: создаём/обновляем схему миграциями
 def init_db():
-    conn = sqlite3.connect('tasks.db')
-    cursor = conn.cursor()
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS tasks (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            description TEXT NOT NULL,
-            created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
-            closed_at DATETIME,
-            time_spent REAL,
-            is_closed BOOLEAN DEFAULT 0
-        )
-    ''')
-    conn.commit()
-    conn.close()
+    migrations.migrate()
+    claim_unowned_tasks()
+
+# Задачи без владельца (созданные до миграции task_owner) бот не показывает ни одному чату.
+# Если задан ADMIN_CHAT_ID, отдаём их этому чату, иначе громко предупреждаем при каждом старте
+def claim_unowned_tasks():
+    conn = db.connect()
+    try:
+        unowned = db.unowned_count(conn)
+        if not unowned:
+            return
+        if config.ADMIN_CHAT_ID is not None:
+            claimed = db.claim_tasks(conn, config.ADMIN_CHAT_ID)
+            logger.info("💬 Задачи без владельца переданы чату ADMIN_CHAT_ID=%s: %s", config.ADMIN_CHAT_ID, claimed)
+            return
+    finally:
+        conn.close()
+    logger.warning(
+        "⚠️ Задач без владельца: %s — в боте их не видит ни один чат. Задайте ADMIN_CHAT_ID "
+        "или отдайте их чату командой: python manage.py claim --chat <id чата>", unowned,
+    )
+
+# Ключи состояния диалога в context.user_data. Состояние переживает перезапуск (см. persistence.py),
+# поэтому его обязательно сбрасываем по завершении сценария — в том числе при ошибках
+DIALOG_STATE_KEYS = (
+    'awaiting_task_description', 'awaiting_time_input', 'awaiting_delete_id', 'awaiting_edit_id',
+    'awaiting_search_query', 'awaiting_bulk_time', 'closing_task_id', 'editing_task_id',
+)
+
+def reset_dialog_state(user_data):
+    for key in DIALOG_STATE_KEYS:
+        user_data.pop(key, None)
 
 # Главное меню с кнопками
 MAIN_MENU_KEYBOARD = [
     ["➕ Добавить задачу", "✅ Закрыть задачу"],
     ["📋 Показать все", "🗑️ Удалить задачу"],
-    ["🕗 Настроить отчёт"]
+    ["🔍 Найти задачу", "🕗 Настроить отчёт"]
 ]
 
 async def show_main_menu(update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -50,6 +94,8 @@ async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
 # Обработка нажатий на основные кнопки
 async def handle_main_menu(update: Update, context: ContextTypes.DEFAULT_TYPE):
     text = update.message.text
+    # Новое действие из меню отменяет незаконченное предыдущее
+    reset_dialog_state(context.user_data)
 
     if text == "➕ Добавить задачу":
         await update.message.reply_text("Введите описание задачи:")
@@ -61,6 +107,9 @@ async def handle_main_menu(update: Update, context: ContextTypes.DEFAULT_TYPE):
     elif text == "🗑️ Удалить задачу":
         await update.message.reply_text("Введите ID задачи для удаления:")
         context.user_data['awaiting_delete_id'] = True
+    elif text == "🔍 Найти задачу":
+        await update.message.reply_text("Введите слова для поиска:")
+        context.user_data['awaiting_search_query'] = True
     elif text == "🕗 Настроить отчёт":
         await set_daily(update, context)
     else:
@@ -70,15 +119,10 @@ async def handle_main_menu(update: Update, context: ContextTypes.DEFAULT_TYPE):
 async def handle_text_input(update: Update, context: ContextTypes.DEFAULT_TYPE):
     if context.user_data.get('awaiting_task_description'):
         description = update.message.text
-        conn = sqlite3.connect('tasks.db')
-        cursor = conn.cursor()
-        cursor.execute('INSERT INTO tasks (description) VALUES (?)', (description,))
-        conn.commit()
-        task_id = cursor.lastrowid
-        conn.close()
+        task_id = await repo.add_task(description, chat_id=update.effective_chat.id)
 
         await update.message.reply_text(f"✅ Задача добавлена!\nID: {task_id}\nОписание: {description}")
-        context.user_data['awaiting_task_description'] = False
+        reset_dialog_state(context.user_data)
         await show_main_menu(update, context)
 
     elif context.user_data.get('awaiting_time_input'):
@@ -90,6 +134,13 @@ async def handle_text_input(update: Update, context: ContextTypes.DEFAULT_TYPE):
     elif context.user_data.get('awaiting_edit_id'):
         await handle_edit_description(update, context)
 
+    elif context.user_data.get('awaiting_bulk_time'):
+        await handle_bulk_time_input(update, context)
+
+    elif context.user_data.get('awaiting_search_query'):
+        reset_dialog_state(context.user_data)
+        await run_search(update, context, update.message.text)
+
     else:
         await update.message.reply_text("Не понимаю. Выберите действие через кнопки.")
 
@@ -107,73 +158,361 @@ async def show_task_filters(update: Update, context: ContextTypes.DEFAULT_TYPE):
     reply_markup = InlineKeyboardMarkup(keyboard)
     await update.message.reply_text("Выберите фильтр:", reply_markup=reply_markup)
 
-# Показать задачи по фильтру
-async def show_tasks_by_filter(update: Update, context: ContextTypes.DEFAULT_TYPE, filter_type="all"):
+# Режимы списка задач. Буква режима попадает в callback_data, поэтому она короткая.
+# "x" — список открытых задач для закрытия: только кнопка "Закрыть" у каждой задачи
+PAGE_MODES = {
+    "o": ("open", "⏳ ОТКРЫТЫЕ ЗАДАЧИ"),
+    "c": ("closed", "✅ ЗАКРЫТЫЕ ЗАДАЧИ"),
+    "a": ("all", "📋 ВСЕ ЗАДАЧИ"),
+    "x": ("open", "✅ ВЫБЕРИТЕ ЗАДАЧУ ДЛЯ ЗАКРЫТИЯ"),
+    # Множественный выбор: те же списки, но у задач кнопки-переключатели
+    "O": ("open", "☑️ ВЫБОР: ОТКРЫТЫЕ ЗАДАЧИ"),
+    "C": ("closed", "☑️ ВЫБОР: ЗАКРЫТЫЕ ЗАДАЧИ"),
+    "A": ("all", "☑️ ВЫБОР: ВСЕ ЗАДАЧИ"),
+}
+FILTER_MODES = {"open": "o", "closed": "c", "all": "a"}
+SELECT_MODES = {"o": "O", "c": "C", "a": "A"}
+
+# Длинные описания в списке обрезаем, чтобы страница гарантированно влезла в одно сообщение
+LIST_DESCRIPTION_LIMIT = 200
+
+# Карточка задачи в списке; t — строка в формате db.TASK_COLUMNS
+def format_task_block(t, description_limit=LIST_DESCRIPTION_LIMIT):
+    description = reports.truncate(t[1], description_limit)
+    status = "✅ ЗАКРЫТА" if t[5] else "⏳ ОТКРЫТА"
+    block = f"🔖 ID: {t[0]}\n📝 {description}\n📆 Создана: {db.format_ts(t[2])}\n{status}"
+    if t[5]:
+        block += f"\n🕒 Закрыта: {db.format_ts(t[3])}\n⏱️ Потрачено: {t[4]} ч."
+    if t[6]:
+        block += f"\n👤 {t[6]}"
+    if t[7] is not None:
+        block += f"\n⏰ Срок: {reminders.format_moment(t[7])}"
+    if t[8] is not None and not t[5]:
+        block += f"\n🔔 Напоминание: {reminders.format_moment(t[8])}"
+    return block
+
+# Текст списка карточек под заголовком. Если он не влезает в одно сообщение Telegram (длинные описания,
+# исполнитель, срок), оставшееся после заголовка и полей место делится между описаниями поровну
+def render_task_list(header, tasks):
+    text = header + "\n\n".join(format_task_block(t) for t in tasks)
+    if reports.message_units(text) <= reports.MESSAGE_LIMIT:
+        return text
+    overhead = reports.message_units(header + "\n\n".join(format_task_block(t, 0) for t in tasks))
+    limit = max((reports.MESSAGE_LIMIT - overhead) // len(tasks), 0)
+    return header + "\n\n".join(format_task_block(t, limit) for t in tasks)
+
+# Кнопки под карточкой: закрыть (если открыта), редактировать, удалить
+def task_buttons(t):
+    row = [
+        InlineKeyboardButton(f"✏️ {t[0]}", callback_data=f"edit_{t[0]}"),
+        InlineKeyboardButton(f"🗑️ {t[0]}", callback_data=f"delete_{t[0]}"),
+    ]
+    if not t[5]:  # если открыта — показываем "Закрыть"
+        row.insert(0, InlineKeyboardButton(f"✅ {t[0]}", callback_data=f"close_{t[0]}"))
+    return row
+
+# Одна страница задач: текст сообщения и клавиатура.
+# Навигация — pg_<режим>_<o|n>_<id>: "o" — задачи старше id, "n" — новее id.
+# selected — id, отмеченные в режиме выбора (O/C/A). Показываются только задачи чата chat_id
+async def render_task_page(chat_id, mode, after=None, before=None, selected=()):
+    filter_type, title = PAGE_MODES[mode]
+    tasks, has_newer, has_older = await repo.page_tasks(filter_type, after=after, before=before, chat_id=chat_id)
+
+    # Задачи на странице могли исчезнуть (удалили) — тогда показываем первую страницу
+    if not tasks and (after is not None or before is not None):
+        tasks, has_newer, has_older = await repo.page_tasks(filter_type, chat_id=chat_id)
+
+    if not tasks:
+        return f"📭 {title}: задач нет.", None
+
+    # "Эта же страница" для перерисовки после переключения: задачи с id < anchor
+    anchor = tasks[0][0] + 1
+    if mode == "x":
+        keyboard = [[InlineKeyboardButton(f"ID {t[0]}: {t[1][:30]}...", callback_data=f"close_{t[0]}")] for t in tasks]
+    elif mode.isupper():
+        keyboard = [
+            [InlineKeyboardButton(f"{'☑️' if t[0] in selected else '⬜'} ID {t[0]}: {t[1][:30]}", callback_data=f"sel_{mode}_{anchor}_{t[0]}")]
+            for t in tasks
+        ]
+    else:
+        keyboard = [task_buttons(t) for t in tasks]
+
+    navigation = []
+    if has_newer:
+        navigation.append(InlineKeyboardButton("⬅️ Новее", callback_data=f"pg_{mode}_n_{tasks[0][0]}"))
+    if has_older:
+        navigation.append(InlineKeyboardButton("Старее ➡️", callback_data=f"pg_{mode}_o_{tasks[-1][0]}"))
+    if navigation:
+        keyboard.append(navigation)
+
+    if mode in SELECT_MODES:
+        keyboard.append([InlineKeyboardButton("☑️ Выбрать несколько", callback_data=f"pg_{SELECT_MODES[mode]}_o_{anchor}")])
+    elif mode.isupper():
+        keyboard.extend(selection_buttons(mode, anchor, selected))
+
+    return render_task_list(f"👇 {title}:\n\n", tasks), InlineKeyboardMarkup(keyboard)
+
+# Кнопки режима выбора: действия над отмеченными задачами, выбор всей страницы, выход
+def selection_buttons(mode, anchor, selected):
+    rows = [[
+        InlineKeyboardButton("☑️ Вся страница", callback_data=f"selall_{mode}_{anchor}"),
+        InlineKeyboardButton("✖️ Сбросить", callback_data=f"selclr_{mode}_{anchor}"),
+    ]]
+    if selected:
+        rows.append([
+            InlineKeyboardButton(f"✅ Закрыть ({len(selected)})", callback_data="bulk_close"),
+            InlineKeyboardButton(f"🗑️ Удалить ({len(selected)})", callback_data="bulk_delete"),
+        ])
+    rows.append([InlineKeyboardButton("↩️ Готово", callback_data=f"pg_{mode.lower()}_o_{anchor}")])
+    return rows
+
+# Показать задачи по фильтру — первая страница в том же сообщении, где были фильтры
+async def show_tasks_by_filter(update: Update, context: ContextTypes.DEFAULT_TYPE):
     query = update.callback_query
     await query.answer()
 
-    conn = sqlite3.connect('tasks.db')
-    cursor = conn.cursor()
+    filter_type = query.data.split('_')[1]
+    text, reply_markup = await render_task_page(update.effective_chat.id, FILTER_MODES.get(filter_type, "a"))
+    await query.edit_message_text(text, reply_markup=reply_markup)
 
-    if filter_type == "open":
-        cursor.execute('SELECT id, description, created_at, closed_at, time_spent, is_closed FROM tasks WHERE is_closed = 0 ORDER BY id DESC')
-        title = "⏳ ОТКРЫТЫЕ ЗАДАЧИ"
-    elif filter_type == "closed":
-        cursor.execute('SELECT id, description, created_at, closed_at, time_spent, is_closed FROM tasks WHERE is_closed = 1 ORDER BY id DESC')
-        title = "✅ ЗАКРЫТЫЕ ЗАДАЧИ"
-    else:
-        cursor.execute('SELECT id, description, created_at, closed_at, time_spent, is_closed FROM tasks ORDER BY id DESC')
-        title = "📋 ВСЕ ЗАДАЧИ"
+# Листание страниц: сообщение редактируется на месте, один запрос к API на страницу
+async def handle_page_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    query = update.callback_query
+    await query.answer()
 
-    tasks = cursor.fetchall()
-    conn.close()
+    _, mode, direction, task_id = query.data.split('_')
+    selected = set(context.user_data.get('selected_tasks', ()))
+    chat_id = update.effective_chat.id
+    if direction == "o":
+        text, reply_markup = await render_task_page(chat_id, mode, after=int(task_id), selected=selected)
+    else:
+        text, reply_markup = await render_task_page(chat_id, mode, before=int(task_id), selected=selected)
 
+    try:
+        await query.edit_message_text(text, reply_markup=reply_markup)
+    except BadRequest as e:
+        # Повторное нажатие на ту же кнопку — страница не изменилась
+        if "not modified" not in str(e):
+            raise
+
+# Страница результатов поиска. Запрос хранится в user_data (в callback_data не влезет),
+# листание — srch_<смещение>
+async def render_search_page(chat_id, text, offset=0):
+    tasks, has_more = await repo.search_tasks(text, offset=offset, chat_id=chat_id)
+    shown = text if len(text) <= 50 else text[:50] + "…"
     if not tasks:
-        await query.edit_message_text(f"📭 {title}: задач нет.")
+        return f"🔍 По запросу «{shown}» ничего не найдено.", None
+
+    title = f"🔍 НАЙДЕНО ПО ЗАПРОСУ «{shown}»"
+    if offset:
+        title += f" (с {offset + 1}-й)"
+    keyboard = [task_buttons(t) for t in tasks]
+
+    navigation = []
+    if offset > 0:
+        navigation.append(InlineKeyboardButton("⬅️ Назад", callback_data=f"srch_{max(offset - db.PAGE_SIZE, 0)}"))
+    if has_more:
+        navigation.append(InlineKeyboardButton("Дальше ➡️", callback_data=f"srch_{offset + db.PAGE_SIZE}"))
+    if navigation:
+        keyboard.append(navigation)
+
+    return render_task_list(f"👇 {title}:\n\n", tasks), InlineKeyboardMarkup(keyboard)
+
+async def run_search(update: Update, context: ContextTypes.DEFAULT_TYPE, text):
+    if db.fts_query(text) is None:
+        await update.message.reply_text("Введите хотя бы одно слово для поиска.")
         return
 
-    await query.edit_message_text(f"👇 {title}:")
+    context.user_data['search_query'] = text
+    result, reply_markup = await render_search_page(update.effective_chat.id, text)
+    await update.message.reply_text(result, reply_markup=reply_markup)
 
-    for t in tasks:
-        status = "✅ ЗАКРЫТА" if t[5] else "⏳ ОТКРЫТА"
-        msg = f"🔖 ID: {t[0]}\n📝 {t[1]}\n📆 Создана: {t[2]}\n{status}"
+# /search <слова> — поиск по описаниям задач; без аргументов — спросить, что искать
+async def search(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    reset_dialog_state(context.user_data)
+    if not context.args:
+        await update.message.reply_text("Введите слова для поиска:")
+        context.user_data['awaiting_search_query'] = True
+        return
 
-        if t[5]:
-            msg += f"\n🕒 Закрыта: {t[3]}\n⏱️ Потрачено: {t[4]} ч."
+    await run_search(update, context, ' '.join(context.args))
 
-        # Кнопки под каждой задачей
-        keyboard = [
-            [
-                InlineKeyboardButton("✏️ Редактировать", callback_data=f"edit_{t[0]}"),
-                InlineKeyboardButton("🗑️ Удалить", callback_data=f"delete_{t[0]}"),
-            ]
-        ]
-        if not t[5]:  # если открыта — показываем "Закрыть"
-            keyboard[0].insert(0, InlineKeyboardButton("✅ Закрыть", callback_data=f"close_{t[0]}"))
+async def handle_search_page_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    query = update.callback_query
+    await query.answer()
+
+    text = context.user_data.get('search_query')
+    if not text:
+        await query.edit_message_text("Поиск устарел, повторите его: /search <слова>")
+        return
+
+    result, reply_markup = await render_search_page(update.effective_chat.id, text, int(query.data.split('_')[1]))
+    try:
+        await query.edit_message_text(result, reply_markup=reply_markup)
+    except BadRequest as e:
+        if "not modified" not in str(e):
+            raise
+
+# --- Inline-режим: @бот <текст> в любом чате ---
+# У inline-запроса нет чата, только пользователь, поэтому ищем среди задач его личного чата с ботом
+# (id личного чата совпадает с id пользователя). Выбранный результат отправляется карточкой задачи.
+# Пока пользователь печатает, запросы идут на каждую букву: ответы держим в LRU по версии данных,
+# а Telegram кэширует их у себя ещё INLINE_CACHE_TIME секунд
+
+INLINE_PAGE_SIZE = 20
+INLINE_CACHE_TIME = 5
+INLINE_CACHE_SIZE = 1024
+INLINE_TITLE_LIMIT = 60
+
+inline_cache = OrderedDict()  # (пользователь, текст, offset) -> (версия данных, результаты, next_offset)
+
+def inline_result(t):
+    title = t[1] if len(t[1]) <= INLINE_TITLE_LIMIT else t[1][:INLINE_TITLE_LIMIT] + "…"
+    details = f"{'✅ закрыта' if t[5] else '⏳ открыта'} · создана {db.format_ts(t[2])}"
+    if t[6]:
+        details += f" · 👤 {t[6]}"
+    return InlineQueryResultArticle(
+        id=str(t[0]),
+        title=f"#{t[0]} {title}",
+        description=details,
+        input_message_content=InputTextMessageContent(format_task_block(t)),
+    )
+
+# offset страницы — id, с которого продолжать (см. db.lookup_tasks)
+async def handle_inline_query(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    query = update.inline_query
+    chat_id = query.from_user.id
+    text = ' '.join(query.query.split()).lower()
+
+    version = await repo.data_version()
+    key = (chat_id, text, query.offset)
+    cached = inline_cache.get(key)
+    if cached is not None and cached[0] == version:
+        inline_cache.move_to_end(key)
+        _, results, next_offset = cached
+    else:
+        before = int(query.offset) if query.offset.isdigit() else None
+        tasks, next_before = await repo.lookup_tasks(text, before, INLINE_PAGE_SIZE, chat_id)
+        results = [inline_result(t) for t in tasks]
+        next_offset = str(next_before) if next_before is not None else ""
+        inline_cache[key] = (version, results, next_offset)
+        while len(inline_cache) > INLINE_CACHE_SIZE:
+            inline_cache.popitem(last=False)
+
+    await query.answer(results, cache_time=INLINE_CACHE_TIME, is_personal=True, next_offset=next_offset)
+
+# --- Множественный выбор и массовые действия ---
+# Отмеченные id лежат в user_data['selected_tasks'] (список — чтобы сохранялся в persistence)
+
+async def _edit_page(query, mode, anchor, selected):
+    text, reply_markup = await render_task_page(query.message.chat_id, mode, after=anchor, selected=selected)
+    try:
+        await query.edit_message_text(text, reply_markup=reply_markup)
+    except BadRequest as e:
+        if "not modified" not in str(e):
+            raise
 
-        reply_markup = InlineKeyboardMarkup(keyboard)
-        await update.effective_chat.send_message(msg, reply_markup=reply_markup)
+# sel_<режим>_<anchor>_<id> — отметить/снять задачу
+async def handle_select_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    query = update.callback_query
+    await query.answer()
+
+    _, mode, anchor, task_id = query.data.split('_')
+    selected = context.user_data.setdefault('selected_tasks', [])
+    task_id = int(task_id)
+    if task_id in selected:
+        selected.remove(task_id)
+    else:
+        selected.append(task_id)
+    await _edit_page(query, mode, int(anchor), set(selected))
+
+# selall_/selclr_<режим>_<anchor> — отметить всю страницу или сбросить выбор
+async def handle_select_page_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    query = update.callback_query
+    await query.answer()
+
+    action, mode, anchor = query.data.split('_')
+    selected = context.user_data.setdefault('selected_tasks', [])
+    if action == "selclr":
+        selected.clear()
+    else:
+        tasks, _, _ = await repo.page_tasks(PAGE_MODES[mode][0], after=int(anchor), chat_id=update.effective_chat.id)
+        selected.extend(t[0] for t in tasks if t[0] not in selected)
+    await _edit_page(query, mode, int(anchor), set(selected))
+
+# Сводка массовой операции: число задач по статусам и id тех, что не удалось обработать
+BULK_STATUS_LABELS = {
+    'closed': "✅ Закрыто",
+    'deleted': "🗑️ Удалено",
+    'already_closed': "☑️ Уже были закрыты",
+    'not_found': "❓ Не найдены",
+}
+
+def format_bulk_results(results):
+    by_status = {}
+    for task_id, status in results.items():
+        by_status.setdefault(status, []).append(task_id)
+
+    lines = []
+    for status, label in BULK_STATUS_LABELS.items():
+        ids = by_status.get(status)
+        if not ids:
+            continue
+        line = f"{label}: {len(ids)}"
+        if status in ('already_closed', 'not_found'):
+            line += " (ID " + ", ".join(map(str, ids[:20])) + ("…" if len(ids) > 20 else "") + ")"
+        lines.append(line)
+    return "\n".join(lines)
+
+async def handle_bulk_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    query = update.callback_query
+    await query.answer()
+
+    selected = context.user_data.get('selected_tasks') or []
+    if not selected:
+        await query.edit_message_text("Ничего не выбрано.")
+        return
+
+    if query.data == "bulk_close":
+        reset_dialog_state(context.user_data)
+        context.user_data['awaiting_bulk_time'] = True
+        await query.edit_message_text(f"Закрываем {len(selected)} задач(и). Введите потраченное время на каждую (в часах):")
+    elif query.data == "bulk_delete":
+        keyboard = [[
+            InlineKeyboardButton("🗑️ Да, удалить", callback_data="bulk_delete_yes"),
+            InlineKeyboardButton("Отмена", callback_data="bulk_cancel"),
+        ]]
+        await query.edit_message_text(f"Удалить {len(selected)} задач(и)?", reply_markup=InlineKeyboardMarkup(keyboard))
+    elif query.data == "bulk_delete_yes":
+        results = await repo.bulk_delete(selected, chat_id=update.effective_chat.id)
+        context.user_data.pop('selected_tasks', None)
+        await query.edit_message_text(format_bulk_results(results))
+    else:
+        await query.edit_message_text("Отменено. Выбор сохранён — откройте список ещё раз.")
+
+# Время для массового закрытия: все выбранные задачи закрываются одной транзакцией
+async def handle_bulk_time_input(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    try:
+        time_spent = importer.parse_hours(update.message.text)
+    except ValueError:
+        await update.message.reply_text("Пожалуйста, введите неотрицательное число (например, 2.5).")
+        return
+
+    selected = context.user_data.pop('selected_tasks', None) or []
+    reset_dialog_state(context.user_data)
+    results = await repo.bulk_close([(task_id, time_spent) for task_id in selected], chat_id=update.effective_chat.id)
+    await update.message.reply_text(format_bulk_results(results) or "Ничего не выбрано.")
+    await show_main_menu(update, context)
 
 # Показать открытые задачи для закрытия (с кнопками)
 async def show_open_tasks_for_closing(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    conn = sqlite3.connect('tasks.db')
-    cursor = conn.cursor()
-    cursor.execute('SELECT id, description FROM tasks WHERE is_closed = 0 ORDER BY id')
-    open_tasks = cursor.fetchall()
-    conn.close()
+    text, reply_markup = await render_task_page(update.effective_chat.id, "x")
 
-    if not open_tasks:
+    if reply_markup is None:
         await update.message.reply_text("📭 Нет открытых задач для закрытия.")
         return
 
-    keyboard = []
-    for task in open_tasks:
-        keyboard.append([
-            InlineKeyboardButton(f"ID {task[0]}: {task[1][:30]}...", callback_data=f"close_{task[0]}")
-        ])
-
-    reply_markup = InlineKeyboardMarkup(keyboard)
-    await update.message.reply_text("Выберите задачу для закрытия:", reply_markup=reply_markup)
+    await update.message.reply_text(text, reply_markup=reply_markup)
 
 # Обработка нажатия кнопки "Закрыть задачу"
 async def handle_close_task_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -181,6 +520,7 @@ async def handle_close_task_callback(update: Update, context: ContextTypes.DEFAU
     await query.answer()
 
     task_id = int(query.data.split('_')[1])
+    reset_dialog_state(context.user_data)
     context.user_data['closing_task_id'] = task_id
 
     await query.edit_message_text(text=f"Вы выбрали задачу ID {task_id}. Введите потраченное время (в часах):")
@@ -190,36 +530,21 @@ async def handle_close_task_callback(update: Update, context: ContextTypes.DEFAU
 async def handle_time_input(update: Update, context: ContextTypes.DEFAULT_TYPE):
     if context.user_data.get('awaiting_time_input'):
         try:
-            time_spent = float(update.message.text)
+            time_spent = importer.parse_hours(update.message.text)
         except ValueError:
-            await update.message.reply_text("Пожалуйста, введите число (например, 2.5).")
+            await update.message.reply_text("Пожалуйста, введите неотрицательное число (например, 2.5).")
             return
 
         task_id = context.user_data['closing_task_id']
+        status, description = await repo.close_task(task_id, time_spent, chat_id=update.effective_chat.id)
 
-        conn = sqlite3.connect('tasks.db')
-        cursor = conn.cursor()
-        cursor.execute('SELECT description, is_closed FROM tasks WHERE id = ?', (task_id,))
-        task = cursor.fetchone()
-
-        if not task:
+        reset_dialog_state(context.user_data)
+        if status == 'not_found':
             await update.message.reply_text(f"Задача с ID {task_id} не найдена.")
-            return
-        if task[1]:
+        elif status == 'already_closed':
             await update.message.reply_text("Задача уже закрыта!")
-            return
-
-        now = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
-        cursor.execute('''
-            UPDATE tasks
-            SET closed_at = ?, time_spent = ?, is_closed = 1
-            WHERE id = ?
-        ''', (now, time_spent, task_id))
-        conn.commit()
-        conn.close()
-
-        await update.message.reply_text(f"✅ Задача \"{task[0]}\" закрыта.\nПотрачено времени: {time_spent} ч.")
-        context.user_data['awaiting_time_input'] = False
+        else:
+            await update.message.reply_text(f"✅ Задача \"{description}\" закрыта.\nПотрачено времени: {time_spent} ч.")
         await show_main_menu(update, context)
 
 # Удаление задачи по ID (через текст)
@@ -230,21 +555,13 @@ async def handle_delete_task(update: Update, context: ContextTypes.DEFAULT_TYPE)
         await update.message.reply_text("ID должен быть числом!")
         return
 
-    conn = sqlite3.connect('tasks.db')
-    cursor = conn.cursor()
-    cursor.execute('SELECT description FROM tasks WHERE id = ?', (task_id,))
-    task = cursor.fetchone()
+    description = await repo.delete_task(task_id, chat_id=update.effective_chat.id)
+    reset_dialog_state(context.user_data)
 
-    if not task:
+    if description is None:
         await update.message.reply_text(f"Задача с ID {task_id} не найдена.")
-        return
-
-    cursor.execute('DELETE FROM tasks WHERE id = ?', (task_id,))
-    conn.commit()
-    conn.close()
-
-    await update.message.reply_text(f"🗑️ Задача \"{task[0]}\" удалена.")
-    context.user_data['awaiting_delete_id'] = False
+    else:
+        await update.message.reply_text(f"🗑️ Задача \"{description}\" удалена.")
     await show_main_menu(update, context)
 
 # Обработка удаления через кнопку под карточкой
@@ -254,20 +571,13 @@ async def handle_delete_callback(update: Update, context: ContextTypes.DEFAULT_T
 
     task_id = int(query.data.split('_')[1])
 
-    conn = sqlite3.connect('tasks.db')
-    cursor = conn.cursor()
-    cursor.execute('SELECT description FROM tasks WHERE id = ?', (task_id,))
-    task = cursor.fetchone()
+    description = await repo.delete_task(task_id, chat_id=update.effective_chat.id)
 
-    if not task:
+    if description is None:
         await query.edit_message_text("Задача уже удалена.")
         return
 
-    cursor.execute('DELETE FROM tasks WHERE id = ?', (task_id,))
-    conn.commit()
-    conn.close()
-
-    await query.edit_message_text(f"🗑️ Задача \"{task[0]}\" удалена.")
+    await query.edit_message_text(f"🗑️ Задача \"{description}\" удалена.")
 
 # Редактирование задачи
 async def handle_edit_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -275,6 +585,7 @@ async def handle_edit_callback(update: Update, context: ContextTypes.DEFAULT_TYP
     await query.answer()
 
     task_id = int(query.data.split('_')[1])
+    reset_dialog_state(context.user_data)
     context.user_data['editing_task_id'] = task_id
 
     await query.edit_message_text("Введите новое описание задачи:")
@@ -284,118 +595,369 @@ async def handle_edit_callback(update: Update, context: ContextTypes.DEFAULT_TYP
 async def handle_edit_description(update: Update, context: ContextTypes.DEFAULT_TYPE):
     new_description = update.message.text
     task_id = context.user_data['editing_task_id']
+    updated = await repo.edit_task(task_id, new_description, chat_id=update.effective_chat.id)
+    reset_dialog_state(context.user_data)
 
-    conn = sqlite3.connect('tasks.db')
-    cursor = conn.cursor()
-    cursor.execute('SELECT description FROM tasks WHERE id = ?', (task_id,))
-    task = cursor.fetchone()
-
-    if not task:
+    if updated:
+        await update.message.reply_text(f"✏️ Задача обновлена: \"{new_description}\"")
+    else:
         await update.message.reply_text("Задача не найдена.")
-        return
-
-    cursor.execute('UPDATE tasks SET description = ? WHERE id = ?', (new_description, task_id))
-    conn.commit()
-    conn.close()
-
-    await update.message.reply_text(f"✏️ Задача обновлена: \"{new_description}\"")
-    context.user_data['awaiting_edit_id'] = False
     await show_main_menu(update, context)
 
-# Установка ежедневного отчёта
-async def set_daily(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    chat_id = update.message.chat_id
-    scheduler = context.application.bot_data.get('scheduler')
+# /cancel — выйти из незаконченного сценария
+async def cancel(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    reset_dialog_state(context.user_data)
+    await update.message.reply_text("↩️ Действие отменено.")
+    await show_main_menu(update, context)
 
-    if not scheduler:
-        await update.message.reply_text("❌ Планировщик не запущен.")
+# Назначить исполнителя задачи этого чата: /assign <id> <имя>, без имени — снять исполнителя
+async def assign(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    args = context.args or []
+    try:
+        task_id = int(args[0])
+    except (IndexError, ValueError):
+        await update.message.reply_text("Использование: /assign <id> [исполнитель]")
         return
+    assignee = ' '.join(args[1:])
+    if not await repo.set_assignee(task_id, assignee, chat_id=update.effective_chat.id):
+        await update.message.reply_text(f"Задача с ID {task_id} не найдена.")
+        return
+    if assignee:
+        await update.message.reply_text(f"👤 Задача {task_id} назначена: {assignee[:db.MAX_ASSIGNEE]}")
+    else:
+        await update.message.reply_text(f"👤 С задачи {task_id} снят исполнитель.")
+
+# --- Сроки и напоминания (см. reminders.py) ---
+
+def rearm_reminders(context):
+    timer = context.bot_data.get('reminders')
+    if timer:
+        timer.rearm()
+
+# Разбор "<id> <когда>" для /due и /remind: (id, момент) или None, если ответ пользователю уже отправлен
+async def _parse_deadline_args(update, context, usage):
+    args = context.args or []
+    if len(args) < 2 or not args[0].isdigit():
+        await update.message.reply_text(f"Использование: {usage}\nКогда: {reminders.MOMENT_HELP}")
+        return None
+    task_id = int(args[0])
+    try:
+        moment = reminders.parse_moment(' '.join(args[1:]))
+    except ValueError as e:
+        await update.message.reply_text(f"⚠️ {e}\nКогда: {reminders.MOMENT_HELP}")
+        return None
 
-    current_jobs = scheduler.get_jobs()
-    for job in current_jobs:
-        if job.name == str(chat_id):
-            job.remove()
-
-    scheduler.add_job(
-        daily_report,
-        trigger="cron",
-        hour=9, minute=0,
-        chat_id=chat_id,
-        name=str(chat_id),
-        replace_existing=True
-    )
+    task = await repo.get_task(task_id, update.effective_chat.id)
+    if not task:
+        await update.message.reply_text(f"Задача с ID {task_id} не найдена.")
+        return None
+    if task[5] and moment is not None:
+        await update.message.reply_text(f"Задача {task_id} уже закрыта.")
+        return None
+    return task_id, moment
+
+# Срок задачи: /due <id> <когда>, /due <id> off — снять. Напоминание по умолчанию приходит в момент срока
+async def due_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    parsed = await _parse_deadline_args(update, context, "/due <id> <когда> | off")
+    if not parsed:
+        return
+    task_id, due_at = parsed
+    chat_id = update.effective_chat.id
+    await repo.set_due(task_id, due_at, chat_id)
+    rearm_reminders(context)
+    if due_at is None:
+        await update.message.reply_text(f"⏰ Срок задачи {task_id} снят.")
+        return
+    task = await repo.get_task(task_id, chat_id)
+    text = f"⏰ Срок задачи {task_id}: {reminders.format_moment(due_at)}"
+    if task and task[8] is not None:
+        text += f"\n🔔 Напомню: {reminders.format_moment(task[8])}"
+    await update.message.reply_text(text)
+
+# Напоминание о задаче: /remind <id> <когда>, /remind <id> off — снять
+async def remind_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    parsed = await _parse_deadline_args(update, context, "/remind <id> <когда> | off")
+    if not parsed:
+        return
+    task_id, remind_at = parsed
+    await repo.set_remind(task_id, remind_at, update.effective_chat.id)
+    rearm_reminders(context)
+    if remind_at is None:
+        await update.message.reply_text(f"🔕 Напоминание о задаче {task_id} снято.")
+    else:
+        await update.message.reply_text(f"🔔 Напомню о задаче {task_id}: {reminders.format_moment(remind_at)}")
+
+# Импорт задач из присланного файла CSV/XLSX (см. importer.py). Разбор идёт в фоновом потоке,
+# обработчик сразу освобождается, а прогресс обновляется в одном сообщении
+import_jobs = JobManager(max_workers=1)
+
+# Как часто обновлять сообщение с прогрессом, секунды
+IMPORT_PROGRESS_INTERVAL = 3
+# Сколько отклонённых строк перечислять в сообщении (все — в файле отчёта)
+IMPORT_ERRORS_SHOWN = 5
+
+async def handle_import_document(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    document = update.message.document
+    extension = os.path.splitext(document.file_name or '')[1].lower()
+    if extension not in importer.SUPPORTED_EXTENSIONS:
+        await update.message.reply_text("📎 Для импорта задач пришлите файл .csv или .xlsx.")
+        return
 
-    await update.message.reply_text("✅ Ежедневный отчёт установлен на 09:00.")
+    try:
+        telegram_file = await document.get_file()
+    except BadRequest as e:
+        await update.message.reply_text(f"❌ Не удалось получить файл: {e.message}")
+        return
 
-# Ежедневный отчёт
-async def daily_report(context: ContextTypes.DEFAULT_TYPE):
-    chat_id = context.job.kwargs.get('chat_id') or context.job.args[0] if context.job.args else None
-    if not chat_id:
-        logger.error("Не удалось определить chat_id для отчёта")
+    os.makedirs(importer.IMPORT_DIR, exist_ok=True)
+    source = os.path.join(importer.IMPORT_DIR, f'upload_{document.file_unique_id}_{update.message.message_id}{extension}')
+    await telegram_file.download_to_drive(source)
+
+    job = import_jobs.submit('import', importer.import_job, source, document.file_name, db.DATABASE, update.effective_chat.id)
+    # Это сообщение потом правится — склеивать его с соседними нельзя
+    message = await update.message.reply_text("⏳ Импорт начат...", rate_limit_args={'merge': False})
+    context.application.create_task(watch_import(context.bot, message, job), update=update)
+
+def format_import_result(result):
+    lines = [f"✅ Импорт завершён. Добавлено задач: {result['imported']}"]
+    if result['rejected']:
+        lines.append(f"⚠️ Отклонено строк: {result['rejected']}")
+        for error in result['errors'][:IMPORT_ERRORS_SHOWN]:
+            lines.append(f"• строка {error['line']}: {error['error']}")
+    return "\n".join(lines)
+
+async def watch_import(bot, message, job):
+    shown = None
+    while job.status in ('pending', 'running'):
+        await asyncio.sleep(IMPORT_PROGRESS_INTERVAL)
+        if job.total and job.status == 'running':
+            percent = int(100 * job.done / job.total)
+            if percent != shown:
+                shown = percent
+                try:
+                    await message.edit_text(f"⏳ Импорт: {percent}%")
+                except BadRequest:
+                    pass
+
+    if job.status == 'failed':
+        await message.edit_text(f"❌ Импорт не удался: {job.error}")
+        return
+    await message.edit_text(format_import_result(job.result))
+    if job.result['report']:
+        with open(job.result['report'], 'rb') as report:
+            await bot.send_document(message.chat_id, report, filename='import_errors.csv', caption="📄 Отклонённые строки")
+
+# Любая ошибка в обработчике: пишем в лог и сбрасываем состояние диалога,
+# чтобы пользователь не застрял в сценарии (в том числе после перезапуска бота)
+async def on_error(update: object, context: ContextTypes.DEFAULT_TYPE):
+    logger.error("Ошибка при обработке апдейта", exc_info=context.error)
+    if not isinstance(update, Update):
         return
+    if context.user_data is not None:
+        reset_dialog_state(context.user_data)
+    if update.effective_message:
+        try:
+            await update.effective_message.reply_text("⚠️ Что-то пошло не так, действие отменено. Попробуйте ещё раз.")
+        except Exception:
+            logger.warning("Не удалось сообщить пользователю об ошибке", exc_info=True)
+
+# Аналитика по задачам чата: /analytics [дней]. Считается в отдельном потоке со своим соединением,
+# чтобы не занимать поток репозитория; повторный вызов без изменений в задачах берётся из кэша
+async def analytics_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    args = context.args or []
+    try:
+        days = int(args[0]) if args else analytics.DEFAULT_DAYS
+        if not 1 <= days <= analytics.MAX_DAYS:
+            raise ValueError(days)
+    except ValueError:
+        await update.message.reply_text(f"Использование: /analytics [число дней, 1–{analytics.MAX_DAYS}]")
+        return
+    result = await asyncio.to_thread(analytics.get, db.DATABASE, update.effective_chat.id, days)
+    await update.message.reply_text(analytics.render_text(result))
 
-    conn = sqlite3.connect('tasks.db')
-    cursor = conn.cursor()
-    cursor.execute('SELECT id, description, created_at FROM tasks WHERE is_closed = 0')
-    open_tasks = cursor.fetchall()
-    conn.close()
+# Установка ежедневного отчёта: /setdaily [ЧЧ:ММ] [часовой пояс], /setdaily off — отписаться.
+# Кнопка меню ставит 09:00 (или оставляет время, выбранное раньше)
+async def set_daily(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    chat_id = update.message.chat_id
+    args = context.args or []
 
-    if not open_tasks:
-        await context.bot.send_message(chat_id=chat_id, text="📭 Нет открытых задач.")
+    if args and args[0].lower() in ("off", "выкл"):
+        if await repo.unsubscribe_report(chat_id):
+            await update.message.reply_text("🔕 Ежедневный отчёт отключён.")
+        else:
+            await update.message.reply_text("Ежедневный отчёт и не был включён.")
         return
 
-    now = datetime.now()
-    msg = "📅 ЕЖЕДНЕВНЫЙ ОТЧЁТ — ОТКРЫТЫЕ ЗАДАЧИ:\n\n"
-    for t in open_tasks:
-        created = datetime.strptime(t[2], '%Y-%m-%d %H:%M:%S')
-        delta = now - created
-        days = delta.days
-        hours = delta.seconds // 3600
+    current = await repo.get_report_subscription(chat_id)
+    minute_of_day, tz = current if current else (reports.DEFAULT_REPORT_MINUTE, reports.DEFAULT_REPORT_TZ)
+    try:
+        if args:
+            minute_of_day = reports.parse_report_time(args[0])
+        if len(args) > 1:
+            tz = args[1]
+            ZoneInfo(tz)
+    except ValueError:
+        await update.message.reply_text("Использование: /setdaily [ЧЧ:ММ] [часовой пояс, например Europe/Moscow] или /setdaily off")
+        return
+    except ZoneInfoNotFoundError:
+        await update.message.reply_text(f"Неизвестный часовой пояс: {tz}")
+        return
 
-        if days > 0:
-            time_str = f"{days} дн."
-        else:
-            time_str = f"{hours} ч."
+    await repo.subscribe_report(chat_id, minute_of_day, tz)
+    context.application.bot_data.setdefault('report_timezones', set()).add(tz)
 
-        msg += f"ID: {t[0]} | {t[1]}\nВисит: {time_str}\n\n"
+    await update.message.reply_text(f"✅ Ежедневный отчёт установлен на {reports.format_report_time(minute_of_day)} ({tz}).")
 
-    await context.bot.send_message(chat_id=chat_id, text=msg)
+# Ежеминутный тик планировщика: одним запросом по индексу берём чаты, которым пора отчёт,
+# вторым — открытые задачи этих чатов, и каждому чату отправляем отчёт по его задачам
+async def report_tick(application: Application):
+    slots = reports.due_slots(application.bot_data.get('report_timezones', ()))
+    chat_ids = await repo.due_report_chats(slots)
+    if not chat_ids:
+        return
 
-# Запуск планировщика внутри event loop
+    open_tasks = await repo.open_tasks_by_chat(chat_ids)
+    messages = {chat_id: reports.split_message(reports.render_open_report(tasks)) for chat_id, tasks in open_tasks.items()}
+    await reports.deliver(application.bot, messages)
+    logger.info("📅 Отчёт отправлен в %s чат(ов)", len(chat_ids))
+
+# Ночной перенос старых закрытых задач в архив. Пачками по отдельным вызовам репозитория,
+# чтобы обработчики бота не ждали весь перенос целиком
+async def archive_tick(application: Application):
+    closed_before = int(time.time() - config.ARCHIVE_AFTER_DAYS * 86400)
+    total = 0
+    while True:
+        moved = await repo.run(db.archive_batch, closed_before)
+        total += moved
+        if moved < db.ARCHIVE_BATCH:
+            break
+    if total:
+        logger.info("🗄️ В архив перенесено задач: %s", total)
+
+# Раз в минуту пишем в лог глубину очереди апдейтов (при параллельной обработке)
+def log_update_queue(processor: ChatOrderedUpdateProcessor):
+    logger.info("📬 Очередь апдейтов: %s", processor.stats())
+
+# Запуск планировщика внутри event loop. Подписки живут в БД, при старте читаем только их часовые пояса
 async def post_init(application: Application):
+    application.bot_data['report_timezones'] = set(await repo.report_timezones())
+
     scheduler = AsyncIOScheduler()
+    scheduler.add_job(report_tick, trigger="cron", second=0, args=[application], id="report_tick", coalesce=True)
+    if config.ARCHIVE_AFTER_DAYS > 0:
+        scheduler.add_job(archive_tick, trigger="cron", hour=config.ARCHIVE_HOUR, minute=30, args=[application], id="archive_tick", coalesce=True)
+    if isinstance(application.update_processor, ChatOrderedUpdateProcessor):
+        scheduler.add_job(log_update_queue, trigger="interval", seconds=60, args=[application.update_processor])
+        processor = application.update_processor
+        metrics.UPDATE_QUEUE.set_function(lambda: {(state,): value for state, value in processor.stats().items()})
+    send_queue = application.bot.rate_limiter
+    metrics.OUTBOX_QUEUE.set_function(lambda: {(priority,): count for priority, count in send_queue.stats().items()})
     scheduler.start()
     application.bot_data['scheduler'] = scheduler
     logger.info("✅ Планировщик запущен!")
 
-# Основная функция
-def main():
-    init_db()
-
-    # 🔑 ТОКЕН
-    application = Application.builder().token("8296163167:AAHPn-gjTODYfao8G7_aWY8nEsczGgSwiJY").build()
+    # Напоминания — не задачи планировщика, а один таймер до ближайшего из них
+    timer = reminders.ReminderTimer(repo, application.bot)
+    timer.start()
+    application.bot_data['reminders'] = timer
+
+    if metrics.ENABLED and config.METRICS_PORT:
+        application.bot_data['metrics_server'] = await metrics.start_server(config.METRICS_PORT, config.METRICS_LISTEN)
+
+# Остановка: закрываем сервер метрик, таймер напоминаний, соединение с БД и поток репозитория
+async def post_shutdown(application: Application):
+    server = application.bot_data.pop('metrics_server', None)
+    if server:
+        server.close()
+        await server.wait_closed()
+    timer = application.bot_data.pop('reminders', None)
+    if timer:
+        await timer.stop()
+    await repo.close()
+
+# Сборка приложения со всеми обработчиками (без запуска — её же используют нагрузочные тесты).
+# request/get_updates_request — подмена HTTP-клиента Bot API (бенчмарк записывает вызовы вместо отправки)
+def build_application(request=None, get_updates_request=None):
+    builder = (
+        Application.builder()
+        .token(config.BOT_TOKEN)
+        .base_url(f"{config.TELEGRAM_API_URL}/bot")
+        .base_file_url(f"{config.TELEGRAM_API_URL}/file/bot")
+    )
+    if metrics.ENABLED:
+        request = metrics.InstrumentedRequest(request or HTTPXRequest(connection_pool_size=256))
+        get_updates_request = metrics.InstrumentedRequest(get_updates_request or HTTPXRequest())
+    if request is not None:
+        builder = builder.request(request).get_updates_request(get_updates_request or request)
+    if config.PERSISTENCE:
+        builder = builder.persistence(SQLitePersistence(
+            repo, update_interval=config.PERSISTENCE_UPDATE_INTERVAL, flush_delay=config.PERSISTENCE_FLUSH_DELAY,
+        ))
+    if config.CONCURRENT_UPDATES > 0:
+        builder = builder.concurrent_updates(ChatOrderedUpdateProcessor(config.CONCURRENT_UPDATES))
+    # Все исходящие запросы — через общую очередь с лимитами Telegram (см. outbox.py)
+    builder = builder.rate_limiter(outbox.SendQueue(
+        overall_rate=config.SEND_OVERALL_RATE, group_rate=config.SEND_GROUP_PER_MINUTE, group_period=60,
+        max_retries=config.SEND_MAX_RETRIES, merge=config.SEND_MERGE,
+    ))
+    application = builder.build()
 
     # Обработчики
     application.add_handler(CommandHandler("start", start))
-    application.add_handler(MessageHandler(filters.Regex("^(➕ Добавить задачу|✅ Закрыть задачу|📋 Показать все|🗑️ Удалить задачу|🕗 Настроить отчёт)$"), handle_main_menu))
+    application.add_handler(CommandHandler("cancel", cancel))
+    application.add_handler(CommandHandler("search", search))
+    application.add_handler(CommandHandler("assign", assign))
+    application.add_handler(CommandHandler("analytics", analytics_command))
+    application.add_handler(CommandHandler("due", due_command))
+    application.add_handler(CommandHandler("remind", remind_command))
+    application.add_handler(MessageHandler(filters.Regex("^(➕ Добавить задачу|✅ Закрыть задачу|📋 Показать все|🗑️ Удалить задачу|🔍 Найти задачу|🕗 Настроить отчёт)$"), handle_main_menu))
     application.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, handle_text_input))
+    application.add_handler(MessageHandler(filters.Document.ALL, handle_import_document))
     application.add_handler(CallbackQueryHandler(show_tasks_by_filter, pattern="^filter_(open|closed|all)$"))
+    application.add_handler(CallbackQueryHandler(handle_page_callback, pattern=r"^pg_[ocaxOCA]_[on]_\d+$"))
+    application.add_handler(CallbackQueryHandler(handle_select_callback, pattern=r"^sel_[OCA]_\d+_\d+$"))
+    application.add_handler(CallbackQueryHandler(handle_select_page_callback, pattern=r"^sel(all|clr)_[OCA]_\d+$"))
+    application.add_handler(CallbackQueryHandler(handle_bulk_callback, pattern=r"^bulk_(close|delete|delete_yes|cancel)$"))
+    application.add_handler(CallbackQueryHandler(handle_search_page_callback, pattern=r"^srch_\d+$"))
     application.add_handler(CallbackQueryHandler(handle_close_task_callback, pattern=r"^close_\d+$"))
     application.add_handler(CallbackQueryHandler(handle_delete_callback, pattern=r"^delete_\d+$"))
     application.add_handler(CallbackQueryHandler(handle_edit_callback, pattern=r"^edit_\d+$"))
+    application.add_handler(InlineQueryHandler(handle_inline_query))
 
     # Старые команды — для совместимости
     application.add_handler(CommandHandler("add", add_task))
     application.add_handler(CommandHandler("close", close_task))
     application.add_handler(CommandHandler("list", list_tasks))
     application.add_handler(CommandHandler("setdaily", set_daily))
+    application.add_error_handler(on_error)
+    if metrics.ENABLED:
+        metrics.instrument_application(application)
 
     # Планировщик
     application.post_init = post_init
+    application.post_shutdown = post_shutdown
+
+    return application
+
+# Основная функция
+def main():
+    init_db()
+    application = build_application()
 
     # Запуск
-    logger.info("🚀 Бот запускается...")
-    application.run_polling()
+    if config.BOT_MODE == "webhook":
+        webhook_url = config.WEBHOOK_URL or f"http://{config.WEBHOOK_LISTEN}:{config.WEBHOOK_PORT}/{config.WEBHOOK_PATH}"
+        logger.info("🚀 Бот запускается (webhook: %s)...", webhook_url)
+        application.run_webhook(
+            listen=config.WEBHOOK_LISTEN,
+            port=config.WEBHOOK_PORT,
+            url_path=config.WEBHOOK_PATH,
+            webhook_url=webhook_url,
+            secret_token=config.WEBHOOK_SECRET,
+        )
+    else:
+        logger.info("🚀 Бот запускается...")
+        application.run_polling()
 
 # Старые функции — оставим для совместимости
 async def add_task(update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -403,12 +965,7 @@ async def add_task(update: Update, context: ContextTypes.DEFAULT_TYPE):
         await update.message.reply_text("Использование: /add <описание задачи>")
         return
     description = ' '.join(context.args)
-    conn = sqlite3.connect('tasks.db')
-    cursor = conn.cursor()
-    cursor.execute('INSERT INTO tasks (description) VALUES (?)', (description,))
-    conn.commit()
-    task_id = cursor.lastrowid
-    conn.close()
+    task_id = await repo.add_task(description, chat_id=update.effective_chat.id)
     await update.message.reply_text(f"✅ Задача добавлена!\nID: {task_id}\nОписание: {description}")
 
 async def close_task(update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -417,25 +974,18 @@ async def close_task(update: Update, context: ContextTypes.DEFAULT_TYPE):
         return
     try:
         task_id = int(context.args[0])
-        time_spent = float(context.args[1])
+        time_spent = importer.parse_hours(context.args[1])
     except ValueError:
         await update.message.reply_text("ID и время должны быть числами!")
         return
-    conn = sqlite3.connect('tasks.db')
-    cursor = conn.cursor()
-    cursor.execute('SELECT description, is_closed FROM tasks WHERE id = ?', (task_id,))
-    task = cursor.fetchone()
-    if not task:
+    status, description = await repo.close_task(task_id, time_spent, chat_id=update.effective_chat.id)
+    if status == 'not_found':
         await update.message.reply_text(f"Задача с ID {task_id} не найдена.")
         return
-    if task[1]:
+    if status == 'already_closed':
         await update.message.reply_text("Задача уже закрыта!")
         return
-    now = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
-    cursor.execute('UPDATE tasks SET closed_at = ?, time_spent = ?, is_closed = 1 WHERE id = ?', (now, time_spent, task_id))
-    conn.commit()
-    conn.close()
-    await update.message.reply_text(f"✅ Задача \"{task[0]}\" закрыта.\nПотрачено времени: {time_spent} ч.")
+    await update.message.reply_text(f"✅ Задача \"{description}\" закрыта.\nПотрачено времени: {time_spent} ч.")
 
 async def list_tasks(update: Update, context: ContextTypes.DEFAULT_TYPE):
     await show_task_filters(update, context)
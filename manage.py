@@ -0,0 +1,89 @@
+import argparse
+import sys
+
+import config
+import db
+import migrations
+
+# Служебные команды для обслуживания базы:
+#   python manage.py migrate
+#   python manage.py stats            — проверить сводную статистику
+#   python manage.py stats --rebuild  — пересчитать её с нуля
+#   python manage.py archive --older-than 90  — перенести в архив задачи, закрытые больше 90 дней назад
+
+# Миграции применяет main() перед любой командой, здесь остаётся только сообщить об этом
+def cmd_migrate(args):
+    print("✅ Схема базы актуальна.")
+
+def cmd_stats(args):
+    conn = db.connect(args.db)
+    try:
+        if args.rebuild:
+            with conn:
+                db.rebuild_stats(conn)
+            print("✅ Сводная статистика пересчитана.")
+
+        problems = db.check_stats(conn)
+    finally:
+        conn.close()
+
+    if problems:
+        print("❌ Сводная статистика расходится с таблицей задач:")
+        for problem in problems:
+            print(f"  - {problem}")
+        print("Запустите: python manage.py stats --rebuild")
+        return 1
+
+    print("✅ Сводная статистика совпадает с таблицей задач.")
+    return 0
+
+def cmd_archive(args):
+    conn = db.connect(args.db)
+    try:
+        moved = db.archive_closed(conn, args.older_than, args.batch)
+        counts = db.archive_counts(conn)
+    finally:
+        conn.close()
+    print(f"🗄️ Перенесено в архив: {moved}. В работе: {counts['tasks']}, в архиве: {counts['tasks_archive']}.")
+    return 0
+
+# Задачи, созданные до появления владельцев, не видны ни одному чату в боте — их отдаёт чату эта команда
+def cmd_claim(args):
+    conn = db.connect(args.db)
+    try:
+        claimed = db.claim_tasks(conn, args.chat, args.ids, args.batch)
+        unowned = db.unowned_count(conn)
+    finally:
+        conn.close()
+    print(f"💬 Передано чату {args.chat}: {claimed}. Без владельца осталось: {unowned}.")
+    return 0
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Обслуживание базы задач")
+    parser.add_argument('--db', default=db.DATABASE, help="путь к базе (по умолчанию %(default)s)")
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    commands.add_parser('migrate', help="применить миграции схемы").set_defaults(func=cmd_migrate)
+
+    stats_parser = commands.add_parser('stats', help="проверить/пересчитать сводную статистику")
+    stats_parser.add_argument('--rebuild', action='store_true', help="пересчитать сводку с нуля")
+    stats_parser.set_defaults(func=cmd_stats)
+
+    archive_parser = commands.add_parser('archive', help="перенести старые закрытые задачи в архив")
+    archive_parser.add_argument('--older-than', type=float, default=config.ARCHIVE_AFTER_DAYS or 90,
+                                help="закрыты больше стольких дней назад (по умолчанию %(default)s)")
+    archive_parser.add_argument('--batch', type=int, default=db.ARCHIVE_BATCH, help="задач в одной транзакции")
+    archive_parser.set_defaults(func=cmd_archive)
+
+    claim_parser = commands.add_parser('claim', help="отдать задачи чату (по умолчанию все задачи без владельца)")
+    claim_parser.add_argument('--chat', type=int, required=True, help="id чата Telegram")
+    claim_parser.add_argument('--ids', type=int, nargs='+', help="только эти задачи")
+    claim_parser.add_argument('--batch', type=int, default=db.ARCHIVE_BATCH, help="задач в одной транзакции")
+    claim_parser.set_defaults(func=cmd_claim)
+
+    args = parser.parse_args(argv)
+    migrations.migrate(args.db)
+    return args.func(args) or 0
+
+if __name__ == '__main__':
+    sys.exit(main())
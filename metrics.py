@@ -0,0 +1,310 @@
+import asyncio
+import bisect
+import functools
+import logging
+import os
+import re
+import sqlite3
+import threading
+import time
+
+from telegram.request import BaseRequest
+
+logger = logging.getLogger(__name__)
+
+# Метрики процесса (бота или веб-интерфейса) в текстовом формате Prometheus.
+#
+# Гистограммы и счётчики живут в памяти процесса; наблюдение — это perf_counter, bisect
+# и инкремент под замком (единицы микросекунд), поэтому инструментирование включено всегда.
+# Отключить целиком: METRICS=0. Веб отдаёт метрики на /metrics (после входа или по METRICS_TOKEN), бот — на METRICS_PORT (если задан).
+
+ENABLED = os.environ.get('METRICS', '1') != '0'
+
+# Границы корзин гистограмм задержек, секунды
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+
+# Больше разных SQL-запросов не различаем — остальные попадают в метку "other"
+MAX_STATEMENTS = 500
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+def _labels(names, values, extra=()):
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    pairs.extend(f'{name}="{value}"' for name, value in extra)
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+def _number(value):
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Counter:
+    kind = 'counter'
+
+    def __init__(self, name, help, labelnames=()):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, *labels, amount=1):
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+    def samples(self):
+        with self._lock:
+            values = dict(self._values)
+        for labels, value in sorted(values.items()):
+            yield f'{self.name}{_labels(self.labelnames, labels)} {_number(value)}'
+
+
+class Histogram:
+    kind = 'histogram'
+
+    def __init__(self, name, help, labelnames=(), buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(buckets)
+        # метки -> [счётчики по корзинам (не накопительные) + переполнение, сумма, количество]
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value, *labels):
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            state = self._values.get(labels)
+            if state is None:
+                state = self._values[labels] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            state[0][index] += 1
+            state[1] += value
+            state[2] += 1
+
+    def samples(self):
+        with self._lock:
+            values = {labels: (list(counts), total, count) for labels, (counts, total, count) in self._values.items()}
+        for labels, (counts, total, count) in sorted(values.items()):
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets + (float('inf'),), counts):
+                cumulative += bucket_count
+                yield f'{self.name}_bucket{_labels(self.labelnames, labels, [("le", _number(bound))])} {cumulative}'
+            yield f'{self.name}_sum{_labels(self.labelnames, labels)} {_number(total)}'
+            yield f'{self.name}_count{_labels(self.labelnames, labels)} {count}'
+
+
+# Значение, которое читается в момент выгрузки: func() -> {кортеж меток: число}
+class Gauge:
+    kind = 'gauge'
+
+    def __init__(self, name, help, labelnames=()):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self._func = None
+
+    def set_function(self, func):
+        self._func = func
+
+    def samples(self):
+        if self._func is None:
+            return
+        for labels, value in sorted(self._func().items()):
+            yield f'{self.name}{_labels(self.labelnames, labels)} {_number(value)}'
+
+
+REGISTRY = []
+
+def _register(metric):
+    REGISTRY.append(metric)
+    return metric
+
+def render():
+    lines = []
+    for metric in REGISTRY:
+        lines.append(f'# HELP {metric.name} {metric.help}')
+        lines.append(f'# TYPE {metric.name} {metric.kind}')
+        lines.extend(metric.samples())
+    return '\n'.join(lines) + '\n'
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+
+HANDLER_LATENCY = _register(Histogram('bot_handler_duration_seconds', 'Время работы обработчика апдейта', ['handler']))
+HANDLER_ERRORS = _register(Counter('bot_handler_errors_total', 'Исключения в обработчиках', ['handler', 'error']))
+UPDATE_QUEUE = _register(Gauge('bot_update_queue', 'Очередь апдейтов при параллельной обработке', ['state']))
+TELEGRAM_REQUESTS = _register(Counter('telegram_api_requests_total', 'Вызовы Bot API', ['method', 'status']))
+TELEGRAM_LATENCY = _register(Histogram('telegram_api_request_duration_seconds', 'Время вызова Bot API', ['method']))
+HTTP_LATENCY = _register(Histogram('http_request_duration_seconds', 'Время обработки HTTP-запроса', ['endpoint', 'method', 'status']))
+SQL_LATENCY = _register(Histogram('sql_statement_duration_seconds', 'Время выполнения SQL (execute: подготовка и первый шаг)', ['statement']))
+SQL_ERRORS = _register(Counter('sql_statement_errors_total', 'Ошибки SQL', ['statement', 'error']))
+WRITE_BATCH_SIZE = _register(Histogram('db_write_batch_size', 'Операций в одной транзакции групповой записи', buckets=(1, 2, 4, 8, 16, 32, 64, 128, 256)))
+OUTBOX_QUEUE = _register(Gauge('bot_outbox_queue', 'Исходящие запросы в очереди отправки', ['priority']))
+OUTBOX_RETRIES = _register(Counter('bot_outbox_retry_after_total', 'Ответы 429 (RetryAfter) от Bot API', ['method']))
+OUTBOX_MERGED = _register(Counter('bot_outbox_merged_total', 'Сообщения, отправленные вместе с предыдущим'))
+
+
+# --- Бот: обработчики PTB ---
+
+def instrument_handler(handler):
+    callback = handler.callback
+    name = getattr(callback, '__name__', type(handler).__name__)
+
+    @functools.wraps(callback)
+    async def timed(update, context):
+        started = time.perf_counter()
+        try:
+            return await callback(update, context)
+        except Exception as e:
+            HANDLER_ERRORS.inc(name, type(e).__name__)
+            raise
+        finally:
+            HANDLER_LATENCY.observe(time.perf_counter() - started, name)
+
+    handler.callback = timed
+
+# Обернуть все уже зарегистрированные обработчики приложения
+def instrument_application(application):
+    for handlers in application.handlers.values():
+        for handler in handlers:
+            instrument_handler(handler)
+
+
+# HTTP-клиент Bot API, который считает вызовы по методам и статусам и меряет их время
+class InstrumentedRequest(BaseRequest):
+    def __init__(self, inner):
+        self.inner = inner
+
+    @property
+    def read_timeout(self):
+        return self.inner.read_timeout
+
+    async def initialize(self):
+        await self.inner.initialize()
+
+    async def shutdown(self):
+        await self.inner.shutdown()
+
+    async def do_request(self, url, method, request_data=None, read_timeout=BaseRequest.DEFAULT_NONE,
+                         write_timeout=BaseRequest.DEFAULT_NONE, connect_timeout=BaseRequest.DEFAULT_NONE,
+                         pool_timeout=BaseRequest.DEFAULT_NONE):
+        api_method = url.rsplit('/', 1)[-1]
+        started = time.perf_counter()
+        status = 'error'
+        try:
+            code, payload = await self.inner.do_request(
+                url, method, request_data=request_data, read_timeout=read_timeout,
+                write_timeout=write_timeout, connect_timeout=connect_timeout, pool_timeout=pool_timeout,
+            )
+            status = str(code)
+            return code, payload
+        finally:
+            TELEGRAM_LATENCY.observe(time.perf_counter() - started, api_method)
+            TELEGRAM_REQUESTS.inc(api_method, status)
+
+
+# Минимальный HTTP-сервер для бота: GET /metrics, больше ничего. Работает в том же event loop
+async def start_server(port, host='127.0.0.1'):
+    async def handle(reader, writer):
+        try:
+            request_line = await asyncio.wait_for(reader.readline(), 5)
+            # Заголовки запроса не нужны, но их надо дочитать
+            while (await asyncio.wait_for(reader.readline(), 5)) not in (b'\r\n', b'\n', b''):
+                pass
+            parts = request_line.decode('latin-1').split()
+            if len(parts) >= 2 and parts[0] == 'GET' and parts[1].split('?')[0] == '/metrics':
+                status, content_type, body = '200 OK', CONTENT_TYPE, render().encode()
+            else:
+                status, content_type, body = '404 Not Found', 'text/plain', b'not found\n'
+            writer.write(
+                f'HTTP/1.1 {status}\r\nContent-Type: {content_type}\r\n'
+                f'Content-Length: {len(body)}\r\nConnection: close\r\n\r\n'.encode() + body
+            )
+            await writer.drain()
+        except (asyncio.TimeoutError, ConnectionError):
+            pass
+        finally:
+            writer.close()
+
+    server = await asyncio.start_server(handle, host, port)
+    logger.info("📈 Метрики бота: http://%s:%s/metrics", host, port)
+    return server
+
+
+# --- Веб: все маршруты Flask ---
+
+def instrument_flask(app):
+    from flask import g, request
+
+    @app.before_request
+    def _start_timer():
+        g.metrics_started = time.perf_counter()
+
+    # after_request вызывается и для ответов 500 (после обработчика ошибок)
+    @app.after_request
+    def _observe(response):
+        started = g.pop('metrics_started', None)
+        if started is not None:
+            HTTP_LATENCY.observe(time.perf_counter() - started, request.endpoint or 'unknown', request.method, str(response.status_code))
+        return response
+
+
+# --- SQL: соединение, которое меряет каждый запрос ---
+
+_statements = set()
+_labels_by_sql = {}
+
+# Метка запроса: текст без лишних пробелов, списки "?, ?, ?" и повторы условий схлопнуты.
+# Текст запроса почти всегда один и тот же объект-строка, так что это поиск в словаре
+def statement_label(sql):
+    label = _labels_by_sql.get(sql)
+    if label is None:
+        label = _labels_by_sql[sql] = _make_label(sql) if len(_labels_by_sql) < 4 * MAX_STATEMENTS else 'other'
+    return label
+
+def _make_label(sql):
+    label = ' '.join(sql.split())
+    label = re.sub(r'\?(\s*,\s*\?)+', '?, …', label)
+    label = re.sub(r'(\([^()]*\?[^()]*\))(\s+(OR|,)\s+\([^()]*\?[^()]*\))+', r'\1 …', label)
+    label = label[:300]
+    if label not in _statements:
+        if len(_statements) >= MAX_STATEMENTS:
+            return 'other'
+        _statements.add(label)
+    return label
+
+class TimedCursor(sqlite3.Cursor):
+    def execute(self, sql, parameters=()):
+        started = time.perf_counter()
+        try:
+            return super().execute(sql, parameters)
+        except sqlite3.Error as e:
+            SQL_ERRORS.inc(statement_label(sql), type(e).__name__)
+            raise
+        finally:
+            SQL_LATENCY.observe(time.perf_counter() - started, statement_label(sql))
+
+    def executemany(self, sql, seq_of_parameters):
+        started = time.perf_counter()
+        try:
+            return super().executemany(sql, seq_of_parameters)
+        except sqlite3.Error as e:
+            SQL_ERRORS.inc(statement_label(sql), type(e).__name__)
+            raise
+        finally:
+            SQL_LATENCY.observe(time.perf_counter() - started, statement_label(sql))
+
+# Фабрика для sqlite3.connect(factory=...): Connection.execute в C не вызывает cursor(),
+# поэтому execute/executemany переопределены явно
+class TimedConnection(sqlite3.Connection):
+    def cursor(self, factory=TimedCursor):
+        return super().cursor(factory)
+
+    def execute(self, sql, parameters=()):
+        return self.cursor().execute(sql, parameters)
+
+    def executemany(self, sql, seq_of_parameters):
+        return self.cursor().executemany(sql, seq_of_parameters)
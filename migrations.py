@@ -0,0 +1,465 @@
+import logging
+
+import db
+
+logger = logging.getLogger(__name__)
+
+# Версионированные миграции схемы. Номер версии хранится в PRAGMA user_version:
+# миграция N применяется, если user_version < N. Новые миграции только добавляются в конец списка.
+
+# 1. Исходная схема (в старых базах таблица уже есть — тогда ничего не делаем)
+def _initial_schema(conn):
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS tasks (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            description TEXT NOT NULL,
+            created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+            closed_at DATETIME,
+            time_spent REAL,
+            is_closed BOOLEAN DEFAULT 0
+        )
+    ''')
+
+# 2. Время как INTEGER unix epoch, чтобы возраст и диапазоны дат считались прямо в SQL.
+# created_at раньше писался через CURRENT_TIMESTAMP (UTC), а closed_at — локальным временем бота
+def _epoch_timestamps(conn):
+    seq = conn.execute("SELECT seq FROM sqlite_sequence WHERE name = 'tasks'").fetchone()
+
+    conn.execute('''
+        CREATE TABLE tasks_new (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            description TEXT NOT NULL,
+            created_at INTEGER NOT NULL DEFAULT (CAST(strftime('%s', 'now') AS INTEGER)),
+            closed_at INTEGER,
+            time_spent REAL,
+            is_closed INTEGER NOT NULL DEFAULT 0
+        )
+    ''')
+    conn.execute('''
+        INSERT INTO tasks_new (id, description, created_at, closed_at, time_spent, is_closed)
+        SELECT
+            id,
+            description,
+            COALESCE(CAST(strftime('%s', created_at) AS INTEGER), CAST(strftime('%s', 'now') AS INTEGER)),
+            CAST(strftime('%s', closed_at, 'utc') AS INTEGER),
+            time_spent,
+            COALESCE(is_closed, 0)
+        FROM tasks
+    ''')
+    conn.execute('DROP TABLE tasks')
+    conn.execute('ALTER TABLE tasks_new RENAME TO tasks')
+
+    # AUTOINCREMENT не должен выдать заново id удалённых задач
+    if seq:
+        conn.execute("UPDATE sqlite_sequence SET seq = MAX(seq, ?) WHERE name = 'tasks'", (seq[0],))
+
+# 3. Индексы под списки открытых/закрытых задач, статистику и фильтр по дате
+def _listing_indexes(conn):
+    # Открытые: списки по id и отчёт по возрасту задачи
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_tasks_open ON tasks(id, created_at) WHERE is_closed = 0')
+    # Закрытые: списки по id
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_tasks_closed ON tasks(id) WHERE is_closed = 1')
+    # Закрытые: AVG(time_spent) и топ самых долгих читаются только из индекса
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_tasks_closed_time ON tasks(time_spent) WHERE is_closed = 1')
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_tasks_created ON tasks(created_at)')
+
+# 4. Счётчик изменений данных: растёт при любой записи в tasks из любого процесса.
+# По нему кэшируются выгрузки и прочие производные от таблицы данные
+def _data_version(conn):
+    conn.execute('CREATE TABLE meta (key TEXT PRIMARY KEY, value INTEGER NOT NULL) WITHOUT ROWID')
+    conn.execute("INSERT INTO meta (key, value) VALUES ('data_version', 0)")
+    for event in ('INSERT', 'UPDATE', 'DELETE'):
+        conn.execute(f'''
+            CREATE TRIGGER tasks_data_version_{event.lower()} AFTER {event} ON tasks
+            BEGIN
+                UPDATE meta SET value = value + 1 WHERE key = 'data_version';
+            END
+        ''')
+
+# Сколько самых долгих задач держим в task_top
+TOP_N = 5
+
+# Пересобрать task_top: читает TOP_N записей с конца индекса idx_tasks_closed_time
+REFILL_TOP = f'''
+    DELETE FROM task_top;
+    INSERT INTO task_top (task_id, description, time_spent)
+    SELECT id, description, time_spent
+    FROM tasks
+    WHERE is_closed = 1 AND time_spent IS NOT NULL
+    ORDER BY time_spent DESC
+    LIMIT {TOP_N};
+'''
+
+# Вклад строки задачи в счётчики task_stats: (open, closed, сумма времени, число задач со временем)
+def _stats_delta(row, sign, count_total=True):
+    total = f'total = total {sign} 1,' if count_total else ''
+    return f'''
+        UPDATE task_stats SET
+            {total}
+            open_count = open_count {sign} ({row}.is_closed = 0),
+            closed_count = closed_count {sign} ({row}.is_closed = 1),
+            time_sum = time_sum {sign} (CASE WHEN {row}.is_closed = 1 THEN COALESCE({row}.time_spent, 0) ELSE 0 END),
+            time_count = time_count {sign} ({row}.is_closed = 1 AND {row}.time_spent IS NOT NULL)
+        WHERE id = 1;
+    '''
+
+# 5. Сводная статистика, которую поддерживают триггеры: /api/stats читает одну строку вместо
+# пяти запросов по всей таблице. Топ самых долгих задач лежит в task_top и пересобирается
+# только когда изменение может его затронуть
+def _stats_summary(conn):
+    conn.execute('''
+        CREATE TABLE task_stats (
+            id INTEGER PRIMARY KEY CHECK (id = 1),
+            total INTEGER NOT NULL,
+            open_count INTEGER NOT NULL,
+            closed_count INTEGER NOT NULL,
+            time_sum REAL NOT NULL,
+            time_count INTEGER NOT NULL
+        )
+    ''')
+    conn.execute('''
+        CREATE TABLE task_top (
+            task_id INTEGER PRIMARY KEY,
+            description TEXT NOT NULL,
+            time_spent REAL NOT NULL
+        )
+    ''')
+    conn.execute(f'''
+        CREATE TRIGGER tasks_stats_insert AFTER INSERT ON tasks
+        BEGIN
+            {_stats_delta('new', '+')}
+        END
+    ''')
+    conn.execute(f'''
+        CREATE TRIGGER tasks_stats_delete AFTER DELETE ON tasks
+        BEGIN
+            {_stats_delta('old', '-')}
+        END
+    ''')
+    conn.execute(f'''
+        CREATE TRIGGER tasks_stats_update AFTER UPDATE OF is_closed, time_spent ON tasks
+        BEGIN
+            {_stats_delta('old', '-', count_total=False)}
+            {_stats_delta('new', '+', count_total=False)}
+        END
+    ''')
+
+    # Новая задача попадает в топ, если топ не заполнен или она дольше самой короткой в нём
+    qualifies = f'''
+        new.is_closed = 1 AND new.time_spent IS NOT NULL AND (
+            (SELECT COUNT(*) FROM task_top) < {TOP_N}
+            OR new.time_spent > (SELECT MIN(time_spent) FROM task_top)
+        )
+    '''
+    in_top = 'EXISTS (SELECT 1 FROM task_top WHERE task_id = old.id)'
+    conn.execute(f'''
+        CREATE TRIGGER tasks_top_insert AFTER INSERT ON tasks
+        WHEN {qualifies}
+        BEGIN
+            {REFILL_TOP}
+        END
+    ''')
+    conn.execute(f'''
+        CREATE TRIGGER tasks_top_delete AFTER DELETE ON tasks
+        WHEN {in_top}
+        BEGIN
+            {REFILL_TOP}
+        END
+    ''')
+    conn.execute(f'''
+        CREATE TRIGGER tasks_top_update AFTER UPDATE OF is_closed, time_spent, description ON tasks
+        WHEN {in_top} OR {qualifies}
+        BEGIN
+            {REFILL_TOP}
+        END
+    ''')
+
+    # Начальные значения по уже существующим задачам
+    conn.execute('''
+        INSERT INTO task_stats (id, total, open_count, closed_count, time_sum, time_count)
+        SELECT
+            1,
+            COUNT(*),
+            COALESCE(SUM(is_closed = 0), 0),
+            COALESCE(SUM(is_closed = 1), 0),
+            COALESCE(SUM(CASE WHEN is_closed = 1 THEN time_spent END), 0),
+            COUNT(CASE WHEN is_closed = 1 THEN time_spent END)
+        FROM tasks
+    ''')
+    for statement in REFILL_TOP.split(';'):
+        if statement.strip():
+            conn.execute(statement)
+
+# 6. Подписки на ежедневный отчёт: время доставки (минута суток) и часовой пояс чата.
+# Индекс (tz, minute_of_day) — ежеминутный тик читает только те чаты, которым пора
+def _report_subscriptions(conn):
+    conn.execute('''
+        CREATE TABLE report_subscriptions (
+            chat_id INTEGER PRIMARY KEY,
+            minute_of_day INTEGER NOT NULL CHECK (minute_of_day BETWEEN 0 AND 1439),
+            tz TEXT NOT NULL
+        )
+    ''')
+    conn.execute('CREATE INDEX idx_report_subscriptions_due ON report_subscriptions(tz, minute_of_day)')
+
+# 7. Состояние диалогов бота (context.user_data / chat_data) в виде JSON, см. persistence.py.
+# kind — 'user', 'chat' или 'conversation:<имя>', key — id пользователя/чата
+def _persistence(conn):
+    conn.execute('''
+        CREATE TABLE persistence_data (
+            kind TEXT NOT NULL,
+            key TEXT NOT NULL,
+            data TEXT NOT NULL,
+            PRIMARY KEY (kind, key)
+        ) WITHOUT ROWID
+    ''')
+
+# 8. Полнотекстовый поиск по описаниям задач: FTS5-индекс поверх tasks (external content —
+# текст не дублируется, в индексе только токены), синхронизируется триггерами.
+# prefix='2 3' — отдельные индексы префиксов, чтобы поиск "по началу слова" не перебирал весь словарь
+def _search_index(conn):
+    conn.execute('''
+        CREATE VIRTUAL TABLE tasks_fts USING fts5(
+            description,
+            content='tasks',
+            content_rowid='id',
+            tokenize='unicode61 remove_diacritics 2',
+            prefix='2 3'
+        )
+    ''')
+    conn.execute('''
+        CREATE TRIGGER tasks_fts_insert AFTER INSERT ON tasks BEGIN
+            INSERT INTO tasks_fts (rowid, description) VALUES (new.id, new.description);
+        END
+    ''')
+    conn.execute('''
+        CREATE TRIGGER tasks_fts_delete AFTER DELETE ON tasks BEGIN
+            INSERT INTO tasks_fts (tasks_fts, rowid, description) VALUES ('delete', old.id, old.description);
+        END
+    ''')
+    conn.execute('''
+        CREATE TRIGGER tasks_fts_update AFTER UPDATE OF description ON tasks BEGIN
+            INSERT INTO tasks_fts (tasks_fts, rowid, description) VALUES ('delete', old.id, old.description);
+            INSERT INTO tasks_fts (rowid, description) VALUES (new.id, new.description);
+        END
+    ''')
+    conn.execute("INSERT INTO tasks_fts (tasks_fts) VALUES ('rebuild')")
+
+# Пересобрать task_top по горячей таблице и архиву: tasks_all — UNION ALL двух таблиц,
+# SQLite сливает два индекса по time_spent и читает TOP_N записей
+REFILL_TOP_ALL = f'''
+    DELETE FROM task_top;
+    INSERT INTO task_top (task_id, description, time_spent)
+    SELECT id, description, time_spent
+    FROM tasks_all
+    WHERE is_closed = 1 AND time_spent IS NOT NULL
+    ORDER BY time_spent DESC
+    LIMIT {TOP_N};
+'''
+
+# 9. Архив закрытых задач (см. db.archive_batch): старые закрытые задачи переезжают из tasks в tasks_archive
+# в том же файле базы, так что перенос — одна транзакция, а триггеры сводки и поиска видят обе таблицы.
+# Представление tasks_all объединяет их для списков "закрытые"/"все", поиска и выгрузок.
+# id в двух таблицах не пересекаются (AUTOINCREMENT не выдаёт их повторно)
+def _archive(conn):
+    conn.execute('''
+        CREATE TABLE tasks_archive (
+            id INTEGER PRIMARY KEY,
+            description TEXT NOT NULL,
+            created_at INTEGER NOT NULL,
+            closed_at INTEGER,
+            time_spent REAL,
+            is_closed INTEGER NOT NULL DEFAULT 1
+        )
+    ''')
+    conn.execute('CREATE INDEX idx_tasks_archive_time ON tasks_archive(time_spent)')
+    conn.execute('CREATE INDEX idx_tasks_archive_created ON tasks_archive(created_at)')
+    # Кандидаты в архив: закрытые задачи по дате закрытия
+    conn.execute('CREATE INDEX idx_tasks_closed_at ON tasks(closed_at) WHERE is_closed = 1')
+    conn.execute('''
+        CREATE VIEW tasks_all AS
+        SELECT id, description, created_at, closed_at, time_spent, is_closed FROM tasks
+        UNION ALL
+        SELECT id, description, created_at, closed_at, time_spent, is_closed FROM tasks_archive
+    ''')
+
+    for event in ('INSERT', 'UPDATE', 'DELETE'):
+        conn.execute(f'''
+            CREATE TRIGGER tasks_archive_data_version_{event.lower()} AFTER {event} ON tasks_archive
+            BEGIN
+                UPDATE meta SET value = value + 1 WHERE key = 'data_version';
+            END
+        ''')
+
+    # Сводка считает обе таблицы: перенос (удаление из tasks + вставка в архив) её не меняет
+    conn.execute(f'''
+        CREATE TRIGGER tasks_archive_stats_insert AFTER INSERT ON tasks_archive
+        BEGIN
+            {_stats_delta('new', '+')}
+        END
+    ''')
+    conn.execute(f'''
+        CREATE TRIGGER tasks_archive_stats_delete AFTER DELETE ON tasks_archive
+        BEGIN
+            {_stats_delta('old', '-')}
+        END
+    ''')
+    conn.execute(f'''
+        CREATE TRIGGER tasks_archive_stats_update AFTER UPDATE OF is_closed, time_spent ON tasks_archive
+        BEGIN
+            {_stats_delta('old', '-', count_total=False)}
+            {_stats_delta('new', '+', count_total=False)}
+        END
+    ''')
+
+    # Топ теперь пересобирается по обеим таблицам
+    qualifies = f'''
+        new.is_closed = 1 AND new.time_spent IS NOT NULL AND (
+            (SELECT COUNT(*) FROM task_top) < {TOP_N}
+            OR new.time_spent > (SELECT MIN(time_spent) FROM task_top)
+        )
+    '''
+    in_top = 'EXISTS (SELECT 1 FROM task_top WHERE task_id = old.id)'
+    for table in ('tasks', 'tasks_archive'):
+        for event, condition in (('INSERT', qualifies), ('DELETE', in_top),
+                                 ('UPDATE OF is_closed, time_spent, description', f'{in_top} OR {qualifies}')):
+            name = f'{table}_top_{event.split()[0].lower()}'
+            conn.execute(f'DROP TRIGGER IF EXISTS {name}')
+            conn.execute(f'''
+                CREATE TRIGGER {name} AFTER {event} ON {table}
+                WHEN {condition}
+                BEGIN
+                    {REFILL_TOP_ALL}
+                END
+            ''')
+
+    # Поисковый индекс пересоздаётся с содержимым из tasks_all, чтобы 'rebuild' видел и архив
+    conn.execute('DROP TABLE tasks_fts')
+    conn.execute('''
+        CREATE VIRTUAL TABLE tasks_fts USING fts5(
+            description,
+            content='tasks_all',
+            content_rowid='id',
+            tokenize='unicode61 remove_diacritics 2',
+            prefix='2 3'
+        )
+    ''')
+    conn.execute('''
+        CREATE TRIGGER tasks_archive_fts_insert AFTER INSERT ON tasks_archive BEGIN
+            INSERT INTO tasks_fts (rowid, description) VALUES (new.id, new.description);
+        END
+    ''')
+    conn.execute('''
+        CREATE TRIGGER tasks_archive_fts_delete AFTER DELETE ON tasks_archive BEGIN
+            INSERT INTO tasks_fts (tasks_fts, rowid, description) VALUES ('delete', old.id, old.description);
+        END
+    ''')
+    conn.execute('''
+        CREATE TRIGGER tasks_archive_fts_update AFTER UPDATE OF description ON tasks_archive BEGIN
+            INSERT INTO tasks_fts (tasks_fts, rowid, description) VALUES ('delete', old.id, old.description);
+            INSERT INTO tasks_fts (rowid, description) VALUES (new.id, new.description);
+        END
+    ''')
+    conn.execute("INSERT INTO tasks_fts (tasks_fts) VALUES ('rebuild')")
+
+# 10. Владелец задачи: чат, в котором она заведена (chat_id), и необязательный исполнитель.
+# Индексы начинаются с chat_id, поэтому списки, закрытие и отчёт одного чата читают только его строки:
+# (chat_id, is_closed) — открытые/закрытые, (chat_id) — все; id в конце любого индекса есть неявно.
+# Старые задачи остаются без чата: при старте бот отдаёт их чату ADMIN_CHAT_ID (main.claim_unowned_tasks),
+# а без него предупреждает в логе; вручную их раздаёт чатам manage.py claim
+def _task_owner(conn):
+    for table in ('tasks', 'tasks_archive'):
+        conn.execute(f'ALTER TABLE {table} ADD COLUMN chat_id INTEGER')
+        conn.execute(f'ALTER TABLE {table} ADD COLUMN assignee TEXT')
+    conn.execute('CREATE INDEX idx_tasks_chat_status ON tasks(chat_id, is_closed)')
+    conn.execute('CREATE INDEX idx_tasks_chat ON tasks(chat_id)')
+    conn.execute('CREATE INDEX idx_tasks_archive_chat ON tasks_archive(chat_id)')
+
+    conn.execute('DROP VIEW tasks_all')
+    conn.execute('''
+        CREATE VIEW tasks_all AS
+        SELECT id, description, created_at, closed_at, time_spent, is_closed, chat_id, assignee FROM tasks
+        UNION ALL
+        SELECT id, description, created_at, closed_at, time_spent, is_closed, chat_id, assignee FROM tasks_archive
+    ''')
+
+# Сколько последних изменений хранит журнал task_changes (старые срезаются пачками по CHANGE_LOG_TRIM)
+CHANGE_LOG_SIZE = 100000
+CHANGE_LOG_TRIM = 1000
+
+# 11. Журнал изменений: каждая запись в задачу добавляет строку (seq, id задачи). Клиенты помнят
+# последний seq и забирают только изменённые с тех пор задачи (db.changes_since).
+# AUTOINCREMENT — чтобы seq никогда не повторялся, даже если журнал срезан целиком.
+# Вставка в архив не пишется: её всегда предваряет удаление из tasks, которое уже в журнале
+def _change_log(conn):
+    conn.execute('CREATE TABLE task_changes (seq INTEGER PRIMARY KEY AUTOINCREMENT, task_id INTEGER NOT NULL)')
+    for table, events in (('tasks', ('INSERT', 'UPDATE', 'DELETE')), ('tasks_archive', ('UPDATE', 'DELETE'))):
+        for event in events:
+            row = 'old' if event == 'DELETE' else 'new'
+            conn.execute(f'''
+                CREATE TRIGGER {table}_changes_{event.lower()} AFTER {event} ON {table}
+                BEGIN
+                    INSERT INTO task_changes (task_id) VALUES ({row}.id);
+                END
+            ''')
+    conn.execute(f'''
+        CREATE TRIGGER task_changes_trim AFTER INSERT ON task_changes
+        WHEN new.seq % {CHANGE_LOG_TRIM} = 0
+        BEGIN
+            DELETE FROM task_changes WHERE seq <= new.seq - {CHANGE_LOG_SIZE};
+        END
+    ''')
+
+# 12. Срок (due_at) и напоминание (remind_at), unix epoch. Ждущие напоминания — в частичном индексе:
+# таймер бота (reminders.py) одним чтением его начала узнаёт ближайшее, а сработавшее напоминание
+# обнуляется и из индекса выпадает. Закрытые задачи в индекс не попадают — их напоминания не нужны
+def _deadlines(conn):
+    for table in ('tasks', 'tasks_archive'):
+        conn.execute(f'ALTER TABLE {table} ADD COLUMN due_at INTEGER')
+        conn.execute(f'ALTER TABLE {table} ADD COLUMN remind_at INTEGER')
+    conn.execute('CREATE INDEX idx_tasks_remind ON tasks(remind_at) WHERE remind_at IS NOT NULL AND is_closed = 0')
+
+    conn.execute('DROP VIEW tasks_all')
+    conn.execute('''
+        CREATE VIEW tasks_all AS
+        SELECT id, description, created_at, closed_at, time_spent, is_closed, chat_id, assignee, due_at, remind_at FROM tasks
+        UNION ALL
+        SELECT id, description, created_at, closed_at, time_spent, is_closed, chat_id, assignee, due_at, remind_at FROM tasks_archive
+    ''')
+
+MIGRATIONS = [
+    _initial_schema,
+    _epoch_timestamps,
+    _listing_indexes,
+    _data_version,
+    _stats_summary,
+    _report_subscriptions,
+    _persistence,
+    _search_index,
+    _archive,
+    _task_owner,
+    _change_log,
+    _deadlines,
+]
+
+# Применить недостающие миграции. Каждая идёт в своей транзакции вместе с новым user_version;
+# BEGIN IMMEDIATE не даёт боту и веб-интерфейсу мигрировать одну базу одновременно
+def migrate(path=db.DATABASE):
+    conn = db.connect(path, isolation_level=None)
+    try:
+        for version, migration in enumerate(MIGRATIONS, start=1):
+            conn.execute('BEGIN IMMEDIATE')
+            try:
+                current = conn.execute('PRAGMA user_version').fetchone()[0]
+                if current >= version:
+                    conn.execute('COMMIT')
+                    continue
+                migration(conn)
+                conn.execute(f'PRAGMA user_version = {version}')
+                conn.execute('COMMIT')
+            except Exception:
+                conn.execute('ROLLBACK')
+                raise
+            logger.info("🛠️ Миграция %s (%s) применена", version, migration.__name__.lstrip('_'))
+    finally:
+        conn.close()
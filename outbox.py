@@ -0,0 +1,323 @@
+import asyncio
+import heapq
+import itertools
+import logging
+import time
+
+from telegram.error import RetryAfter
+from telegram.ext import BaseRateLimiter
+
+import metrics
+
+logger = logging.getLogger(__name__)
+
+# Единая очередь исходящих запросов к Bot API. Подключается к боту как rate limiter PTB,
+# поэтому через неё идёт всё: reply_text в обработчиках, правки сообщений, ежедневные отчёты.
+#
+# - Общий лимит: не больше OVERALL_RATE запросов в секунду на бота (token bucket).
+# - Группы (chat_id < 0): не больше GROUP_RATE сообщений за GROUP_PERIOD секунд на чат.
+# - Внутри чата запросы уходят по одному и по порядку; между чатами первыми идут ответы
+#   пользователям (INTERACTIVE), рассылки (BULK) — когда лимит свободен.
+# - RetryAfter: ждём retry_after плюс растущую паузу и повторяем, не больше MAX_RETRIES раз.
+# - Несколько простых текстовых сообщений, скопившихся в очереди одного чата, уходят одним.
+# Запросы без chat_id (answerCallbackQuery, getFile...) в очередь не встают, только повторяются при 429.
+
+INTERACTIVE = 0
+BULK = 1
+PRIORITY_NAMES = {INTERACTIVE: 'interactive', BULK: 'bulk'}
+
+OVERALL_RATE = 30
+GROUP_RATE = 20
+GROUP_PERIOD = 60
+MAX_RETRIES = 5
+# Доля общего лимита, которую рассылки не трогают: ответ пользователю, пришедший посреди
+# рассылки, уходит сразу, а не ждёт, пока освободится токен
+INTERACTIVE_RESERVE = 0.2
+
+# Склеиваются только сообщения без разметки, клавиатур и ответов — остальные параметры должны совпадать
+MERGE_KEYS = frozenset({'chat_id', 'text', 'disable_notification', 'message_thread_id', 'protect_content'})
+MERGE_SEPARATOR = '\n\n'
+# Лимит Telegram на длину сообщения (в UTF-16 символах)
+MESSAGE_LIMIT = 4096
+
+# Как часто выбрасывать состояние чатов, которым нечего отправлять, секунды
+SWEEP_INTERVAL = 60
+
+
+# Длина так, как её считает Telegram: в кодовых единицах UTF-16 (эмодзи — это два символа)
+def message_units(text):
+    return len(text.encode('utf-16-le')) // 2
+
+# Пауза перед повтором после 429: retry_after от Telegram и 0.5, 1, 2... секунды сверху
+def _backoff(retry_after, attempt):
+    return retry_after + 0.5 * 2 ** (attempt - 1)
+
+
+# Token bucket: capacity запросов сразу, дальше rate в секунду
+class _Bucket:
+    __slots__ = ('capacity', 'rate', 'tokens', 'updated')
+
+    def __init__(self, capacity, period):
+        self.capacity = capacity
+        self.rate = capacity / period
+        self.tokens = capacity
+        self.updated = time.monotonic()
+
+    def _refill(self, now):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    # Через сколько секунд в корзине будет need токенов (0 — уже есть)
+    def delay(self, now, need=1):
+        self._refill(now)
+        return 0 if self.tokens >= need else (need - self.tokens) / self.rate
+
+    def take(self, now):
+        self._refill(now)
+        self.tokens -= 1
+
+    def full(self, now):
+        self._refill(now)
+        return self.tokens >= self.capacity
+
+
+class _Item:
+    __slots__ = ('priority', 'seq', 'endpoint', 'data', 'callback', 'args', 'kwargs', 'futures', 'attempt', 'mergeable')
+
+    def __init__(self, priority, seq, endpoint, data, callback, args, kwargs, mergeable):
+        self.priority = priority
+        self.seq = seq
+        self.endpoint = endpoint
+        self.data = data
+        self.callback = callback
+        self.args = args
+        self.kwargs = kwargs
+        self.futures = [asyncio.get_running_loop().create_future()]
+        self.attempt = 0
+        self.mergeable = mergeable
+
+    def __lt__(self, other):
+        return (self.priority, self.seq) < (other.priority, other.seq)
+
+    def extra(self):
+        return {key: value for key, value in self.data.items() if key != 'text'}
+
+    def resolve(self, result=None, error=None):
+        for future in self.futures:
+            if future.done():
+                continue
+            if error is not None:
+                future.set_exception(error)
+            else:
+                future.set_result(result)
+
+
+class _Chat:
+    __slots__ = ('items', 'bucket', 'busy', 'blocked_until')
+
+    def __init__(self, bucket):
+        self.items = []  # куча _Item: приоритет, затем порядок постановки
+        self.bucket = bucket
+        self.busy = False
+        self.blocked_until = 0.0
+
+
+class SendQueue(BaseRateLimiter):
+    def __init__(self, overall_rate=OVERALL_RATE, group_rate=GROUP_RATE, group_period=GROUP_PERIOD,
+                 max_retries=MAX_RETRIES, merge=True):
+        self.overall_rate = overall_rate
+        self.group_rate = group_rate
+        self.group_period = group_period
+        self.max_retries = max_retries
+        self.merge = merge
+        # overall_rate=0 — без общего лимита (бенчмарк меряет обработчики, а не лимиты Telegram)
+        self._overall = _Bucket(overall_rate, 1) if overall_rate > 0 else None
+        self._bulk_need = 1 + overall_rate * INTERACTIVE_RESERVE
+        self._paused_until = 0.0
+        self._chats = {}
+        self._ready = []    # куча (приоритет, порядок, chat_id): чаты, которым можно отправлять
+        self._waiting = []  # куча (когда, chat_id): чаты, ждущие лимита или паузы после 429
+        self._seq = itertools.count()
+        self._wakeup = None
+        self._worker = None
+        self._sending = set()
+
+    # PTB вызывает initialize дважды (Application и Updater) — второй вызов не должен
+    # заводить второй рабочий цикл поверх первого
+    async def initialize(self):
+        if self._worker is not None:
+            return
+        self._wakeup = asyncio.Event()
+        self._worker = asyncio.create_task(self._run())
+
+    async def shutdown(self):
+        if self._worker:
+            self._worker.cancel()
+            try:
+                await self._worker
+            except asyncio.CancelledError:
+                pass
+            self._worker = None
+        for chat in self._chats.values():
+            for item in chat.items:
+                item.resolve(error=RuntimeError("Очередь отправки остановлена"))
+        self._chats.clear()
+
+    # Размер очереди по приоритетам (для метрик)
+    def stats(self):
+        counts = {name: 0 for name in PRIORITY_NAMES.values()}
+        for chat in self._chats.values():
+            for item in chat.items:
+                counts[PRIORITY_NAMES.get(item.priority, 'bulk')] += 1
+        return counts
+
+    async def process_request(self, callback, args, kwargs, endpoint, data, rate_limit_args):
+        rate_limit_args = rate_limit_args or {}
+        chat_id = data.get('chat_id')
+        if chat_id is None or self._worker is None:
+            return await self._call(callback, args, kwargs, endpoint)
+
+        priority = rate_limit_args.get('priority', INTERACTIVE)
+        mergeable = (self.merge and rate_limit_args.get('merge', True) and endpoint == 'sendMessage'
+                     and isinstance(data.get('text'), str) and MERGE_KEYS.issuperset(data))
+        item = _Item(priority, next(self._seq), endpoint, data, callback, args, kwargs, mergeable)
+
+        chat = self._chats.get(chat_id)
+        if chat is None:
+            is_group = isinstance(chat_id, str) or chat_id < 0
+            chat = self._chats[chat_id] = _Chat(_Bucket(self.group_rate, self.group_period) if is_group else None)
+        heapq.heappush(chat.items, item)
+        self._schedule(chat_id, chat)
+        return await item.futures[0]
+
+    # Запрос без очереди (нет чата): только повтор при 429
+    async def _call(self, callback, args, kwargs, endpoint):
+        attempt = 0
+        while True:
+            delay = self._paused_until - time.monotonic()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            try:
+                return await callback(*args, **kwargs)
+            except RetryAfter as e:
+                attempt += 1
+                metrics.OUTBOX_RETRIES.inc(endpoint)
+                if attempt > self.max_retries:
+                    raise
+                logger.warning("⏳ %s: Telegram просит подождать %s с (попытка %s)", endpoint, e.retry_after, attempt)
+                await asyncio.sleep(_backoff(e.retry_after, attempt))
+
+    def _schedule(self, chat_id, chat):
+        if chat.busy or not chat.items:
+            return
+        now = time.monotonic()
+        ready_at = chat.blocked_until
+        if chat.bucket is not None:
+            ready_at = max(ready_at, now + chat.bucket.delay(now))
+        if ready_at <= now:
+            head = chat.items[0]
+            heapq.heappush(self._ready, (head.priority, head.seq, chat_id))
+        else:
+            heapq.heappush(self._waiting, (ready_at, chat_id))
+        if self._wakeup:
+            self._wakeup.set()
+
+    async def _run(self):
+        swept = time.monotonic()
+        while True:
+            now = time.monotonic()
+            while self._waiting and self._waiting[0][0] <= now:
+                _, chat_id = heapq.heappop(self._waiting)
+                chat = self._chats.get(chat_id)
+                if chat is not None:
+                    self._schedule(chat_id, chat)
+            if now - swept > SWEEP_INTERVAL:
+                self._sweep(now)
+                swept = now
+
+            if not self._ready:
+                await self._sleep(self._waiting[0][0] - now if self._waiting else SWEEP_INTERVAL)
+                continue
+
+            delay = self._paused_until - now
+            if self._overall is not None:
+                need = 1 if self._ready[0][0] == INTERACTIVE else self._bulk_need
+                delay = max(delay, self._overall.delay(now, need))
+            if delay > 0:
+                # Ждём токен, но просыпаемся и от новых запросов: ответ пользователю может обогнать рассылку
+                await self._sleep(delay)
+                continue
+
+            priority, seq, chat_id = heapq.heappop(self._ready)
+            chat = self._chats.get(chat_id)
+            # Устаревшая запись: чат уже отправляет или его голова очереди сменилась
+            if chat is None or chat.busy or not chat.items or (chat.items[0].priority, chat.items[0].seq) != (priority, seq):
+                continue
+
+            item = self._take(chat)
+            if self._overall is not None:
+                self._overall.take(now)
+            if chat.bucket is not None:
+                chat.bucket.take(now)
+            chat.busy = True
+            task = asyncio.create_task(self._send(chat_id, chat, item))
+            self._sending.add(task)
+            task.add_done_callback(self._sending.discard)
+
+    async def _sleep(self, timeout):
+        self._wakeup.clear()
+        try:
+            await asyncio.wait_for(self._wakeup.wait(), timeout)
+        except asyncio.TimeoutError:
+            pass
+
+    # Голова очереди чата вместе с идущими за ней простыми сообщениями того же приоритета
+    def _take(self, chat):
+        item = heapq.heappop(chat.items)
+        if not item.mergeable:
+            return item
+        extra = item.extra()
+        length = message_units(item.data['text'])
+        while chat.items:
+            following = chat.items[0]
+            if not following.mergeable or following.priority != item.priority or following.extra() != extra:
+                break
+            following_length = message_units(MERGE_SEPARATOR + following.data['text'])
+            if length + following_length > MESSAGE_LIMIT:
+                break
+            heapq.heappop(chat.items)
+            item.data['text'] += MERGE_SEPARATOR + following.data['text']
+            item.futures.extend(following.futures)
+            length += following_length
+            metrics.OUTBOX_MERGED.inc()
+        return item
+
+    async def _send(self, chat_id, chat, item):
+        try:
+            result = await item.callback(*item.args, **item.kwargs)
+        except RetryAfter as e:
+            item.attempt += 1
+            metrics.OUTBOX_RETRIES.inc(item.endpoint)
+            if item.attempt > self.max_retries:
+                item.resolve(error=e)
+            else:
+                # 429 может означать и общий флуд-лимит бота: на retry_after останавливаем всю очередь,
+                # а этот чат ждёт ещё и растущую паузу
+                now = time.monotonic()
+                self._paused_until = max(self._paused_until, now + e.retry_after)
+                chat.blocked_until = now + _backoff(e.retry_after, item.attempt)
+                heapq.heappush(chat.items, item)
+                logger.warning("⏳ Чат %s: Telegram просит подождать %s с (попытка %s)", chat_id, e.retry_after, item.attempt)
+        except Exception as e:
+            item.resolve(error=e)
+        else:
+            item.resolve(result)
+        finally:
+            chat.busy = False
+            self._schedule(chat_id, chat)
+
+    # Забыть чаты без очереди и с полным лимитом — их состояние такое же, как у нового чата
+    def _sweep(self, now):
+        for chat_id, chat in list(self._chats.items()):
+            if not chat.items and not chat.busy and chat.blocked_until <= now and (chat.bucket is None or chat.bucket.full(now)):
+                del self._chats[chat_id]
@@ -0,0 +1,171 @@
+import asyncio
+import json
+import logging
+
+from telegram.ext import BasePersistence, PersistenceInput
+
+logger = logging.getLogger(__name__)
+
+# Состояние диалогов (context.user_data / chat_data) в той же tasks.db, с отложенной пакетной записью.
+#
+# PTB раз в update_interval секунд передаёт сюда данные всех пользователей и чатов, у которых были апдейты.
+# Мы только складываем их в буфер (в памяти, без обращения к БД) и не позже чем через flush_delay
+# пишем весь буфер одной транзакцией в потоке репозитория. Неизменившиеся данные не пишутся вовсе.
+# Итого задержка сохранения ограничена update_interval + flush_delay; при остановке бота
+# PTB вызывает flush(), и буфер дописывается до конца.
+#
+# bot_data не сохраняем: там живёт планировщик и прочие объекты процесса.
+
+# Повтор записи после ошибки базы: пауза удваивается от FLUSH_RETRY_DELAY до FLUSH_RETRY_MAX_DELAY секунд
+FLUSH_RETRY_DELAY = 1
+FLUSH_RETRY_MAX_DELAY = 60
+
+def _load(conn, kind):
+    return conn.execute('SELECT key, data FROM persistence_data WHERE kind = ?', (kind,)).fetchall()
+
+# Одна транзакция на весь буфер: upserts — [(kind, key, json)], deletes — [(kind, key)]
+def _write_batch(conn, upserts, deletes):
+    with conn:
+        if deletes:
+            conn.executemany('DELETE FROM persistence_data WHERE kind = ? AND key = ?', deletes)
+        if upserts:
+            conn.executemany('''
+                INSERT INTO persistence_data (kind, key, data) VALUES (?, ?, ?)
+                ON CONFLICT(kind, key) DO UPDATE SET data = excluded.data
+            ''', upserts)
+
+
+class SQLitePersistence(BasePersistence):
+    def __init__(self, repo, update_interval=5, flush_delay=1.0):
+        super().__init__(
+            store_data=PersistenceInput(bot_data=False, callback_data=False),
+            update_interval=update_interval,
+        )
+        self.repo = repo
+        self.flush_delay = flush_delay
+        # (kind, key) -> JSON, который сейчас лежит в базе; по нему отсекаем пустые записи
+        self._saved = {}
+        # (kind, key) -> новый JSON или None (удалить)
+        self._dirty = {}
+        self._flush_task = None
+        self._flush_lock = asyncio.Lock()
+
+    # --- Чтение при старте: по одному запросу на вид данных ---
+
+    async def _get(self, kind):
+        data = {}
+        for key, raw in await self.repo.run(_load, kind):
+            self._saved[(kind, key)] = raw
+            data[int(key)] = json.loads(raw)
+        return data
+
+    async def get_user_data(self):
+        return await self._get('user')
+
+    async def get_chat_data(self):
+        return await self._get('chat')
+
+    async def get_bot_data(self):
+        return {}
+
+    async def get_callback_data(self):
+        return None
+
+    async def get_conversations(self, name):
+        kind = f'conversation:{name}'
+        conversations = {}
+        for key, raw in await self.repo.run(_load, kind):
+            self._saved[(kind, key)] = raw
+            conversations[tuple(json.loads(key))] = json.loads(raw)
+        return conversations
+
+    # --- Запись: только в буфер ---
+
+    def _stage(self, kind, key, data):
+        raw = None if data is None else json.dumps(data, ensure_ascii=False, sort_keys=True)
+        if self._saved.get((kind, key)) == raw and (kind, key) not in self._dirty:
+            return
+        self._dirty[(kind, key)] = raw
+        if self._flush_task is None or self._flush_task.done():
+            self._flush_task = asyncio.create_task(self._delayed_flush())
+
+    async def update_user_data(self, user_id, data):
+        self._stage('user', str(user_id), data)
+
+    async def update_chat_data(self, chat_id, data):
+        self._stage('chat', str(chat_id), data)
+
+    async def update_bot_data(self, data):
+        pass
+
+    async def update_callback_data(self, data):
+        pass
+
+    async def update_conversation(self, name, key, new_state):
+        self._stage(f'conversation:{name}', json.dumps(list(key)), new_state)
+
+    async def drop_user_data(self, user_id):
+        self._stage('user', str(user_id), None)
+
+    async def drop_chat_data(self, chat_id):
+        self._stage('chat', str(chat_id), None)
+
+    async def refresh_user_data(self, user_id, user_data):
+        pass
+
+    async def refresh_chat_data(self, chat_id, chat_data):
+        pass
+
+    async def refresh_bot_data(self, bot_data):
+        pass
+
+    # --- Сброс буфера в базу ---
+
+    # Пишем буфер, пока в нём что-то есть: пришедшее во время записи уйдёт следующим заходом.
+    # Ошибку базы не пробрасываем (задачу никто не ждёт) — повторяем с растущей паузой до FLUSH_RETRY_MAX_DELAY
+    async def _delayed_flush(self):
+        delay = self.flush_delay
+        while True:
+            await asyncio.sleep(delay)
+            try:
+                await self._write()
+            except Exception:
+                delay = min(max(delay, FLUSH_RETRY_DELAY) * 2, FLUSH_RETRY_MAX_DELAY)
+                continue
+            if not self._dirty:
+                return
+            delay = self.flush_delay
+
+    async def _write(self):
+        async with self._flush_lock:
+            if not self._dirty:
+                return
+            batch, self._dirty = self._dirty, {}
+            upserts = [(kind, key, raw) for (kind, key), raw in batch.items() if raw is not None]
+            deletes = [(kind, key) for (kind, key), raw in batch.items() if raw is None]
+            try:
+                await self.repo.run(_write_batch, upserts, deletes)
+            except BaseException as e:
+                # Не теряем данные: вернём их в буфер (более свежие записи имеют приоритет).
+                # При отмене запись могла и пройти — повтор безопасен, она идемпотентна
+                if not isinstance(e, asyncio.CancelledError):
+                    logger.exception("Не удалось сохранить состояние диалогов, повторим позже")
+                self._dirty = {**batch, **self._dirty}
+                raise
+            for item, raw in batch.items():
+                if raw is None:
+                    self._saved.pop(item, None)
+                else:
+                    self._saved[item] = raw
+            logger.debug("💾 Сохранено состояний: %s, удалено: %s", len(upserts), len(deletes))
+
+    # Вызывается PTB при остановке: дописываем всё, что осталось в буфере
+    async def flush(self):
+        if self._flush_task is not None:
+            self._flush_task.cancel()
+            try:
+                await self._flush_task
+            except asyncio.CancelledError:
+                pass
+            self._flush_task = None
+        await self._write()
@@ -0,0 +1,184 @@
+import asyncio
+import logging
+import re
+import time
+from datetime import datetime, timedelta
+
+import db
+import importer
+import reports
+
+logger = logging.getLogger(__name__)
+
+# Сроки задач и напоминания.
+#
+# Один таймер на весь бот: спит до ближайшего напоминания (первая запись частичного индекса
+# idx_tasks_remind), отправляет сработавшие пачками по db.REMINDER_BATCH и засыпает до следующего.
+# Таблица не опрашивается, задач планировщика на каждое напоминание нет: сколько бы напоминаний
+# ни было запланировано, это один таймер и одно чтение индекса на срабатывание.
+# Бот перезаводит таймер сам (rearm), когда меняет сроки; запись из веб-интерфейса (другой процесс)
+# замечается по версии данных (db.data_version) — её таймер сверяет раз в CHECK_INTERVAL секунд.
+# Напоминание снимается только после отправки: если бот упал посреди рассылки, после перезапуска оно придёт снова.
+# Если Telegram не принял сообщение (сеть, чат недоступен), напоминание откладывается на RETRY_DELAY секунд,
+# дальше пауза удваивается до RETRY_MAX_DELAY; после RETRY_ATTEMPTS неудач напоминание снимается
+
+CHECK_INTERVAL = 30
+
+RETRY_DELAY = 60
+RETRY_MAX_DELAY = 3600
+RETRY_ATTEMPTS = 8
+
+# Дата без времени — это DEFAULT_HOUR:00 этого дня (время сервера, как и все даты в интерфейсах)
+DEFAULT_HOUR = 9
+
+OFF_WORDS = {'off', 'выкл', 'нет', '-'}
+
+RELATIVE = re.compile(r'\+(\d{1,4})\s*(м|мин|m|min|ч|h|д|дн|d)\.?', re.IGNORECASE)
+RELATIVE_UNITS = {'м': 60, 'мин': 60, 'm': 60, 'min': 60, 'ч': 3600, 'h': 3600, 'д': 86400, 'дн': 86400, 'd': 86400}
+TIME_OF_DAY = re.compile(r'(\d{1,2}):(\d{2})')
+
+MOMENT_HELP = "ДД.ММ.ГГГГ [ЧЧ:ММ], ГГГГ-ММ-ДД [ЧЧ:ММ], ЧЧ:ММ или +30м / +2ч / +3д"
+
+# Момент из ввода пользователя -> unix epoch. "off"/"выкл"/пусто -> None (снять).
+# ValueError с понятным текстом, если не разобрали
+def parse_moment(text, now=None):
+    text = ' '.join(text.split())
+    if not text or text.lower() in OFF_WORDS:
+        return None
+    now = now or time.time()
+
+    match = RELATIVE.fullmatch(text)
+    if match:
+        return int(now) + int(match.group(1)) * RELATIVE_UNITS[match.group(2).lower()]
+
+    # Только время: сегодня, а если уже прошло — завтра
+    match = TIME_OF_DAY.fullmatch(text)
+    if match:
+        hours, minutes = int(match.group(1)), int(match.group(2))
+        if not (0 <= hours < 24 and 0 <= minutes < 60):
+            raise ValueError(f"непонятное время: {text}")
+        moment = datetime.fromtimestamp(now).replace(hour=hours, minute=minutes, second=0, microsecond=0)
+        if moment.timestamp() <= now:
+            moment += timedelta(days=1)
+        return int(moment.timestamp())
+
+    moment = importer.parse_timestamp(text)
+    date_only = importer.ISO_DATE.fullmatch(text) or importer.RU_DATE.fullmatch(text)
+    if date_only and date_only.group(4) is None:
+        moment += DEFAULT_HOUR * 3600
+    return moment
+
+def format_moment(ts):
+    return datetime.fromtimestamp(ts).strftime('%Y-%m-%d %H:%M') if ts is not None else None
+
+# Текст напоминаний одного чата: строки (id, описание, срок, напоминание, chat_id)
+def render_reminders(rows, now):
+    parts = ["🔔 НАПОМИНАНИЕ:"]
+    for task_id, description, due_at, _, _ in rows:
+        block = f"🔖 ID: {task_id}\n📝 {description}"
+        if due_at is not None:
+            overdue = " — просрочена!" if due_at < now else ""
+            block += f"\n⏰ Срок: {format_moment(due_at)}{overdue}"
+        parts.append(block)
+    return "\n\n".join(parts)
+
+
+class ReminderTimer:
+    def __init__(self, repo, bot, check_interval=CHECK_INTERVAL):
+        self.repo = repo
+        self.bot = bot
+        self.check_interval = check_interval
+        self.next_at = None
+        self._changed = None
+        self._task = None
+        # id задачи -> сколько раз подряд не удалось отправить её напоминание
+        self._failures = {}
+
+    def start(self):
+        self._changed = asyncio.Event()
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    # Сроки или напоминания изменились в этом процессе: перечитать ближайшее сразу, не дожидаясь проверки
+    def rearm(self):
+        if self._changed is not None:
+            self._changed.set()
+
+    async def _run(self):
+        version = None
+        while True:
+            try:
+                self._changed.clear()
+                current = await self.repo.data_version()
+                if current != version:
+                    version = current
+                    self.next_at = await self.repo.next_reminder()
+
+                now = time.time()
+                if self.next_at is not None and self.next_at <= now:
+                    await self.fire(int(now))
+                    version = None
+                    continue
+
+                timeout = self.check_interval if self.next_at is None else min(self.next_at - now, self.check_interval)
+                try:
+                    await asyncio.wait_for(self._changed.wait(), timeout)
+                except asyncio.TimeoutError:
+                    pass
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                logger.exception("Ошибка в таймере напоминаний")
+                await asyncio.sleep(self.check_interval)
+
+    # Отправить все напоминания, сработавшие к now
+    async def fire(self, now):
+        sent = failed = 0
+        while True:
+            rows = await self.repo.due_reminders(now)
+            if not rows:
+                break
+            by_chat = {}
+            for row in rows:
+                # Задачи без чата (заведены до появления владельцев) напомнить некуда — просто снимаем
+                if row[4] is not None:
+                    by_chat.setdefault(row[4], []).append(row)
+            delivered = await reports.deliver(self.bot, {
+                chat_id: reports.split_message(render_reminders(chat_rows, now)) for chat_id, chat_rows in by_chat.items()
+            })
+
+            done, retry = [], []
+            for row in rows:
+                if row[4] is None or row[4] in delivered:
+                    done.append((row[0], row[3]))
+                    self._failures.pop(row[0], None)
+                    sent += 1
+                    continue
+                attempt = self._failures.get(row[0], 0) + 1
+                if attempt > RETRY_ATTEMPTS:
+                    logger.warning("🔔 Напоминание по задаче %s так и не отправлено в чат %s — снимаем", row[0], row[4])
+                    done.append((row[0], row[3]))
+                    self._failures.pop(row[0], None)
+                    continue
+                self._failures[row[0]] = attempt
+                retry.append((row[0], row[3], now + min(RETRY_DELAY * 2 ** (attempt - 1), RETRY_MAX_DELAY)))
+
+            await self.repo.clear_reminders(done)
+            if retry:
+                # Отложенные уходят из выборки сработавших, следующая пачка их уже не увидит
+                await self.repo.postpone_reminders(retry)
+            failed += len(retry)
+            if len(rows) < db.REMINDER_BATCH:
+                break
+        if sent:
+            logger.info("🔔 Отправлено напоминаний: %s", sent)
+        if failed:
+            logger.warning("🔔 Не отправлено напоминаний (повторим позже): %s", failed)
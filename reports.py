@@ -0,0 +1,132 @@
+import asyncio
+import logging
+import os
+from datetime import datetime, timezone
+from zoneinfo import ZoneInfo
+
+import tzlocal
+from telegram.error import TelegramError
+
+import outbox
+from outbox import MESSAGE_LIMIT, message_units
+
+logger = logging.getLogger(__name__)
+
+# Сколько чатов получают отчёт одновременно. Темп отправки задаёт очередь (outbox.py),
+# здесь только с запасом, чтобы ей было что отправлять на полном лимите
+REPORT_CONCURRENCY = 64
+
+# Время отчёта по умолчанию — как раньше, 09:00 по часовому поясу сервера (или REPORT_TZ)
+DEFAULT_REPORT_MINUTE = 9 * 60
+DEFAULT_REPORT_TZ = os.environ.get('REPORT_TZ') or tzlocal.get_localzone_name()
+
+REPORT_TITLE = "📅 ЕЖЕДНЕВНЫЙ ОТЧЁТ — ОТКРЫТЫЕ ЗАДАЧИ:"
+EMPTY_REPORT = "📭 Нет открытых задач."
+
+# "ЧЧ:ММ" -> минута суток
+def parse_report_time(text):
+    hours, minutes = text.split(':')
+    hours, minutes = int(hours), int(minutes)
+    if not (0 <= hours < 24 and 0 <= minutes < 60):
+        raise ValueError(text)
+    return hours * 60 + minutes
+
+def format_report_time(minute_of_day):
+    return f"{minute_of_day // 60:02d}:{minute_of_day % 60:02d}"
+
+# Для каждого часового пояса подписчиков — текущая минута суток в нём
+def due_slots(timezones, now=None):
+    now = now or datetime.now(timezone.utc)
+    slots = []
+    for tz in timezones:
+        local = now.astimezone(ZoneInfo(tz))
+        slots.append((tz, local.hour * 60 + local.minute))
+    return slots
+
+def format_age(seconds):
+    seconds = max(seconds, 0)
+    days = seconds // 86400
+    if days > 0:
+        return f"{days} дн."
+    return f"{seconds // 3600} ч."
+
+# Текст отчёта по снимку открытых задач: строки (id, описание, возраст в секундах)
+def render_open_report(tasks):
+    if not tasks:
+        return EMPTY_REPORT
+
+    parts = [REPORT_TITLE]
+    parts.extend(f"ID: {task_id} | {description}\nВисит: {format_age(age)}" for task_id, description, age in tasks)
+    return "\n\n".join(parts)
+
+# Обрезать текст до limit единиц UTF-16 вместе с многоточием
+def truncate(text, limit):
+    if message_units(text) <= limit:
+        return text
+    if limit < 1:
+        return ''
+    units = 0
+    for i, char in enumerate(text):
+        units += 2 if ord(char) > 0xFFFF else 1
+        if units > limit - 1:
+            return text[:i] + "…"
+    return text
+
+# Самая длинная голова строки, которая влезает в limit; по возможности режем по переводу строки
+def _cut_point(text, limit):
+    units = 0
+    cut = len(text)
+    for i, char in enumerate(text):
+        units += 2 if ord(char) > 0xFFFF else 1
+        if units > limit:
+            cut = i
+            break
+    newline = text.rfind('\n', 0, cut)
+    return newline if newline > 0 else cut
+
+def _pieces(text, limit):
+    for paragraph in text.split('\n\n'):
+        while message_units(paragraph) > limit:
+            cut = _cut_point(paragraph, limit)
+            yield paragraph[:cut]
+            paragraph = paragraph[cut:].lstrip('\n')
+        yield paragraph
+
+# Разбить текст на сообщения не длиннее limit. Блоки (задачи) разделены пустой строкой
+# и по возможности не разрываются между сообщениями
+def split_message(text, limit=MESSAGE_LIMIT):
+    chunks = []
+    current = ''
+    for piece in _pieces(text, limit):
+        candidate = f'{current}\n\n{piece}' if current else piece
+        if message_units(candidate) <= limit:
+            current = candidate
+        else:
+            chunks.append(current)
+            current = piece
+    if current:
+        chunks.append(current)
+    return chunks
+
+# Отправить каждому чату его сообщения: messages — {chat_id: [части]}. Не больше concurrency
+# чатов одновременно, внутри чата части идут строго по порядку; ошибка одного чата не мешает остальным.
+# Возвращает множество чатов, которым ушли все части
+async def deliver(bot, messages, concurrency=REPORT_CONCURRENCY):
+    semaphore = asyncio.Semaphore(concurrency)
+    # В общей очереди отправки (outbox.py) отчёты пропускают вперёд ответы пользователям
+    rate_limit = {'rate_limit_args': {'priority': outbox.BULK}} if getattr(bot, 'rate_limiter', None) else {}
+
+    delivered = set()
+
+    async def send(chat_id, chunks):
+        async with semaphore:
+            try:
+                for chunk in chunks:
+                    await bot.send_message(chat_id=chat_id, text=chunk, **rate_limit)
+            except TelegramError as e:
+                logger.warning("Не удалось отправить отчёт в чат %s: %s", chat_id, e)
+            else:
+                delivered.add(chat_id)
+
+    await asyncio.gather(*(send(chat_id, chunks) for chat_id, chunks in messages.items()))
+    return delivered
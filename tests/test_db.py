@@ -0,0 +1,97 @@
+import sqlite3
+
+import pytest
+
+import db
+import migrations
+
+
+@pytest.fixture
+def conn(tmp_path):
+    path = str(tmp_path / 'tasks.db')
+    migrations.migrate(path)
+    conn = db.connect(path)
+    yield conn
+    conn.close()
+
+def _add(conn, descriptions, chat_id=1):
+    return [db.add_task(conn, description, chat_id) for description in descriptions]
+
+# Сбой на середине пачки: триггер не даёт изменить задачу task_id
+def _break_on(conn, event, task_id):
+    conn.execute(f'''
+        CREATE TEMP TRIGGER broken BEFORE {event} ON main.tasks WHEN old.id = {task_id}
+        BEGIN
+            SELECT RAISE(ABORT, 'сбой');
+        END
+    ''')
+
+def _snapshot(conn):
+    return conn.execute('SELECT id, description, is_closed, time_spent FROM tasks_all ORDER BY id').fetchall()
+
+
+@pytest.mark.parametrize('action', ['close', 'delete', 'edit'])
+def test_bulk_action_is_atomic(conn, action):
+    ids = _add(conn, ['первая', 'вторая', 'третья'])
+    before = _snapshot(conn)
+    seq = db.change_seq(conn)
+
+    _break_on(conn, 'DELETE' if action == 'delete' else 'UPDATE', ids[1])
+    with pytest.raises(sqlite3.DatabaseError):
+        if action == 'close':
+            db.bulk_close(conn, [(task_id, 1.0) for task_id in ids])
+        elif action == 'delete':
+            db.bulk_delete(conn, ids)
+        else:
+            db.bulk_edit(conn, [(task_id, 'новое') for task_id in ids])
+
+    assert _snapshot(conn) == before
+    assert db.change_seq(conn) == seq
+    assert db.check_stats(conn) == []
+
+def test_archive_keeps_search_and_stats(conn):
+    ids = _add(conn, ['старый отчёт', 'свежий отчёт', 'открытый отчёт'])
+    db.close_task(conn, ids[0], 5.0)
+    db.close_task(conn, ids[1], 1.0)
+    with conn:
+        conn.execute('UPDATE tasks SET closed_at = closed_at - 200 * 86400 WHERE id = ?', (ids[0],))
+    stats = db.read_stats(conn)
+
+    assert db.archive_closed(conn, 90) == 1
+    assert db.archive_counts(conn) == {'tasks': 2, 'tasks_archive': 1}
+    assert db.read_stats(conn) == stats
+    assert db.check_stats(conn) == []
+    assert sorted(row[0] for row in db.search_tasks(conn, 'отчёт')[0]) == ids
+    assert [row[0] for row in db.search_tasks(conn, 'отчёт', 'closed')[0]] == [ids[1], ids[0]]
+
+    # Переименование и удаление задачи из архива видны поиску
+    db.bulk_edit(conn, [(ids[0], 'переименованная')])
+    assert [row[0] for row in db.search_tasks(conn, 'переименованная')[0]] == [ids[0]]
+    assert db.bulk_delete(conn, [ids[0]]) == {ids[0]: 'deleted'}
+    assert db.search_tasks(conn, 'переименованная')[0] == []
+    assert db.check_stats(conn) == []
+    conn.execute("INSERT INTO tasks_fts (tasks_fts, rank) VALUES ('integrity-check', 1)")
+
+def test_changes_since(conn):
+    ids = _add(conn, ['закроется', 'удалится', 'останется'])
+    since = db.change_seq(conn)
+
+    db.close_task(conn, ids[0], 1.0)
+    db.bulk_delete(conn, [ids[1]])
+    new_id = db.add_task(conn, 'новая', 1)
+    _add(conn, ['чужая'], chat_id=2)
+
+    changes = db.changes_since(conn, since, 'open', chat_id=1)
+    assert changes['seq'] == db.change_seq(conn)
+    assert not changes['reset']
+    assert [row[0] for row in changes['tasks']] == [new_id]
+    assert sorted(changes['removed']) == sorted([ids[0], ids[1], new_id + 1])
+
+    assert db.changes_since(conn, changes['seq'])['tasks'] == []
+    assert db.changes_since(conn, since, limit=2)['reset']
+
+    # Журнал срезан дальше since — список нужно перечитать целиком
+    with conn:
+        conn.execute('DELETE FROM task_changes WHERE seq <= ?', (since + 1,))
+    assert db.changes_since(conn, since - 1)['reset']
+    assert not db.changes_since(conn, since + 1)['reset']
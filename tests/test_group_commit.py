@@ -0,0 +1,88 @@
+import sqlite3
+import threading
+from concurrent.futures import CancelledError
+
+import pytest
+
+import db
+import group_commit
+import migrations
+
+
+# Соединение, у которого не проходит COMMIT с номером fail_on (1, 2, ...)
+class FailingCommitConnection(sqlite3.Connection):
+    fail_on = None
+    commits = 0
+
+    def execute(self, sql, *args):
+        if sql == 'COMMIT':
+            FailingCommitConnection.commits += 1
+            if FailingCommitConnection.commits == FailingCommitConnection.fail_on:
+                raise sqlite3.OperationalError("disk I/O error")
+        return super().execute(sql, *args)
+
+
+@pytest.fixture
+def path(tmp_path):
+    path = str(tmp_path / 'tasks.db')
+    migrations.migrate(path)
+    return path
+
+
+def test_each_caller_gets_own_result(path):
+    writes = group_commit.GroupCommit(path)
+    try:
+        futures = [writes.submit(db.insert_task, f'задача {i}', 7) for i in range(50)]
+        ids = [future.result(timeout=5) for future in futures]
+        assert len(set(ids)) == 50
+        assert writes.call(db.mark_closed, ids[0], 1.5, 7) == ('closed', 'задача 0')
+        assert writes.call(db.mark_closed, ids[0], 1.5, 7) == ('already_closed', 'задача 0')
+    finally:
+        writes.close()
+
+
+def test_failed_commit_keeps_writer_alive(path, monkeypatch):
+    connect = db.connect
+    monkeypatch.setattr(db, 'connect', lambda *args, **kwargs: connect(*args, factory=FailingCommitConnection, **kwargs))
+    monkeypatch.setattr(FailingCommitConnection, 'fail_on', 2)
+    monkeypatch.setattr(FailingCommitConnection, 'commits', 0)
+
+    writes = group_commit.GroupCommit(path, max_delay=0)
+    gate = threading.Event()
+    started = threading.Event()
+
+    def hold(conn):
+        started.set()
+        gate.wait(5)
+
+    def broken(conn):
+        raise ValueError("ошибка операции")
+
+    try:
+        # Первая пачка держит поток записи, пока очередь второй не соберётся целиком
+        first = writes.submit(hold)
+        assert started.wait(5)
+        inserted = writes.submit(db.insert_task, 'не запишется', 7)
+        cancelled = writes.submit(db.insert_task, 'отменена', 7)
+        assert cancelled.cancel()
+        failed = writes.submit(broken)
+        gate.set()
+        first.result(timeout=5)
+
+        # Вторая пачка: отменённая операция уже завершена, COMMIT падает
+        with pytest.raises(sqlite3.OperationalError):
+            inserted.result(timeout=5)
+        with pytest.raises(CancelledError):
+            cancelled.result(timeout=5)
+        with pytest.raises(sqlite3.OperationalError):
+            failed.result(timeout=5)
+
+        # Поток записи жив: следующая операция записывается
+        task_id = writes.submit(db.insert_task, 'после сбоя', 7).result(timeout=5)
+    finally:
+        gate.set()
+        writes.close()
+
+    conn = connect(path)
+    assert conn.execute('SELECT description FROM tasks').fetchall() == [('после сбоя',)]
+    assert conn.execute('SELECT id FROM tasks').fetchone()[0] == task_id
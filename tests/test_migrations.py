@@ -0,0 +1,53 @@
+import sqlite3
+
+import db
+import migrations
+
+
+# База в том виде, как её создавала самая первая версия бота: без user_version, время строками
+def _legacy_db(path):
+    conn = sqlite3.connect(path)
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS tasks (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            description TEXT NOT NULL,
+            created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+            closed_at DATETIME,
+            time_spent REAL,
+            is_closed BOOLEAN DEFAULT 0
+        )
+    ''')
+    conn.execute("INSERT INTO tasks (description, created_at) VALUES ('открытая задача', '2024-03-01 10:00:00')")
+    conn.execute('''
+        INSERT INTO tasks (description, created_at, closed_at, time_spent, is_closed)
+        VALUES ('закрытый отчёт', '2024-03-01 10:00:00', '2024-03-02 12:30:00', 2.5, 1)
+    ''')
+    conn.execute("INSERT INTO tasks (description) VALUES ('удалённая')")
+    conn.execute("DELETE FROM tasks WHERE description = 'удалённая'")
+    conn.commit()
+    conn.close()
+
+
+def test_migrate_legacy_database(tmp_path):
+    path = str(tmp_path / 'tasks.db')
+    _legacy_db(path)
+
+    migrations.migrate(path)
+    migrations.migrate(path)
+
+    conn = db.connect(path)
+    assert conn.execute('PRAGMA user_version').fetchone()[0] == len(migrations.MIGRATIONS) == 12
+    rows = conn.execute('SELECT id, description, is_closed, time_spent, chat_id FROM tasks_all ORDER BY id').fetchall()
+    assert rows == [(1, 'открытая задача', 0, None, None), (2, 'закрытый отчёт', 1, 2.5, None)]
+    created_at, closed_at = conn.execute('SELECT created_at, closed_at FROM tasks WHERE id = 2').fetchone()
+    assert isinstance(created_at, int) and isinstance(closed_at, int) and closed_at > created_at
+
+    # Сводка и поисковый индекс собраны по уже существующим задачам
+    assert db.check_stats(conn) == []
+    assert db.read_stats(conn)['open'] == 1
+    assert [row[0] for row in db.search_tasks(conn, 'отчёт')[0]] == [2]
+    conn.execute("INSERT INTO tasks_fts (tasks_fts, rank) VALUES ('integrity-check', 1)")
+
+    # id удалённой задачи не выдаётся повторно
+    assert db.add_task(conn, 'новая', 7) == 4
+    assert db.unowned_count(conn) == 2
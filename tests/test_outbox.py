@@ -0,0 +1,18 @@
+import asyncio
+
+import outbox
+
+
+def test_initialize_twice_leaves_one_worker():
+    async def scenario():
+        queue = outbox.SendQueue()
+        await queue.initialize()
+        worker = queue._worker
+        await queue.initialize()
+        assert queue._worker is worker
+
+        await queue.shutdown()
+        assert worker.done()
+        return [task for task in asyncio.all_tasks() if task is not asyncio.current_task()]
+
+    assert asyncio.run(scenario()) == []
@@ -0,0 +1,36 @@
+import asyncio
+import sqlite3
+
+import persistence
+
+
+class FlakyRepo:
+    def __init__(self, failures):
+        self.failures = failures
+        self.writes = []
+
+    async def run(self, func, *args):
+        if self.failures:
+            self.failures -= 1
+            raise sqlite3.OperationalError("database is locked")
+        self.writes.append(args)
+
+
+def test_flush_retries_after_db_error(monkeypatch):
+    monkeypatch.setattr(persistence, 'FLUSH_RETRY_DELAY', 0.01)
+    monkeypatch.setattr(persistence, 'FLUSH_RETRY_MAX_DELAY', 0.02)
+
+    async def scenario():
+        repo = FlakyRepo(failures=2)
+        store = persistence.SQLitePersistence(repo, flush_delay=0.01)
+        await store.update_user_data(1, {'awaiting_task_description': True})
+        for _ in range(100):
+            if repo.writes:
+                break
+            await asyncio.sleep(0.01)
+        assert repo.writes == [([('user', '1', '{"awaiting_task_description": true}')], [])]
+        assert store._dirty == {}
+        await store.flush()
+        assert store._flush_task is None
+
+    asyncio.run(scenario())
@@ -0,0 +1,90 @@
+import asyncio
+
+from telegram.error import NetworkError
+
+import db
+import migrations
+import reminders
+
+
+class FakeBot:
+    def __init__(self, failing=()):
+        self.failing = set(failing)
+        self.sent = []
+
+    async def send_message(self, chat_id, text, **kwargs):
+        if chat_id in self.failing:
+            raise NetworkError("нет связи")
+        self.sent.append((chat_id, text))
+
+
+def _make_db(tmp_path):
+    path = str(tmp_path / 'tasks.db')
+    migrations.migrate(path)
+    return path
+
+def _add_reminder(conn, description, chat_id, remind_at):
+    with conn:
+        task_id = db.insert_task(conn, description, chat_id)
+    db.set_remind(conn, task_id, remind_at)
+    return task_id
+
+def _remind_at(conn, task_id):
+    return conn.execute('SELECT remind_at FROM tasks WHERE id = ?', (task_id,)).fetchone()[0]
+
+
+def test_failed_send_keeps_reminder_for_retry(tmp_path):
+    path = _make_db(tmp_path)
+    conn = db.connect(path)
+    now = 1_000_000
+    ok_id = _add_reminder(conn, 'дойдёт', 1, now - 10)
+    failing_id = _add_reminder(conn, 'не дойдёт', 2, now - 10)
+
+    async def scenario():
+        repo = db.TaskRepository(path)
+        bot = FakeBot(failing={2})
+        timer = reminders.ReminderTimer(repo, bot)
+        try:
+            await timer.fire(now)
+            assert [chat_id for chat_id, _ in bot.sent] == [1]
+            assert _remind_at(conn, ok_id) is None
+            assert _remind_at(conn, failing_id) == now + reminders.RETRY_DELAY
+
+            # Повтор раньше срока ничего не шлёт; после паузы, когда чат доступен, напоминание уходит и снимается
+            await timer.fire(now + 1)
+            assert len(bot.sent) == 1
+            bot.failing.clear()
+            await timer.fire(now + reminders.RETRY_DELAY)
+            assert [chat_id for chat_id, _ in bot.sent] == [1, 2]
+            assert _remind_at(conn, failing_id) is None
+            assert timer._failures == {}
+        finally:
+            await repo.close()
+
+    asyncio.run(scenario())
+
+
+def test_reminder_dropped_after_retry_limit(tmp_path, monkeypatch):
+    monkeypatch.setattr(reminders, 'RETRY_ATTEMPTS', 2)
+    path = _make_db(tmp_path)
+    conn = db.connect(path)
+    now = 1_000_000
+    task_id = _add_reminder(conn, 'чат недоступен', 2, now)
+
+    async def scenario():
+        repo = db.TaskRepository(path)
+        timer = reminders.ReminderTimer(repo, FakeBot(failing={2}))
+        try:
+            delays = []
+            moment = now
+            while _remind_at(conn, task_id) is not None:
+                await timer.fire(moment)
+                retry_at = _remind_at(conn, task_id)
+                if retry_at is not None:
+                    delays.append(retry_at - moment)
+                    moment = retry_at
+            assert delays == [reminders.RETRY_DELAY, reminders.RETRY_DELAY * 2]
+        finally:
+            await repo.close()
+
+    asyncio.run(scenario())
@@ -0,0 +1,18 @@
+import main
+import reports
+
+
+def _task(task_id, description):
+    return (task_id, description, 1_700_000_000, 1_700_000_000, 123.5, 1, 'Я' * 64, 1_700_000_000, None)
+
+
+def test_long_page_fits_one_message():
+    tasks = [_task(1_000_000 + i, '😀' * 150 + 'х' * 100) for i in range(10)]
+    text = main.render_task_list("👇 ВСЕ ЗАДАЧИ:\n\n", tasks)
+    assert reports.message_units(text) <= reports.MESSAGE_LIMIT
+    assert text.count('🔖 ID:') == 10
+
+
+def test_short_page_is_not_truncated():
+    text = main.render_task_list("👇 ВСЕ ЗАДАЧИ:\n\n", [_task(1, 'купить молоко')])
+    assert '📝 купить молоко\n' in text
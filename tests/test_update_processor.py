@@ -0,0 +1,67 @@
+import asyncio
+from datetime import datetime
+
+from telegram import Chat, Message, Update, User
+
+from update_processor import ChatOrderedUpdateProcessor
+
+
+def _update(update_id, chat_id):
+    chat = Chat(chat_id, 'private')
+    user = User(chat_id, 'Тест', False)
+    return Update(update_id, message=Message(update_id, datetime.now(), chat, from_user=user, text=str(update_id)))
+
+
+def test_busy_chat_does_not_block_other_chats():
+    limit = 2
+
+    async def scenario():
+        processor = ChatOrderedUpdateProcessor(limit)
+        release = asyncio.Event()
+        done = []
+
+        async def handle(update_id, chat_id, wait):
+            if wait:
+                await release.wait()
+            done.append((chat_id, update_id))
+
+        # Чат 1: limit + 1 апдейтов, первый висит, пока его не отпустят
+        tasks = [asyncio.create_task(processor.process_update(_update(i, 1), handle(i, 1, True))) for i in range(limit + 1)]
+        await asyncio.sleep(0)
+        others = [
+            asyncio.create_task(processor.process_update(_update(100 + chat_id, chat_id), handle(100 + chat_id, chat_id, False)))
+            for chat_id in (2, 3)
+        ]
+
+        await asyncio.wait_for(asyncio.gather(*others), 1)
+        assert done == [(2, 102), (3, 103)]
+        assert processor.stats()['active'] == 1
+        assert processor.stats()['waiting'] == limit
+
+        release.set()
+        await asyncio.wait_for(asyncio.gather(*tasks), 1)
+        assert [update_id for chat_id, update_id in done if chat_id == 1] == list(range(limit + 1))
+        assert processor.stats()['chats'] == 0
+
+    asyncio.run(scenario())
+
+
+def test_concurrency_is_bounded():
+    limit = 3
+
+    async def scenario():
+        processor = ChatOrderedUpdateProcessor(limit)
+        running = peak = 0
+
+        async def handle():
+            nonlocal running, peak
+            running += 1
+            peak = max(peak, running)
+            await asyncio.sleep(0.01)
+            running -= 1
+
+        await asyncio.gather(*(processor.process_update(_update(i, i), handle()) for i in range(20)))
+        assert peak == limit
+        assert processor.stats()['processed'] == 20
+
+    asyncio.run(scenario())
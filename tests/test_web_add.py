@@ -0,0 +1,75 @@
+import pytest
+
+import config
+import db
+import group_commit
+import importer
+import migrations
+import web
+
+
+@pytest.fixture
+def path(tmp_path):
+    path = str(tmp_path / 'tasks.db')
+    migrations.migrate(path)
+    return path
+
+@pytest.fixture
+def client(path, monkeypatch):
+    writes = group_commit.GroupCommit(path)
+    monkeypatch.setattr(web, 'DATABASE', path)
+    monkeypatch.setattr(web, 'writes', writes)
+    client = web.app.test_client()
+    with client.session_transaction() as session:
+        session['logged_in'] = True
+    yield client
+    writes.close()
+
+def _owners(path):
+    conn = db.connect(path)
+    try:
+        return [row[0] for row in conn.execute('SELECT chat_id FROM tasks ORDER BY id')]
+    finally:
+        conn.close()
+
+
+def test_add_uses_form_chat(client, path, monkeypatch):
+    monkeypatch.setattr(config, 'ADMIN_CHAT_ID', 99)
+    client.post('/add', data={'description': 'задача', 'chat': '5'})
+    assert _owners(path) == [5]
+
+def test_add_defaults_to_admin_chat(client, path, monkeypatch):
+    monkeypatch.setattr(config, 'ADMIN_CHAT_ID', 99)
+    client.post('/add', data={'description': 'задача', 'chat': ''})
+    assert _owners(path) == [99]
+
+def test_add_without_chat_is_rejected(client, path, monkeypatch):
+    monkeypatch.setattr(config, 'ADMIN_CHAT_ID', None)
+    response = client.post('/add', data={'description': 'задача', 'chat': ''})
+    assert response.status_code == 302
+    assert _owners(path) == []
+
+def test_import_rows_without_chat(path, tmp_path):
+    source = tmp_path / 'tasks.csv'
+    source.write_text('Описание,Чат\nсвоя,7\nбез чата,\n', encoding='utf-8')
+
+    result = importer.import_file(str(source), path, 'tasks.csv', report_name='no_chat')
+    assert result['imported'] == 1
+    assert result['rejected'] == 1
+
+    result = importer.import_file(str(source), path, 'tasks.csv', report_name='admin_chat', default_chat_id=99)
+    assert result['imported'] == 2
+    assert _owners(path) == [7, 7, 99]
+
+def test_metrics_require_login_or_token(monkeypatch):
+    monkeypatch.setattr(config, 'METRICS_TOKEN', 'secret-123')
+    client = web.app.test_client()
+    assert client.get('/metrics').status_code == 401
+    assert client.get('/metrics', headers={'Authorization': 'Bearer чужой'}).status_code == 401
+    assert client.get('/metrics', headers={'Authorization': 'Bearer secret-123'}).status_code == 200
+
+    monkeypatch.setattr(config, 'METRICS_TOKEN', None)
+    assert client.get('/metrics', headers={'Authorization': 'Bearer '}).status_code == 401
+    with client.session_transaction() as session:
+        session['logged_in'] = True
+    assert client.get('/metrics').status_code == 200
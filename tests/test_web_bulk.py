@@ -0,0 +1,86 @@
+import pytest
+
+import db
+import group_commit
+import migrations
+import web
+
+
+@pytest.fixture
+def path(tmp_path):
+    path = str(tmp_path / 'tasks.db')
+    migrations.migrate(path)
+    return path
+
+@pytest.fixture
+def client(path, monkeypatch):
+    writes = group_commit.GroupCommit(path)
+    monkeypatch.setattr(web, 'DATABASE', path)
+    monkeypatch.setattr(web, 'writes', writes)
+    client = web.app.test_client()
+    with client.session_transaction() as session:
+        session['logged_in'] = True
+    yield client
+    writes.close()
+
+def _add(path, count, chat_id=1):
+    conn = db.connect(path)
+    try:
+        return [db.add_task(conn, f'задача {i}', chat_id) for i in range(count)]
+    finally:
+        conn.close()
+
+def _count(path):
+    conn = db.connect(path)
+    try:
+        return conn.execute('SELECT COUNT(*) FROM tasks_all').fetchone()[0]
+    finally:
+        conn.close()
+
+
+@pytest.mark.parametrize('body', [
+    {'action': 'delete', 'ids': '12'},
+    {'action': 'delete', 'ids': {'1': 1}},
+    {'action': 'delete', 'ids': ['1', '2']},
+    {'action': 'delete', 'ids': [True]},
+    {'action': 'delete'},
+    {'action': 'close', 'ids': '12', 'time_spent': 1},
+    {'action': 'close', 'items': {'id': 1, 'time_spent': 1}},
+    {'action': 'edit', 'items': 'описание'},
+    ['delete', 1],
+])
+def test_bulk_rejects_non_list_ids(client, path, body):
+    _add(path, 3)
+    response = client.post('/api/bulk', json=body)
+    assert response.status_code == 400
+    assert _count(path) == 3
+
+@pytest.mark.parametrize('hours', ['nan', 'inf', '-inf', -1, 'два'])
+def test_bulk_close_rejects_bad_hours(client, path, hours):
+    ids = _add(path, 2)
+    assert client.post('/api/bulk', json={'action': 'close', 'ids': ids, 'time_spent': hours}).status_code == 400
+    assert client.post('/api/bulk', json={'action': 'close', 'items': [{'id': ids[0], 'time_spent': hours}]}).status_code == 400
+    assert client.post(f'/close/{ids[0]}', data={'time_spent': str(hours)}).status_code == 400
+    conn = db.connect(path)
+    assert conn.execute('SELECT COUNT(*) FROM tasks WHERE is_closed = 1').fetchone()[0] == 0
+
+def test_bulk_actions(client, path):
+    ids = _add(path, 3)
+    foreign = _add(path, 1, chat_id=2)[0]
+
+    response = client.post('/api/bulk', json={'action': 'close', 'ids': ids[:2] + [foreign], 'time_spent': 1.5, 'chat': 1})
+    assert response.status_code == 200
+    assert response.json['results'] == {str(ids[0]): 'closed', str(ids[1]): 'closed', str(foreign): 'not_found'}
+
+    response = client.post('/api/bulk', json={'action': 'close', 'items': [{'id': ids[0], 'time_spent': 2}, {'id': ids[2], 'time_spent': 2}]})
+    assert response.json['summary'] == {'already_closed': 1, 'closed': 1}
+
+    response = client.post('/api/bulk', json={'action': 'edit', 'items': [{'id': ids[1], 'description': ' новое '}]})
+    assert response.json['results'] == {str(ids[1]): 'updated'}
+
+    response = client.post('/api/bulk', json={'action': 'delete', 'ids': [ids[0], 10 ** 9]})
+    assert response.json['results'] == {str(ids[0]): 'deleted', str(10 ** 9): 'not_found'}
+
+    conn = db.connect(path)
+    assert conn.execute('SELECT description, time_spent FROM tasks WHERE id = ?', (ids[1],)).fetchone() == ('новое', 1.5)
+    assert _count(path) == 3
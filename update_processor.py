@@ -0,0 +1,108 @@
+import asyncio
+
+from telegram import Update
+from telegram.ext import BaseUpdateProcessor
+
+# Параллельная обработка апдейтов с сохранением порядка внутри чата.
+#
+# Апдейты разных чатов обрабатываются одновременно (не больше max_concurrent_updates),
+# а апдейты одного чата — строго по очереди, в порядке поступления: на этом держатся
+# флаги awaiting_* в context.user_data. Пока апдейт ждёт своей очереди в чате,
+# он не занимает слот обработчика, так что один "шумный" чат не тормозит остальных.
+#
+# process_update базового класса (final в PTB) не переопределяем: его семафор получает
+# заведомо большой лимит (UNBOUNDED) и ничего не ограничивает, а порядок и настоящий лимит
+# живут в do_process_update: сначала замок чата, потом слот обработчика (self._workers)
+UNBOUNDED = 2 ** 31 - 1
+
+class ChatOrderedUpdateProcessor(BaseUpdateProcessor):
+    def __init__(self, max_concurrent_updates):
+        if max_concurrent_updates < 1:
+            raise ValueError("`max_concurrent_updates` must be a positive integer!")
+        super().__init__(UNBOUNDED)
+        self.concurrency = max_concurrent_updates
+        self._workers = asyncio.Semaphore(max_concurrent_updates)
+        # ключ чата -> [замок очереди чата, сколько апдейтов чата сейчас в обработке или в очереди]
+        self._chats = {}
+        self.waiting = 0
+        self.queued = 0
+        self.active = 0
+        self.max_waiting = 0
+        self.max_queued = 0
+        self.processed = 0
+
+    # Порядок нужен внутри чата; у inline-запросов чата нет — тогда внутри пользователя
+    @staticmethod
+    def ordering_key(update):
+        if not isinstance(update, Update):
+            return None
+        if update.effective_chat:
+            return update.effective_chat.id
+        if update.effective_user:
+            return ('user', update.effective_user.id)
+        return None
+
+    # Вызывается базовым классом. Между созданием задачи в Application и захватом замка чата нет await
+    # (семафор базового класса с лимитом UNBOUNDED не ждёт), поэтому в очередь замка апдейты встают
+    # в порядке поступления (asyncio.Lock — FIFO)
+    async def do_process_update(self, update, coroutine):
+        key = self.ordering_key(update)
+        if key is None:
+            await self._run(coroutine)
+            return
+
+        slot = self._chats.get(key)
+        if slot is None:
+            slot = self._chats[key] = [asyncio.Lock(), 0]
+        slot[1] += 1
+        try:
+            self.waiting += 1
+            self.max_waiting = max(self.max_waiting, self.waiting)
+            try:
+                await slot[0].acquire()
+            finally:
+                self.waiting -= 1
+            try:
+                await self._run(coroutine)
+            finally:
+                slot[0].release()
+        finally:
+            slot[1] -= 1
+            if slot[1] == 0:
+                del self._chats[key]
+
+    # Слот обработчика берётся только когда подошла очередь апдейта в его чате
+    async def _run(self, coroutine):
+        self.queued += 1
+        self.max_queued = max(self.max_queued, self.queued)
+        try:
+            await self._workers.acquire()
+        finally:
+            self.queued -= 1
+        self.active += 1
+        try:
+            await coroutine
+        finally:
+            self.active -= 1
+            self.processed += 1
+            self._workers.release()
+
+    async def initialize(self):
+        pass
+
+    async def shutdown(self):
+        pass
+
+    # Метрики очереди: waiting — апдейты, ждущие своей очереди в чате, queued — дождавшиеся и ждущие
+    # свободного обработчика, active — обрабатываются сейчас, chats — чаты с незавершёнными апдейтами
+    def stats(self):
+        return {
+            'waiting': self.waiting,
+            'queued': self.queued,
+            'active': self.active,
+            'chats': len(self._chats),
+            'max_waiting': self.max_waiting,
+            'max_queued': self.max_queued,
+            'processed': self.processed,
+            'max_concurrent_updates': self.concurrency,
+        }
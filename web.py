@@ -1,22 +1,60 @@
 from flask import Flask, render_template, request, redirect, url_for, jsonify, flash, session
+from flask import Response, send_file, stream_with_context
 import sqlite3
-from datetime import datetime
+from datetime import datetime, timedelta
+import hmac
 import os
 
+import analytics
+import config
+import db
+import exports
+import group_commit
+import http_cache
+import importer
+import metrics
+import migrations
+import reminders
+from jobs import JobManager
+
 app = Flask(__name__)
+app.jinja_env.filters['datetime'] = db.format_ts
+app.jinja_env.filters['moment'] = reminders.format_moment
 app.secret_key = 'super_secret_key_2025'  # 🔐 Обязательно для сессий
+if metrics.ENABLED:
+    metrics.instrument_flask(app)
 
 # 🔐 Настройка логина и пароля (измени на свои!)
 ADMIN_USERNAME = "admin"
 ADMIN_PASSWORD = "password123"
 
-DATABASE = 'tasks.db'
+DATABASE = db.DATABASE
+
+# Сколько задач отдаётся за раз: первая страница в HTML и каждая догрузка через API
+PAGE_SIZE = 50
+MAX_PAGE_SIZE = 200
 
 def get_db_connection():
-    conn = sqlite3.connect(DATABASE)
+    conn = db.connect(DATABASE)
     conn.row_factory = sqlite3.Row
     return conn
 
+# Добавление и закрытие задач из всех потоков веб-сервера коммитятся пачками (см. group_commit.py)
+writes = group_commit.GroupCommit(DATABASE)
+
+# Кэш ответов и условные GET для тяжёлых представлений (см. http_cache.py)
+response_cache = http_cache.ResponseCache()
+
+def current_data_version():
+    conn = db.connect(DATABASE)
+    try:
+        return db.data_version(conn)
+    finally:
+        conn.close()
+
+def cached_view(store=True):
+    return http_cache.conditional(response_cache, current_data_version, store=store)
+
 # 🔐 Проверка аутентификации
 def login_required(f):
     def wrap(*args, **kwargs):
@@ -49,22 +87,122 @@ def logout():
     flash('🚪 Вы вышли из системы.', 'info')
     return redirect(url_for('login'))
 
+# Чат из параметра ?chat= (или поля формы): задачи только этого чата. Нет или не число — все чаты
+def _chat_arg(values=None):
+    return (values if values is not None else request.args).get('chat', type=int)
+
+# Чат-владелец новой задачи из формы: поле chat, а если оно пустое — чат администратора.
+# Задач без владельца из веба не создаём: их не видно ни в одном чате бота
+def _owner_chat(values):
+    chat = _chat_arg(values)
+    return chat if chat is not None else config.ADMIN_CHAT_ID
+
 # 🏠 Главная страница — список задач (только для авторизованных)
 @app.route('/')
 @login_required
+@cached_view()
 def index():
     filter_status = request.args.get('filter', 'all')
+    if filter_status not in db.FILTER_CONDITIONS:
+        filter_status = 'all'
 
+    chat = _chat_arg()
+
+    # Сервер рендерит только первую страницу, остальное догружается через /api/tasks при прокрутке
     conn = get_db_connection()
-    if filter_status == 'open':
-        tasks = conn.execute('SELECT * FROM tasks WHERE is_closed = 0 ORDER BY id DESC').fetchall()
-    elif filter_status == 'closed':
-        tasks = conn.execute('SELECT * FROM tasks WHERE is_closed = 1 ORDER BY id DESC').fetchall()
-    else:
-        tasks = conn.execute('SELECT * FROM tasks ORDER BY id DESC').fetchall()
+    tasks, next_cursor = db.query_tasks(conn, filter_status, limit=PAGE_SIZE, chat_id=chat)
+    chats = db.task_chats(conn)
+    change_seq = db.change_seq(conn)
     conn.close()
 
-    return render_template('index.html', tasks=tasks, filter=filter_status)
+    return render_template('index.html', tasks=tasks, filter=filter_status, next_cursor=next_cursor, chat=chat, chats=chats,
+                           change_seq=change_seq, admin_chat=config.ADMIN_CHAT_ID)
+
+# 📄 API списка задач: keyset-пагинация, фильтры по статусу, чату и дате создания, выбор полей
+@app.route('/api/tasks')
+@login_required
+def api_tasks():
+    status = request.args.get('status', 'all')
+    if status not in db.FILTER_CONDITIONS:
+        return jsonify({'error': 'status: open, closed или all'}), 400
+
+    try:
+        cursor = request.args.get('cursor', type=int)
+        limit = min(request.args.get('limit', PAGE_SIZE, type=int), MAX_PAGE_SIZE)
+        created_from = _parse_date(request.args.get('from'))
+        created_to = _parse_date(request.args.get('to'), next_day=True)
+    except ValueError:
+        return jsonify({'error': 'Даты должны быть в формате ГГГГ-ММ-ДД'}), 400
+    if limit < 1:
+        return jsonify({'error': 'limit должен быть больше нуля'}), 400
+
+    fields = db.API_FIELDS
+    if request.args.get('fields'):
+        fields = tuple(f.strip() for f in request.args['fields'].split(','))
+        unknown = [f for f in fields if f not in db.API_FIELDS]
+        if unknown:
+            return jsonify({'error': f'Неизвестные поля: {", ".join(unknown)}'}), 400
+
+    conn = get_db_connection()
+    tasks, next_cursor = db.query_tasks(conn, status, cursor, limit, created_from, created_to, fields, _chat_arg())
+    conn.close()
+
+    return jsonify({
+        'tasks': [dict(row) for row in tasks],
+        'next_cursor': next_cursor
+    })
+
+# 🔄 Изменения после since (номер из журнала task_changes): страница держит список актуальным,
+# забирая только изменённые задачи — и сделанные в вебе, и пришедшие из бота
+@app.route('/api/changes')
+@login_required
+def api_changes():
+    status = request.args.get('status', 'all')
+    if status not in db.FILTER_CONDITIONS:
+        return jsonify({'error': 'status: open, closed или all'}), 400
+    since = request.args.get('since', type=int)
+    if since is None:
+        return jsonify({'error': 'since: номер последнего известного изменения'}), 400
+
+    conn = get_db_connection()
+    changes = db.changes_since(conn, since, status, _chat_arg())
+    conn.close()
+
+    changes['tasks'] = [dict(row) for row in changes['tasks']]
+    return jsonify(changes)
+
+# 🔍 Поиск по описаниям: лучшие совпадения первыми, страницы по смещению
+@app.route('/api/search')
+@login_required
+def api_search():
+    text = request.args.get('q', '').strip()
+    status = request.args.get('status', 'all')
+    if status not in db.FILTER_CONDITIONS:
+        return jsonify({'error': 'status: open, closed или all'}), 400
+
+    offset = max(request.args.get('offset', 0, type=int), 0)
+    limit = min(request.args.get('limit', PAGE_SIZE, type=int), MAX_PAGE_SIZE)
+    if limit < 1:
+        return jsonify({'error': 'limit должен быть больше нуля'}), 400
+
+    conn = get_db_connection()
+    tasks, has_more = db.search_tasks(conn, text, status, offset, limit, _chat_arg())
+    conn.close()
+
+    return jsonify({
+        'tasks': [dict(row) for row in tasks],
+        'next_offset': offset + limit if has_more else None
+    })
+
+# Дата 'ГГГГ-ММ-ДД' (локальное время) -> unix epoch начала дня; next_day — начало следующего дня,
+# чтобы граница "по" включала весь день
+def _parse_date(value, next_day=False):
+    if not value:
+        return None
+    day = datetime.strptime(value, '%Y-%m-%d')
+    if next_day:
+        day += timedelta(days=1)
+    return int(day.timestamp())
 
 # ➕ Добавление задачи
 @app.route('/add', methods=['POST'])
@@ -75,13 +213,14 @@ def add_task():
         flash('Описание не может быть пустым!', 'danger')
         return redirect(url_for('index'))
 
-    conn = get_db_connection()
-    conn.execute('INSERT INTO tasks (description) VALUES (?)', (description,))
-    conn.commit()
-    conn.close()
+    chat = _owner_chat(request.form)
+    if chat is None:
+        flash('Укажите чат задачи: ADMIN_CHAT_ID не задан, задача без чата не видна в боте', 'danger')
+        return redirect(url_for('index'))
+    writes.call(db.insert_task, description, chat)
 
     flash('✅ Задача добавлена!', 'success')
-    return redirect(url_for('index'))
+    return redirect(url_for('index', chat=chat))
 
 # ✏️ Редактирование задачи
 @app.route('/edit/<int:task_id>', methods=['POST'])
@@ -92,30 +231,64 @@ def edit_task(task_id):
         return jsonify({'error': 'Описание не может быть пустым'}), 400
 
     conn = get_db_connection()
-    conn.execute('UPDATE tasks SET description = ? WHERE id = ?', (description, task_id))
-    conn.commit()
+    db.edit_task(conn, task_id, description)
     conn.close()
 
     return jsonify({'success': True})
 
+# Часы из запроса: конечное неотрицательное число, иначе ValueError
+def _hours(value):
+    hours = importer.parse_hours(value)
+    if hours is None:
+        raise ValueError("не указано время")
+    return hours
+
+# id задачи из JSON: только целое число (строки и true/false не принимаем)
+def _task_id(value):
+    if isinstance(value, bool) or not isinstance(value, int):
+        raise TypeError("id должен быть целым числом")
+    return value
+
+# Список из JSON: строка или объект вместо списка — ошибка формата, а не перебор символов/ключей
+def _json_list(value):
+    if not isinstance(value, list):
+        raise TypeError("нужен список")
+    return value
+
 # ✅ Закрытие задачи
 @app.route('/close/<int:task_id>', methods=['POST'])
 @login_required
 def close_task(task_id):
     try:
-        time_spent = float(request.form['time_spent'])
+        time_spent = _hours(request.form.get('time_spent'))
     except ValueError:
-        return jsonify({'error': 'Время должно быть числом'}), 400
+        return jsonify({'error': 'Время должно быть неотрицательным числом'}), 400
+
+    writes.call(db.mark_closed, task_id, time_spent)
+
+    return jsonify({'success': True})
+
+# ⏰ Срок и напоминание. Поля формы due и remind необязательны: переданное поле меняется,
+# пустое значение снимает срок/напоминание. Форматы — как в боте (reminders.MOMENT_HELP).
+# Бот замечает изменение по версии данных и перезаводит таймер напоминаний
+@app.route('/deadline/<int:task_id>', methods=['POST'])
+@login_required
+def set_deadline(task_id):
+    try:
+        due_at = reminders.parse_moment(request.form['due']) if 'due' in request.form else None
+        remind_at = reminders.parse_moment(request.form['remind']) if 'remind' in request.form else None
+    except ValueError as e:
+        return jsonify({'error': f'{e}. Форматы: {reminders.MOMENT_HELP}'}), 400
 
-    now = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
     conn = get_db_connection()
-    conn.execute('''
-        UPDATE tasks
-        SET closed_at = ?, time_spent = ?, is_closed = 1
-        WHERE id = ?
-    ''', (now, time_spent, task_id))
-    conn.commit()
+    found = True
+    if 'due' in request.form:
+        found = db.set_due(conn, task_id, due_at)
+    if 'remind' in request.form and found:
+        found = db.set_remind(conn, task_id, remind_at)
     conn.close()
+    if not found:
+        return jsonify({'error': 'Задача не найдена'}), 404
 
     return jsonify({'success': True})
 
@@ -124,84 +297,236 @@ def close_task(task_id):
 @login_required
 def delete_task(task_id):
     conn = get_db_connection()
-    conn.execute('DELETE FROM tasks WHERE id = ?', (task_id,))
-    conn.commit()
+    db.delete_task(conn, task_id)
     conn.close()
 
     return jsonify({'success': True})
 
-# 📊 API для статистики
-@app.route('/api/stats')
-@login_required
-def stats():
-    conn = get_db_connection()
-    total = conn.execute('SELECT COUNT(*) FROM tasks').fetchone()[0]
-    open_count = conn.execute('SELECT COUNT(*) FROM tasks WHERE is_closed = 0').fetchone()[0]
-    closed_count = conn.execute('SELECT COUNT(*) FROM tasks WHERE is_closed = 1').fetchone()[0]
+# 📦 Массовые операции: один запрос — одна транзакция. Тело JSON:
+#   {"action": "close", "ids": [1, 2], "time_spent": 1.5}  или  "items": [{"id": 1, "time_spent": 2}, ...]
+#   {"action": "delete", "ids": [1, 2, 3]}
+#   {"action": "edit", "items": [{"id": 1, "description": "..."}, ...]}
+# Необязательное "chat": 123 ограничивает пакет задачами этого чата (чужие id — not_found).
+# Ответ: результат по каждому id и сводка по статусам
+MAX_BULK_ITEMS = 10000
 
-    avg_time_row = conn.execute('SELECT AVG(time_spent) FROM tasks WHERE is_closed = 1').fetchone()
-    avg_time = round(avg_time_row[0], 2) if avg_time_row[0] else 0
+@app.route('/api/bulk', methods=['POST'])
+@login_required
+def api_bulk():
+    data = request.get_json(silent=True)
+    action = data.get('action') if isinstance(data, dict) else None
+    if action not in ('close', 'delete', 'edit'):
+        return jsonify({'error': 'action: close, delete или edit'}), 400
 
-    top_long_tasks = conn.execute('''
-        SELECT description, time_spent
-        FROM tasks
-        WHERE is_closed = 1 AND time_spent IS NOT NULL
-        ORDER BY time_spent DESC
-        LIMIT 5
-    ''').fetchall()
+    try:
+        if action == 'delete':
+            payload = [_task_id(task_id) for task_id in _json_list(data['ids'])]
+        elif action == 'close' and 'items' not in data:
+            time_spent = _hours(data['time_spent'])
+            payload = [(_task_id(task_id), time_spent) for task_id in _json_list(data['ids'])]
+        elif action == 'close':
+            payload = [(_task_id(item['id']), _hours(item['time_spent'])) for item in _json_list(data['items'])]
+        else:
+            payload = [(_task_id(item['id']), str(item['description']).strip()) for item in _json_list(data['items'])]
+        chat = int(data['chat']) if data.get('chat') is not None else None
+    except (KeyError, TypeError, ValueError):
+        return jsonify({'error': 'Неверный формат: нужен список целых id и неотрицательное время (см. описание /api/bulk)'}), 400
+
+    if not payload:
+        return jsonify({'error': 'Пустой пакет'}), 400
+    if len(payload) > MAX_BULK_ITEMS:
+        return jsonify({'error': f'Не больше {MAX_BULK_ITEMS} задач за раз'}), 400
+    if action == 'edit' and not all(description for _, description in payload):
+        return jsonify({'error': 'Описание не может быть пустым'}), 400
 
+    conn = get_db_connection()
+    if action == 'close':
+        results = db.bulk_close(conn, payload, chat)
+    elif action == 'delete':
+        results = db.bulk_delete(conn, payload, chat)
+    else:
+        results = db.bulk_edit(conn, payload, chat)
     conn.close()
 
+    summary = {}
+    for status in results.values():
+        summary[status] = summary.get(status, 0) + 1
     return jsonify({
-        'total': total,
-        'open': open_count,
-        'closed': closed_count,
-        'avg_time': avg_time,
-        'top_long_tasks': [dict(row) for row in top_long_tasks]
+        'results': {str(task_id): status for task_id, status in results.items()},
+        'summary': summary
     })
 
-# 📥 Экспорт в Excel
-import pandas as pd
-from io import BytesIO
-from flask import send_file
+# 📊 API для статистики
+@app.route('/api/stats')
+@login_required
+@cached_view()
+def stats():
+    # Цифры ведут триггеры (см. миграцию stats_summary) — здесь только чтение одной строки и топа.
+    # Для одного чата (?chat=) считаем по его строкам через индекс по chat_id
+    conn = get_db_connection()
+    data = db.read_stats(conn, _chat_arg())
+    conn.close()
+
+    return jsonify(data)
 
+# 📈 Аналитика по времени: перцентили времени выполнения, закрытия по дням (?days=, по умолчанию 30),
+# распределение трудозатрат и возраст открытых задач. Считается один раз на версию данных (см. analytics.py)
+@app.route('/api/analytics')
+@login_required
+def api_analytics():
+    days = request.args.get('days', analytics.DEFAULT_DAYS, type=int)
+    if not 1 <= days <= analytics.MAX_DAYS:
+        return jsonify({'error': f'days: от 1 до {analytics.MAX_DAYS}'}), 400
+    return jsonify(analytics.get(DATABASE, _chat_arg(), days))
+
+# 📈 Метрики процесса для Prometheus: после входа или по токену config.METRICS_TOKEN —
+# сборщик метрик не умеет входить и присылает заголовок Authorization: Bearer <токен>
+@app.route('/metrics')
+def metrics_endpoint():
+    token = config.METRICS_TOKEN
+    authorization = request.headers.get('Authorization', '').encode()
+    if 'logged_in' not in session and not (token and hmac.compare_digest(authorization, f'Bearer {token}'.encode())):
+        return Response('Требуется вход или токен метрик\n', status=401, content_type='text/plain; charset=utf-8')
+    return Response(metrics.render(), content_type=metrics.CONTENT_TYPE)
+
+# 📥 Экспорт
+XLSX_MIMETYPE = 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'
+
+# Таблицы до этого размера выгружаются в xlsx прямо в запросе, больше — только фоновой задачей
+EXPORT_SYNC_ROWS = 50000
+
+export_jobs = JobManager(max_workers=1)
+
+# GET /export — xlsx из кэша (или собранный сразу, если таблица небольшая);
+# /export?format=csv|ndjson — потоковая выгрузка кусками, без сборки файла в памяти
 @app.route('/export')
 @login_required
+@cached_view(store=False)
 def export_excel():
+    export_format = request.args.get('format', 'xlsx')
+    if export_format == 'csv':
+        return Response(
+            stream_with_context(exports.stream_csv(DATABASE)),
+            mimetype='text/csv; charset=utf-8',
+            headers={'Content-Disposition': 'attachment; filename=tasks_export.csv'}
+        )
+    if export_format == 'ndjson':
+        return Response(
+            stream_with_context(exports.stream_ndjson(DATABASE)),
+            mimetype='application/x-ndjson; charset=utf-8',
+            headers={'Content-Disposition': 'attachment; filename=tasks_export.ndjson'}
+        )
+
     conn = get_db_connection()
-    tasks = conn.execute('''
-        SELECT
-            id,
-            description,
-            created_at,
-            closed_at,
-            time_spent,
-            CASE WHEN is_closed = 1 THEN 'Закрыта' ELSE 'Открыта' END as status
-        FROM tasks
-        ORDER BY id DESC
-    ''').fetchall()
+    path = exports.cached_xlsx(conn)
+    too_big = path is None and exports.count_rows(conn) > EXPORT_SYNC_ROWS
     conn.close()
 
-    # Преобразуем в DataFrame
-    df = pd.DataFrame(tasks, columns=['ID', 'Описание', 'Создана', 'Закрыта', 'Потрачено часов', 'Статус'])
+    if too_big:
+        export_jobs.submit('export', exports.xlsx_job, DATABASE, key='xlsx')
+        flash('⏳ Таблица большая — выгрузка готовится в фоне, нажмите «Экспорт в Excel» ещё раз чуть позже.', 'info')
+        return redirect(url_for('index'))
+
+    if path is None:
+        path = exports.build_xlsx(DATABASE)
+    return _send_xlsx(path)
+
+# Запустить фоновую выгрузку xlsx (если для текущих данных файл уже есть — задача завершится сразу)
+@app.route('/api/export', methods=['POST'])
+@login_required
+def start_export():
+    job = export_jobs.submit('export', exports.xlsx_job, DATABASE, key='xlsx')
+    return jsonify(job.to_dict()), 202
 
-    # Экспорт в Excel
-    output = BytesIO()
-    with pd.ExcelWriter(output, engine='openpyxl') as writer:
-        df.to_excel(writer, index=False, sheet_name='Задачи')
-    output.seek(0)
+# Прогресс фоновой выгрузки
+@app.route('/api/export/<job_id>')
+@login_required
+def export_status(job_id):
+    job = export_jobs.get(job_id)
+    if not job:
+        return jsonify({'error': 'Задача не найдена'}), 404
+
+    data = job.to_dict()
+    if job.status == 'done':
+        data['download_url'] = url_for('export_download', job_id=job.id)
+    return jsonify(data)
+
+@app.route('/export/<job_id>/download')
+@login_required
+def export_download(job_id):
+    job = export_jobs.get(job_id)
+    if not job or job.status != 'done' or not os.path.exists(job.result):
+        flash('Выгрузка устарела, запустите экспорт ещё раз.', 'warning')
+        return redirect(url_for('index'))
+    return _send_xlsx(job.result)
 
+def _send_xlsx(path):
     return send_file(
-        output,
-        mimetype='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet',
+        path,
+        mimetype=XLSX_MIMETYPE,
         download_name='tasks_export.xlsx',
         as_attachment=True
     )
 
+# --- Импорт задач из CSV/XLSX (см. importer.py) ---
+
+# Загрузка сохраняется на диск потоково, разбор идёт в фоне — запрос не ждёт импорта
+MAX_IMPORT_BYTES = 200 * 1024 * 1024
+app.config['MAX_CONTENT_LENGTH'] = MAX_IMPORT_BYTES
+
+import_jobs = JobManager(max_workers=1)
+
+@app.route('/api/import', methods=['POST'])
+@login_required
+def start_import():
+    upload = request.files.get('file')
+    if not upload or not upload.filename:
+        return jsonify({'error': 'Файл не выбран'}), 400
+    extension = os.path.splitext(upload.filename)[1].lower()
+    if extension not in importer.SUPPORTED_EXTENSIONS:
+        return jsonify({'error': 'Поддерживаются только файлы .csv и .xlsx'}), 400
+
+    os.makedirs(importer.IMPORT_DIR, exist_ok=True)
+    source = os.path.join(importer.IMPORT_DIR, f'upload_{os.urandom(8).hex()}{extension}')
+    upload.save(source)
+    # Поле chat — все задачи файла достанутся этому чату; без него чат берётся из столбца "Чат",
+    # а строкам без чата достаётся чат администратора (нет и его — строка отклоняется)
+    job = import_jobs.submit('import', importer.import_job, source, upload.filename, DATABASE, _chat_arg(request.form),
+                             config.ADMIN_CHAT_ID)
+    return jsonify(job.to_dict()), 202
+
+# Прогресс импорта; по завершении — итоги и ссылка на отчёт об отклонённых строках
+@app.route('/api/import/<job_id>')
+@login_required
+def import_status(job_id):
+    job = import_jobs.get(job_id)
+    if not job:
+        return jsonify({'error': 'Задача не найдена'}), 404
+
+    data = job.to_dict()
+    if job.status == 'done':
+        data['result'] = {key: value for key, value in job.result.items() if key != 'report'}
+        if job.result['report']:
+            data['report_url'] = url_for('import_errors', job_id=job.id)
+    return jsonify(data)
+
+@app.route('/import/<job_id>/errors')
+@login_required
+def import_errors(job_id):
+    job = import_jobs.get(job_id)
+    if not job or job.status != 'done' or not job.result['report'] or not os.path.exists(job.result['report']):
+        flash('Отчёт об ошибках импорта не найден.', 'warning')
+        return redirect(url_for('index'))
+    return send_file(
+        job.result['report'],
+        mimetype='text/csv; charset=utf-8',
+        download_name='import_errors.csv',
+        as_attachment=True
+    )
+
 if __name__ == '__main__':
-    if not os.path.exists(DATABASE):
-        print("⚠️ База данных не найдена! Запустите сначала Telegram-бота (main.py), чтобы она создалась.")
-        exit(1)
+    # Схема та же, что у бота: недостающие миграции применяются при старте любого из процессов
+    migrations.migrate(DATABASE)
 
     print("🌐 Запускаю веб-интерфейс...")
     print("🔑 Логин: admin | Пароль: password123")